@@ -0,0 +1,404 @@
+# Offline end-to-end benchmark for Chatbot.process_input
+#
+# The Groq client, the Amadeus client and the fast_flights module are swapped for local stand-ins that replay
+# the recorded responses in fixtures.json with configurable latency and error injection, so every change to the
+# request path can be measured without API keys or network access.
+#
+#   python benchmarks/benchmark.py --sessions 16 --turns 6
+#   python benchmarks/benchmark.py --latency groq=0.3,amadeus=0.5,fast_flights=1.2 --errors amadeus=0.05 --stream
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from types import FunctionType, MethodType, ModuleType, SimpleNamespace
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+CHATBOT_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "chatbot")
+
+PROVIDERS = ["groq", "amadeus", "fast_flights"]
+DEFAULT_LATENCY = {"groq": 0.35, "amadeus": 0.6, "fast_flights": 1.5}
+PERCENTILES = (50, 90, 95, 99)
+
+
+class InjectedError(Exception):
+    """Transient upstream failure raised by a stub. Carries a status code so the scheduler treats it like a real 503."""
+
+    def __init__(self, provider:str, status_code:int = 503):
+        super().__init__(f"injected {provider} error ({status_code})")
+        self.status_code = status_code
+
+
+class Upstream():
+    """Latency and error model shared by the stubs, plus a count of every call they receive."""
+
+    def __init__(self, latency:dict, errors:dict, jitter:float = 0.25, token_delay:float = 0.002, seed:int = 0):
+        self.latency = latency
+        self.errors = errors
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.calls = Counter()
+        self.injected = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+
+    def call(self, provider:str):
+        """Count the call, sleep for a jittered latency and raise an injected error at the configured rate."""
+
+        with self._lock:
+            self.calls[provider] += 1
+            delay = self.latency.get(provider, 0) * self._random.lognormvariate(0, self.jitter)
+            fail = self._random.random() < self.errors.get(provider, 0)
+            if fail:
+                self.injected[provider] += 1
+        time.sleep(delay)
+        if fail:
+            raise InjectedError(provider)
+
+
+class StubGroq():
+    """Stands in for groq.Groq. Understanding calls get the query's recorded JSON, other calls its recorded answer."""
+
+    def __init__(self, upstream:Upstream, fixtures:dict):
+        self.upstream = upstream
+        self.fixtures = fixtures
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+
+    def create(self, model:str, messages:list, stream:bool = False, response_format = None, **options):
+        self.upstream.call("groq")
+        text = self._respond(messages, json_mode=response_format is not None)
+        pieces = re.findall(r"\S+\s*", text) or [text]
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1,
+                                completion_tokens=len(text) // 4 + 1)
+        if stream:
+            return self._stream(pieces, usage)
+
+        time.sleep(self.upstream.token_delay * len(pieces))
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+    def _stream(self, pieces:list[str], usage):
+        for i, piece in enumerate(pieces):
+            time.sleep(self.upstream.token_delay)
+            last = i == len(pieces) - 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))],
+                                  x_groq=SimpleNamespace(usage=usage if last else None))
+
+
+    def _respond(self, messages:list, json_mode:bool) -> str:
+        if json_mode:
+            prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+            query = self.fixtures["by_prompt"].get(prompt)
+            understanding = query["understanding"] if query else {"categories": ["general"], "flight": None, "hotel": None}
+            return json.dumps(understanding)
+
+        content = str(messages[-1].get("content", ""))
+        if content.startswith("Update the running summary"):
+            return self.fixtures["summary"]
+        for prompt, query in self.fixtures["by_prompt"].items():
+            if prompt in content and query.get("answer"):
+                return query["answer"]
+        return self.fixtures["by_prompt"]["what can you do?"]["answer"]
+
+
+class StubAmadeus():
+    """Stands in for amadeus.Client: every city has a stable list of hotel ids and roughly 60% of hotels have an offer."""
+
+    def __init__(self, upstream:Upstream, fixtures:dict):
+        self.upstream = upstream
+        self.template = fixtures["hotel_offer"]
+        self.reference_data = SimpleNamespace(locations=SimpleNamespace(hotels=SimpleNamespace(
+            by_city=SimpleNamespace(get=self.hotels_by_city))))
+        self.shopping = SimpleNamespace(hotel_offers_search=SimpleNamespace(get=self.hotel_offers))
+
+
+    def hotels_by_city(self, cityCode:str):
+        self.upstream.call("amadeus")
+        count = 60 + _stable(cityCode) % 240
+        return SimpleNamespace(data=[{"hotelId": f"{cityCode[:3]}{i:05d}", "name": f"{cityCode} Hotel {i}"} for i in range(count)])
+
+
+    def hotel_offers(self, hotelIds:list, checkInDate:str, checkOutDate:str, adults:int):
+        self.upstream.call("amadeus")
+        nights = max(1, (date.fromisoformat(checkOutDate) - date.fromisoformat(checkInDate)).days)
+        data = []
+        for hotel_id in hotelIds:
+            seed = _stable(f"{hotel_id}{checkInDate}{checkOutDate}")
+            if seed % 10 >= 6:
+                continue
+            per_night = 80 + seed % 320
+            hotel = json.loads(json.dumps(self.template))
+            hotel["hotel"].update(hotelId=hotel_id, name=f"Hotel {hotel_id}", cityCode=hotel_id[:3])
+            offer = hotel["offers"][0]
+            offer.update(id=f"{hotel_id}-{seed % 9973}", checkInDate=checkInDate, checkOutDate=checkOutDate, guests={"adults": adults})
+            offer["price"].update(base=f"{per_night * nights:.2f}", total=f"{per_night * nights * 1.12:.2f}")
+            offer["price"]["variations"]["average"]["base"] = f"{per_night:.2f}"
+            data.append(hotel)
+        return SimpleNamespace(data=data)
+
+
+class StubFlights():
+    """Stands in for fast_flights.get_flights, returning the recorded flights with prices varied per route and date."""
+
+    def __init__(self, upstream:Upstream, fixtures:dict):
+        self.upstream = upstream
+        self.flights = fixtures["flights"]
+
+
+    def __call__(self, flight_data:list, trip:str, seat:str, passengers, fetch_mode:str = "fallback"):
+        self.upstream.call("fast_flights")
+        leg = flight_data[0]
+        seed = _stable(f"{leg.from_airport}{leg.to_airport}{leg.date}{seat}")
+        flights = []
+        for i, flight in enumerate(self.flights):
+            price = int(flight["price"].strip("$")) + (seed >> i) % 120
+            flights.append(SimpleNamespace(**{**flight, "price": f"${price}"}))
+        return SimpleNamespace(current_price=["low", "typical", "high"][seed % 3], flights=flights)
+
+
+def load_fixtures(path:str) -> dict:
+    """Read the fixtures, turning relative dates like "+21d" into real dates from today."""
+
+    with open(path, encoding="utf-8") as file:
+        fixtures = _resolve_dates(json.load(file), date.today())
+    follow_ups = [query["followUp"] for query in fixtures["queries"] if query.get("followUp")]
+    fixtures["by_prompt"] = {query["prompt"]: query for query in fixtures["queries"] + follow_ups}
+    return fixtures
+
+
+def install_stubs(core, flights, upstream:Upstream, fixtures:dict):
+    """Point the shared client registry and the flight search at the stubs. fast_flights itself is replaced too,
+    so the benchmark never imports it and doesn't depend on the version installed."""
+
+    core.CLIENTS._groq = StubGroq(upstream, fixtures)
+    core.CLIENTS._amadeus = StubAmadeus(upstream, fixtures)
+    flights.get_flights = StubFlights(upstream, fixtures)
+    stub_module = SimpleNamespace(FlightData=SimpleNamespace, Passengers=SimpleNamespace, get_flights=flights.get_flights)
+    flights.load_fast_flights = core.load_fast_flights = lambda: stub_module
+
+
+def run_session(core, queries:list[dict], turns:int, stream:bool, rng:random.Random, follow_up:float = 0.0,
+                think:float = 0.0) -> tuple[list[dict], object]:
+    """One simulated user: a fresh Chatbot sending turns queries drawn from the weighted mix.
+    After a query with a followUp, the next turn is that follow-up with probability follow_up.
+    The user waits think seconds between turns."""
+
+    chatbot = core.Chatbot()
+    records = []
+    next_query = None
+    while len(records) < turns:
+        query = next_query or rng.choices(queries, weights=[q.get("weight", 1) for q in queries])[0]
+        next_query = query["followUp"] if query.get("followUp") and rng.random() < follow_up else None
+        if records:
+            time.sleep(think)
+        start = time.perf_counter()
+        first = None
+        if stream:
+            for _ in chatbot.process_input_stream(query["prompt"]):
+                if first is None:
+                    first = time.perf_counter() - start
+        else:
+            chatbot.process_input(query["prompt"])
+        records.append({"kind": query["kind"], "latency": time.perf_counter() - start, "first_event": first,
+                        "failed": "⚠️" in chatbot.last_response,
+                        "unfinished": "⏳" in chatbot.last_response or "🚫" in chatbot.last_response})
+    return records, chatbot
+
+
+def retained_size(obj, seen:set | None = None) -> int:
+    """Approximate bytes reachable from obj (dicts, sequences, __dict__ and __slots__), skipping code and modules
+    so shared singletons reached through methods aren't counted."""
+
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, (type, ModuleType, FunctionType, MethodType)) or callable(obj) and not hasattr(obj, "__dict__"):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(retained_size(k, seen) + retained_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        size += sum(retained_size(item, seen) for item in obj)
+    elif not isinstance(obj, (str, bytes, int, float, bool)):
+        if hasattr(obj, "__dict__"):
+            size += retained_size(vars(obj), seen)
+        for name in getattr(type(obj), "__slots__", ()):
+            size += retained_size(getattr(obj, name, None), seen)
+    return size
+
+
+def percentiles(values:list[float]) -> dict:
+    values = sorted(values)
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": values[min(len(values) - 1, int(p / 100 * len(values)))] for p in PERCENTILES}
+
+
+def report(args, records:list[dict], elapsed:float, upstream:Upstream, chatbots:list, core, tracing) -> dict:
+    """Collect the run's numbers into one dict."""
+
+    latencies = [r["latency"] for r in records]
+    by_kind = defaultdict(list)
+    for r in records:
+        by_kind[r["kind"]].append(r["latency"])
+
+    session_sizes = [retained_size(chatbot) for chatbot in chatbots]
+    snapshot = tracing.METRICS.snapshot()
+
+    result = {
+        "config": {"sessions": args.sessions, "turns": args.turns, "stream": args.stream, "seed": args.seed,
+                   "follow_up": args.follow_up, "think": args.think,
+                   "latency": upstream.latency, "errors": upstream.errors, "unlimited": args.unlimited},
+        "turns": len(records),
+        "elapsed": elapsed,
+        "throughput": len(records) / elapsed if elapsed else None,
+        "latency": {"mean": sum(latencies) / len(latencies), **percentiles(latencies), "max": max(latencies)},
+        "by_kind": {kind: {"count": len(values), **percentiles(values)} for kind, values in sorted(by_kind.items())},
+        "failed_turns": sum(r["failed"] for r in records),
+        "unfinished_turns": sum(r["unfinished"] for r in records),
+        "upstream_calls": {provider: upstream.calls[provider] for provider in PROVIDERS},
+        "injected_errors": {provider: upstream.injected[provider] for provider in PROVIDERS},
+        "retries": {provider: stats["retries"] for provider, stats in core.SCHEDULER.stats().items()},
+        "merged": {provider: in_flight.stats()["merged"] for provider, in_flight in core.IN_FLIGHT.items()},
+        "prefetch": core.PREFETCHER.stats(),
+        "circuit_opened": {provider: snapshot["counters"].get(f'circuit_opened_total{{provider="{provider}"}}', 0) for provider in PROVIDERS},
+        "caches": snapshot["caches"],
+        "stages": snapshot["stages"],
+        "memory_per_session": {"mean": sum(session_sizes) / len(session_sizes), "max": max(session_sizes)},
+    }
+    if args.stream:
+        result["first_event"] = percentiles([r["first_event"] for r in records if r["first_event"] is not None])
+    return result
+
+
+def print_report(result:dict):
+    ms = lambda seconds: "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+    config = result["config"]
+    print(f"\n{config['sessions']} sessions x {config['turns']} turns, stream={config['stream']}, seed={config['seed']}")
+    print(f"latency model: {config['latency']}, error rates: {config['errors']}")
+    print("=" * 72)
+    print(f"turns: {result['turns']} in {result['elapsed']:.2f}s -> {result['throughput']:.2f} turns/s, "
+          f"{result['failed_turns']} with an error section, {result['unfinished_turns']} still searching or unavailable")
+
+    latency = result["latency"]
+    print("turn latency: " + ", ".join(f"{key}={ms(value)}" for key, value in latency.items()))
+    if "first_event" in result:
+        print("first event:  " + ", ".join(f"{key}={ms(value)}" for key, value in result["first_event"].items()))
+
+    print("\nby query kind:")
+    for kind, stats in result["by_kind"].items():
+        print(f"  {kind:<16} n={stats['count']:<4} p50={ms(stats['p50'])}  p95={ms(stats['p95'])}")
+
+    print("\nupstream calls (injected errors / scheduler retries), and identical calls merged into one in flight:")
+    for provider, calls in result["upstream_calls"].items():
+        print(f"  {provider:<14} {calls:>5}  ({result['injected_errors'][provider]} / {result['retries'].get(provider, 0)})"
+              f"  {calls / result['turns']:.2f} per turn, {result['merged'].get(provider, 0)} merged"
+              + (f", circuit opened {result['circuit_opened'][provider]}x" if result["circuit_opened"][provider] else ""))
+
+    prefetch = result["prefetch"]
+    print(f"\nprefetch: {prefetch['prefetched']} prefetched ({prefetch['skipped']} over budget, {prefetch['failed']} failed), "
+          f"{prefetch['hits']} hits and {prefetch['late']} still running of {prefetch['hits'] + prefetch['misses']} hotel searches "
+          f"-> hit rate {prefetch['hit_rate']:.0%}, {prefetch['used_rate']:.0%} of finished prefetches used")
+
+    print("\ncaches:")
+    for name, stats in result["caches"].items():
+        print(f"  {name:<18} hit rate {stats['hit_rate']:.0%} ({stats['hits']} hits, {stats['misses']} misses)")
+
+    print("\nstages:")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"  {stage:<26} n={stats['count']:<5} p50={ms(stats['p50'])}  p95={ms(stats['p95'])}  p99={ms(stats['p99'])}")
+
+    memory = result["memory_per_session"]
+    print(f"\nretained memory per session: mean {memory['mean'] / 1024:.1f} KiB, max {memory['max'] / 1024:.1f} KiB\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of Chatbot.process_input with stubbed upstream APIs.")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--latency", type=_provider_values, default={}, help="median latency in seconds, e.g. groq=0.3,amadeus=0.5")
+    parser.add_argument("--errors", type=_provider_values, default={}, help="error rate per call, e.g. amadeus=0.05,fast_flights=0.1")
+    parser.add_argument("--jitter", type=float, default=0.25, help="sigma of the lognormal latency jitter")
+    parser.add_argument("--token-ms", type=float, default=2.0, help="milliseconds per generated LLM token")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiply every simulated delay, e.g. 0.1 for a quick run")
+    parser.add_argument("--follow-up", type=float, default=0.5, help="chance a query with a followUp in the fixtures is followed by it")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each simulated user waits between turns")
+    parser.add_argument("--stream", action="store_true", help="use process_input_stream and report time to first event")
+    parser.add_argument("--unlimited", action="store_true", help="lift the scheduler's per-provider rate limits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", default=os.path.join(BENCHMARK_DIR, "fixtures.json"))
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    # Configuration is read when core is imported: no persistent caches, quiet logs, optionally no rate limits
+    for name in ("NAVIBLU_CACHE_DB", "NAVIBLU_HOTEL_INDEX_DB", "NAVIBLU_INTENT_LOG", "NAVIBLU_METRICS_PORT"):
+        os.environ.pop(name, None)
+    os.environ.setdefault("NAVIBLU_LOG_LEVEL", "ERROR")
+    if args.unlimited:
+        for provider in ("GROQ", "AMADEUS", "FLIGHTS"):
+            os.environ[f"NAVIBLU_{provider}_RATE"] = os.environ[f"NAVIBLU_{provider}_BURST"] = "100000"
+
+    sys.path.insert(0, CHATBOT_DIR)
+    import core
+    import flights
+    import tracing
+
+    latency = {provider: (args.latency.get(provider, DEFAULT_LATENCY[provider])) * args.time_scale for provider in PROVIDERS}
+    errors = {provider: args.errors.get(provider, 0.0) for provider in PROVIDERS}
+    upstream = Upstream(latency, errors, jitter=args.jitter, token_delay=args.token_ms / 1000 * args.time_scale, seed=args.seed)
+    fixtures = load_fixtures(args.fixtures)
+    install_stubs(core, flights, upstream, fixtures)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(run_session, core, fixtures["queries"], args.turns, args.stream, random.Random(args.seed * 1000 + i),
+                               args.follow_up, args.think * args.time_scale)
+                   for i in range(args.sessions)]
+        sessions = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    records = [record for session_records, _ in sessions for record in session_records]
+    result = report(args, records, elapsed, upstream, [chatbot for _, chatbot in sessions], core, tracing)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2, default=str)
+
+
+def _provider_values(text:str) -> dict:
+    values = {}
+    for item in filter(None, text.split(",")):
+        provider, _, value = item.partition("=")
+        if provider not in PROVIDERS:
+            raise argparse.ArgumentTypeError(f"unknown provider {provider!r}, expected one of {', '.join(PROVIDERS)}")
+        values[provider] = float(value)
+    return values
+
+
+def _resolve_dates(value, today:date):
+    if isinstance(value, dict):
+        return {key: _resolve_dates(item, today) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_dates(item, today) for item in value]
+    if isinstance(value, str) and re.fullmatch(r"\+\d+d", value):
+        return (today + timedelta(days=int(value[1:-1]))).isoformat()
+    return value
+
+
+def _stable(text:str) -> int:
+    """Deterministic hash, unlike hash() which is salted per process."""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Cold-start benchmark: how long a fresh process takes to import the chatbot and answer its first session
+#
+# Every run is a new interpreter, so nothing is already imported or built. Each run is measured cold and again
+# after core.warm_up(), the hook the Docker image runs at container start. Upstream APIs are the stubs from
+# benchmark.py with no latency and no rate limits, so only the process's own work is measured.
+#
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --runs 5 --json startup.json
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+CHATBOT_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "chatbot")
+
+PHASES = ["process", "import", "warm_up", "first_session", "sdk_first_use", "second_session"]
+
+
+def child(mode:str, kind:str) -> dict:
+    """One measured start, run in a fresh interpreter: import core, optionally warm up, then two sessions."""
+
+    timings = {}
+    for name in ("NAVIBLU_CACHE_DB", "NAVIBLU_HOTEL_INDEX_DB", "NAVIBLU_INTENT_LOG", "NAVIBLU_METRICS_PORT"):
+        os.environ.pop(name, None)
+    os.environ.setdefault("NAVIBLU_LOG_LEVEL", "ERROR")
+    # Rate limits would only add waiting to the first session, not process work
+    for provider in ("GROQ", "AMADEUS", "FLIGHTS"):
+        os.environ[f"NAVIBLU_{provider}_RATE"] = os.environ[f"NAVIBLU_{provider}_BURST"] = "100000"
+    sys.path.insert(0, CHATBOT_DIR)
+
+    start = time.perf_counter()
+    import core
+    import flights
+    timings["import"] = time.perf_counter() - start
+
+    import benchmark
+    fixtures = benchmark.load_fixtures(os.path.join(BENCHMARK_DIR, "fixtures.json"))
+    upstream = benchmark.Upstream({}, {}, token_delay=0)
+    prompt = next(query["prompt"] for query in fixtures["queries"] if query["kind"] == kind)
+
+    if mode == "warm":
+        start = time.perf_counter()
+        core.warm_up()
+        timings["warm_up"] = time.perf_counter() - start
+
+    # The stubs take the place of the clients, so the SDKs a real first request would import are timed separately
+    benchmark.install_stubs(core, flights, upstream, fixtures)
+    for phase in ("first_session", "second_session"):
+        start = time.perf_counter()
+        core.Chatbot().process_input(prompt)
+        timings[phase] = time.perf_counter() - start
+        if phase == "first_session":
+            timings["sdk_first_use"] = sum(core.CLIENTS.preload().values())
+    return timings
+
+
+def measure(mode:str, kind:str) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, "--kind", kind],
+                            capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and first-session time of a fresh chatbot process, cold and warmed up.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--kind", default="full-trip", help="query kind from fixtures.json answered by each session")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.kind)))
+        return
+
+    runs = {mode: [measure(mode, args.kind) for _ in range(args.runs)] for mode in ("cold", "warm")}
+    result = {mode: {phase: statistics.median(run[phase] for run in mode_runs) if phase in mode_runs[0] else None
+                     for phase in PHASES}
+              for mode, mode_runs in runs.items()}
+    for mode_result in result.values():
+        mode_result["first_turn"] = mode_result["first_session"] + mode_result["sdk_first_use"]
+
+    print(f"\nmedian of {args.runs} fresh processes, first session answers a {args.kind!r} query")
+    print("=" * 60)
+    print(f"  {'':<32} {'cold':>10} {'warmed up':>12}")
+    labels = {
+        "process": "whole process",
+        "import": "import core",
+        "warm_up": "warm_up()",
+        "first_session": "first session",
+        "sdk_first_use": "  + SDK imports on first use",
+        "first_turn": "first turn total",
+        "second_session": "second session",
+    }
+    for phase, label in labels.items():
+        cells = ["-" if result[mode][phase] is None else f"{result[mode][phase] * 1000:.0f}ms" for mode in ("cold", "warm")]
+        print(f"  {label:<32} {cells[0]:>10} {cells[1]:>12}")
+    print()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"runs": runs, "median": result}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
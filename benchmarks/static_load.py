@@ -0,0 +1,172 @@
+# Load test for the static website: requests per second and time to first byte under concurrent clients
+#
+# Each simulated client keeps one connection open and loads the page the way a browser does: index.html, then the
+# CSS, JS and images it uses. --repeat-visits sends the validators from the first load (If-None-Match), like a
+# returning visitor whose browser revalidates its cache.
+#
+#   python static_server.py --port 8080 &
+#   python benchmarks/static_load.py --url http://localhost:8080 --clients 32 --duration 10
+#   python benchmarks/static_load.py --url http://localhost:8080 --clients 32 --repeat-visits --json static.json
+
+import argparse
+import http.client
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urljoin, urlsplit
+
+PERCENTILES = (50, 90, 95, 99)
+ASSET_REFERENCE = re.compile(r'\b(?:src|href)="([^":#]+\.(?:css|js|png|jpe?g|webp|gif|svg|ico)(?:\?[^"]*)?)"')
+SLIDE_COUNT = 10 # images/travel-<n>.jpg, added to the page by scripts.js
+
+
+def page_assets(base:str) -> list[str]:
+    """Paths a browser requests to render the page: the page itself, what it references and the slideshow images."""
+
+    url = urlsplit(base)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    connection.request("GET", "/", headers={"Accept-Encoding": "identity"})
+    body = connection.getresponse().read()
+    connection.close()
+
+    html = body.decode("utf-8")
+    paths = ["/"] + [urlsplit(urljoin(base + "/", reference)).path + _query(reference) for reference in ASSET_REFERENCE.findall(html)]
+    paths += [f"/images/travel-{i}.jpg" for i in range(1, SLIDE_COUNT + 1)]
+    return list(dict.fromkeys(paths))
+
+
+def _query(reference:str) -> str:
+    return "?" + reference.split("?", 1)[1] if "?" in reference else ""
+
+
+class Client(threading.Thread):
+    """One simulated visitor loading the page over a keep-alive connection until the test ends."""
+
+    def __init__(self, base:str, paths:list[str], encoding:str, repeat:bool, stop_at:float):
+        super().__init__(daemon=True)
+        self.url = urlsplit(base)
+        self.paths = paths
+        self.encoding = encoding
+        self.repeat = repeat
+        self.stop_at = stop_at
+        self.records = [] # (path, status, time to first byte, total time, bytes)
+        self.errors = Counter()
+        self.validators = {}
+
+
+    def run(self):
+        connection = None
+        while time.perf_counter() < self.stop_at:
+            for path in self.paths:
+                if time.perf_counter() >= self.stop_at:
+                    break
+                if connection is None:
+                    connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+                headers = {"Accept-Encoding": self.encoding}
+                if self.repeat and path in self.validators:
+                    headers["If-None-Match"] = self.validators[path]
+                start = time.perf_counter()
+                try:
+                    connection.request("GET", path, headers=headers)
+                    response = connection.getresponse()
+                    first_byte = time.perf_counter() - start
+                    body = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    self.errors[type(e).__name__] += 1
+                    connection.close()
+                    connection = None
+                    continue
+                self.records.append((path, response.status, first_byte, time.perf_counter() - start, len(body)))
+                if response.getheader("ETag"):
+                    self.validators[path] = response.getheader("ETag")
+                if response.will_close:
+                    connection.close()
+                    connection = None
+        if connection is not None:
+            connection.close()
+
+
+def percentiles(values:list[float]) -> dict:
+    values = sorted(values)
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": values[min(len(values) - 1, int(p / 100 * len(values)))] for p in PERCENTILES}
+
+
+def run(base:str, clients:int, duration:float, encoding:str, repeat:bool) -> dict:
+    paths = page_assets(base)
+    start = time.perf_counter()
+    threads = [Client(base, paths, encoding, repeat, start + duration) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    records = [record for thread in threads for record in thread.records]
+    errors = sum((thread.errors for thread in threads), Counter())
+    by_kind = defaultdict(list)
+    for path, _, first_byte, _, _ in records:
+        by_kind[_kind(path)].append(first_byte)
+
+    return {
+        "config": {"url": base, "clients": clients, "duration": duration, "encoding": encoding, "repeat_visits": repeat},
+        "requests": len(records),
+        "elapsed": elapsed,
+        "requests_per_second": len(records) / elapsed,
+        "page_loads_per_second": len(records) / len(paths) / elapsed,
+        "megabytes_per_second": sum(record[4] for record in records) / elapsed / 1e6,
+        "status": dict(Counter(record[1] for record in records)),
+        "errors": dict(errors),
+        "ttfb": percentiles([record[2] for record in records]),
+        "total": percentiles([record[3] for record in records]),
+        "ttfb_by_kind": {kind: {"count": len(values), **percentiles(values)} for kind, values in sorted(by_kind.items())},
+    }
+
+
+def _kind(path:str) -> str:
+    path = path.split("?", 1)[0]
+    if path == "/" or path.endswith(".html"):
+        return "html"
+    return path.rsplit(".", 1)[-1]
+
+
+def print_report(result:dict):
+    ms = lambda seconds: "-" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+    config = result["config"]
+    print(f"\n{config['clients']} clients for {config['duration']:.0f}s against {config['url']}, "
+          f"Accept-Encoding: {config['encoding'] or '(none)'}, repeat visits: {config['repeat_visits']}")
+    print("=" * 72)
+    print(f"requests: {result['requests']} -> {result['requests_per_second']:.0f} req/s, "
+          f"{result['page_loads_per_second']:.1f} page loads/s, {result['megabytes_per_second']:.1f} MB/s")
+    print(f"status: {result['status']}" + (f", connection errors: {result['errors']}" if result["errors"] else ""))
+    print("time to first byte: " + ", ".join(f"{key}={ms(value)}" for key, value in result["ttfb"].items()))
+    print("full response:      " + ", ".join(f"{key}={ms(value)}" for key, value in result["total"].items()))
+    print("\ntime to first byte by asset type:")
+    for kind, stats in result["ttfb_by_kind"].items():
+        print(f"  {kind:<6} n={stats['count']:<6} p50={ms(stats['p50'])}  p95={ms(stats['p95'])}  p99={ms(stats['p99'])}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second and time to first byte of the static website server.")
+    parser.add_argument("--url", default="http://localhost:8000", help="base URL of the running server")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--encoding", default="br, gzip", help="Accept-Encoding header sent with every request")
+    parser.add_argument("--repeat-visits", action="store_true", help="revalidate with If-None-Match after the first load")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    result = run(args.url.rstrip("/"), args.clients, args.duration, args.encoding, args.repeat_visits)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
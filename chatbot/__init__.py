@@ -4,6 +4,13 @@ NaviBlu Travel Assistant - Chatbot Module
 This module contains the core chatbot logic and Streamlit UI.
 """
 
+import os
+import sys
+
+# The chatbot folder is deployed on its own to the HF Space, so its modules import each other
+# by plain name (e.g. `from executor import AgentExecutor`). Make that work when imported as a package too.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 from .core import Chatbot
 
 __all__ = ['Chatbot']
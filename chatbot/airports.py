@@ -0,0 +1,476 @@
+# Offline IATA airport and city index, so location codes can be checked and resolved without a network call
+
+import gzip
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "airports.tsv.gz")
+
+# Major place names that are also everyday words only count as a mention when capitalized, like "Nice" but not "nice hotels"
+COMMON_WORDS = {"nice", "split", "male", "la", "dc", "rio", "cabo"}
+
+# Added to the fuzzy-match score of places with a major airport when ranking misspellings
+MAJOR_BOOST = 0.15
+
+# Generic words dropped from airport names, so "JFK International Airport" and "John F Kennedy" both index well
+AIRPORT_WORDS = re.compile(r"\b(international|intl|airport|airfield|airpark|regional|municipal)\b")
+
+# Where a route phrase ends: "from Charlotte to Boston on May 3" or "to Boston next week"
+ROUTE_END = r"(?=\s+(?:on|in|for|next|this|at|around|between|and|with|departing|leaving|returning|from|by|during|\d)\b|\s*$)"
+ROUTE_PATTERN = re.compile(rf"\bfrom\s+(?P<origin>[a-z ]+?)\s+to\s+(?P<destination>[a-z ]+?){ROUTE_END}")
+
+
+@dataclass(frozen=True)
+class Airport():
+    """One row of the bundled dataset."""
+    code: str
+    city_code: str
+    city: str
+    country: str
+    lat: float | None
+    lon: float | None
+    major: bool
+    name: str
+
+
+@dataclass(frozen=True)
+class Place():
+    """A name resolved to an airport or a city code."""
+    code: str
+    kind: str # "airport" or "city"
+    name: str
+    score: float = 1.0
+
+
+class PrefixTrie():
+    """Radix trie from normalized names to lists of values.
+    Edges hold whole substrings, so the ~8k city names take a few thousand nodes instead of one per character."""
+
+    def __init__(self):
+        self.root = {} # first character -> (edge label, child node); the None key holds a node's values
+        self.size = 0
+
+
+    def insert(self, key:str, value):
+        node = self.root
+        while key:
+            edge = node.get(key[0])
+            if edge is None:
+                node[key[0]] = (key, {None: [value]})
+                self.size += 1
+                return
+            label, child = edge
+            common = _common_prefix(label, key)
+            if common < len(label):
+                # Split the edge where the new key diverges from it
+                child = {label[common]: (label[common:], child)}
+                node[key[0]] = (label[:common], child)
+            node, key = child, key[common:]
+        if value not in node.setdefault(None, []):
+            node[None].append(value)
+            self.size += 1
+
+
+    def get(self, key:str) -> list:
+        node, rest = self._walk(key)
+        return node.get(None, []) if node is not None and not rest else []
+
+
+    def complete(self, prefix:str, limit:int = 10) -> list[tuple[str, list]]:
+        """Up to limit (name, values) pairs whose name starts with prefix, in alphabetical order."""
+
+        node, rest = self._walk(prefix)
+        if node is None:
+            return []
+        results = []
+        self._collect(node, prefix + rest, results, limit)
+        return results
+
+
+    def longest_match(self, text:str, start:int) -> tuple[int, list] | None:
+        """The longest key that appears in text at start and ends at a word boundary, as (end, values)."""
+
+        node, pos, best = self.root, start, None
+        while True:
+            if None in node and pos > start and (pos == len(text) or text[pos] == " "):
+                best = (pos, node[None])
+            if pos >= len(text) or text[pos] not in node:
+                return best
+            label, child = node[text[pos]]
+            if not text.startswith(label, pos):
+                return best
+            node, pos = child, pos + len(label)
+
+
+    def _walk(self, key:str):
+        """Follow key down the trie. Returns (node, rest) where rest is the part of the last edge past the key."""
+
+        node = self.root
+        while key:
+            edge = node.get(key[0])
+            if edge is None:
+                return None, ""
+            label, child = edge
+            if key.startswith(label):
+                node, key = child, key[len(label):]
+            elif label.startswith(key):
+                return child, label[len(key):]
+            else:
+                return None, ""
+        return node, ""
+
+
+    def _collect(self, node:dict, name:str, results:list, limit:int):
+        if len(results) >= limit:
+            return
+        if None in node:
+            results.append((name, node[None]))
+        for first in sorted(key for key in node if key is not None):
+            label, child = node[first]
+            self._collect(child, name + label, results, limit)
+
+
+class TrigramIndex():
+    """Fuzzy name lookup: names sharing the most character trigrams with the query, scored by Dice similarity."""
+
+    def __init__(self):
+        self.postings = defaultdict(list) # trigram -> ids of the names containing it
+        self.entries = [] # id -> (name, trigram count, value)
+
+
+    def add(self, name:str, value):
+        grams = trigrams(name)
+        entry_id = len(self.entries)
+        self.entries.append((name, len(grams), value))
+        for gram in grams:
+            self.postings[gram].append(entry_id)
+
+
+    def search(self, query:str, limit:int = 5, min_score:float = 0.5) -> list[tuple[float, str, object]]:
+        """Up to limit (score, name, value) matches scoring at least min_score, best first."""
+
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        matches = []
+        for entry_id, count in shared.items():
+            name, size, value = self.entries[entry_id]
+            score = 2 * count / (len(grams) + size)
+            if score >= min_score:
+                matches.append((score, name, value))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches[0:limit]
+
+
+class AirportIndex():
+    """In-memory index over the bundled airport dataset.
+
+    Code checks are dictionary lookups. Names go through a radix trie for exact and prefix matches and a trigram
+    index for misspellings. Airports map to their metro city code (JFK → NYC) and city codes to their primary
+    airport (NYC → JFK). The name indexes are built on first use, so code checks don't pay for them."""
+
+    def __init__(self, airports:list[Airport], city_aliases:dict | None = None, airport_aliases:dict | None = None):
+        self.airports = {airport.code: airport for airport in airports}
+        self.cities = defaultdict(list) # city code -> airport codes, primary airport first
+        for airport in airports:
+            self.cities[airport.city_code].append(airport.code)
+        self.cities = dict(self.cities)
+        self.city_aliases = city_aliases or {}
+        self.airport_aliases = airport_aliases or {}
+        self.majors = [airport for airport in airports if airport.major and airport.lat is not None]
+
+        self._trie = None
+        self._fuzzy = None
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def load(cls, path:str = DATA_PATH):
+        """Read the gzipped TSV written by data/build_airports.py."""
+
+        airports, city_aliases, airport_aliases = [], {}, {}
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            next(file) # header
+            for line in file:
+                code, city_code, city, country, lat, lon, major, name, cities, names = line.rstrip("\n").split("\t")
+                airports.append(Airport(code, city_code, city, country, float(lat) if lat else None,
+                                        float(lon) if lon else None, major == "1", name))
+                if cities:
+                    city_aliases.setdefault(city_code, []).extend(cities.split("|"))
+                if names:
+                    airport_aliases[code] = names.split("|")
+        return cls(airports, city_aliases, airport_aliases)
+
+
+    def __len__(self):
+        return len(self.airports)
+
+
+    def airport(self, code) -> Airport | None:
+        return self.airports.get(_code(code))
+
+
+    def is_airport(self, code) -> bool:
+        return _code(code) in self.airports
+
+
+    def is_city(self, code) -> bool:
+        return _code(code) in self.cities
+
+
+    def metro(self, code) -> str | None:
+        """City code an airport belongs to (JFK → NYC)."""
+        airport = self.airport(code)
+        return airport.city_code if airport else None
+
+
+    def primary_airport(self, city_code) -> str | None:
+        """Main airport of a city code (NYC → JFK): the first major airport listed for it, otherwise the first listed."""
+
+        codes = self.cities.get(_code(city_code))
+        if not codes:
+            return None
+        return next((code for code in codes if self.airports[code].major), codes[0])
+
+
+    def airport_code(self, code) -> str | None:
+        """Airport code to search flights with, or None if code is neither a known airport nor a known city.
+        City codes resolve to their primary airport unless the code is also a major airport itself (SHA)."""
+
+        code = _code(code)
+        airport = self.airports.get(code)
+        if code in self.cities and (airport is None or not airport.major):
+            primary = self.primary_airport(code)
+            if primary != code and (airport is None or self.airports[primary].major):
+                return primary
+        return code if airport is not None else None
+
+
+    def city_code(self, code) -> str | None:
+        """City code to search hotels with (JFK → NYC), or None if code isn't known."""
+
+        code = _code(code)
+        if code in self.cities:
+            return code
+        return self.metro(code)
+
+
+    def airports_in(self, city_code) -> list[Airport]:
+        return [self.airports[code] for code in self.cities.get(_code(city_code), [])]
+
+
+    def nearby(self, code, radius_km:float = 250, limit:int = 3) -> list[Airport]:
+        """Airports to search for "near X": the airport itself (or a city's primary airport), then the closest
+        major airports within radius_km, its own city's first. Small fields without scheduled service are skipped."""
+
+        home = self.airport(self.airport_code(code))
+        if home is None:
+            return []
+        if home.lat is None:
+            return [home]
+        distances = [(distance_km(home, airport), airport) for airport in self.majors if airport.code != home.code]
+        ranked = sorted((airport.city_code != home.city_code, distance, airport.code, airport)
+                        for distance, airport in distances if distance <= radius_km)
+        return [home] + [airport for _, _, _, airport in ranked][0:max(0, limit - 1)]
+
+
+    def lookup(self, name:str, limit:int = 5) -> list[Place]:
+        """Places matching a name: exact name or alias matches first, then close misspellings."""
+
+        key = _key(name)
+        if not key:
+            return []
+        exact = self._rank(self.trie.get(key))
+        if exact:
+            return exact[0:limit]
+        matches = {}
+        for score, _, place in self.fuzzy.search(key, limit=limit * 4):
+            if place.code not in matches:
+                matches[place.code] = Place(place.code, place.kind, place.name, round(score, 3))
+        # A small boost for major places, so "tokio" finds Tokyo rather than Tok, Alaska
+        return sorted(matches.values(), key=lambda place: (-place.score - MAJOR_BOOST * self._major(place), place.kind != "city"))[0:limit]
+
+
+    def resolve(self, text:str) -> Place | None:
+        """Best place for a code or a name, or None."""
+
+        code = _code(text)
+        if code in self.cities:
+            return Place(code, "city", self.airports[self.cities[code][0]].city)
+        if code in self.airports:
+            return Place(code, "airport", self.airports[code].name)
+        matches = self.lookup(text, limit=1)
+        return matches[0] if matches else None
+
+
+    def complete(self, prefix:str, limit:int = 10) -> list[Place]:
+        """Places whose name starts with prefix, for autocompletion."""
+        return [place for _, places in self.trie.complete(_key(prefix), limit) for place in self._rank(places)[0:1]]
+
+
+    def mentions(self, text:str) -> list[Place]:
+        """Places named in free text, in the order they appear. Uppercase three-letter tokens count as codes."""
+        return [place for _, _, place in self.spans(text)]
+
+
+    def spans(self, text:str) -> list[tuple[int, int, Place]]:
+        """Like mentions, but as (start, end, place) so callers can replace the names in the text."""
+
+        normalized = normalize(text)
+        found = []
+        pos = 0
+        while pos < len(normalized):
+            if normalized[pos] != " " and (pos == 0 or normalized[pos - 1] == " "):
+                match = self.trie.longest_match(normalized, pos)
+                if match is not None:
+                    end, places = match
+                    place, capitalized = self._rank(places)[0], text[pos:pos + 1].isupper()
+                    # Minor places and everyday words need a capital letter to count, so "hope" or "nice" in passing don't
+                    if capitalized or self._major(place) and normalized[pos:end] not in COMMON_WORDS:
+                        found.append((pos, end, place))
+                        pos = end
+                        continue
+                token = text[pos:pos + 3]
+                if len(token) == 3 and token.isupper() and token.isalpha() and (pos + 3 == len(text) or not text[pos + 3].isalnum()):
+                    place = self.resolve(token)
+                    if place is not None:
+                        found.append((pos, pos + 3, place))
+            pos += 1
+        return found
+
+
+    def route(self, text:str) -> tuple[Place | None, Place | None]:
+        """Origin and destination from a "from X to Y" phrase, resolved locally."""
+
+        origins, destinations = self.route_candidates(text)
+        return (origins[0] if origins else None), (destinations[0] if destinations else None)
+
+
+    def route_candidates(self, text:str) -> tuple[list[Place], list[Place]]:
+        """Like route, but every place each phrase could name, best first, so callers can tell whether
+        "San Jose" means one city or several."""
+
+        match = ROUTE_PATTERN.search(_key(text))
+        if match is None:
+            return [], []
+        return self._phrase(match["origin"]), self._phrase(match["destination"])
+
+
+    def warm(self):
+        """Build the name indexes now instead of on the first name lookup."""
+        self._build()
+
+
+    @property
+    def trie(self) -> PrefixTrie:
+        if self._trie is None:
+            self._build()
+        return self._trie # type: ignore
+
+
+    @property
+    def fuzzy(self) -> TrigramIndex:
+        if self._fuzzy is None:
+            self._build()
+        return self._fuzzy # type: ignore
+
+
+    def _build(self):
+        with self._lock:
+            if self._trie is not None:
+                return
+            trie, fuzzy = PrefixTrie(), TrigramIndex()
+            for city_code, codes in self.cities.items():
+                place = Place(city_code, "city", self.airports[codes[0]].city)
+                for name in [place.name] + self.city_aliases.get(city_code, []):
+                    trie.insert(_key(name), place)
+                    fuzzy.add(_key(name), place)
+            for airport in self.airports.values():
+                place = Place(airport.code, "airport", airport.name)
+                names = [airport.name, AIRPORT_WORDS.sub(" ", airport.name.lower())] + self.airport_aliases.get(airport.code, [])
+                for name in dict.fromkeys(filter(None, map(_key, names))):
+                    trie.insert(name, place)
+                    # Misspelled airport names are only worth matching for the major airports
+                    if airport.major:
+                        fuzzy.add(name, place)
+            self._fuzzy = fuzzy
+            self._trie = trie
+
+
+    def _rank(self, places:list[Place]) -> list[Place]:
+        """Best first: higher score, then places with a major airport, then cities before airports."""
+
+        return sorted(places, key=lambda place: (-place.score, not self._major(place), place.kind != "city"))
+
+
+    def _major(self, place:Place) -> bool:
+        if place.kind == "airport":
+            return self.airports[place.code].major
+        return any(self.airports[code].major for code in self.cities.get(place.code, []))
+
+
+    def _phrase(self, phrase:str) -> list[Place]:
+        """Resolve a route phrase such as "new york city" or "barcelonna", trimming trailing words that don't help.
+        Returns the places the longest phrase that matches anything could name, best first."""
+
+        words = phrase.split()
+        while words:
+            matches = self.lookup(" ".join(words))
+            if matches and matches[0].score >= 0.6:
+                return [place for place in matches if place.score >= 0.6]
+            words.pop()
+        return []
+
+
+def distance_km(a:Airport, b:Airport) -> float:
+    """Great-circle distance between two airports."""
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (a.lat, a.lon, b.lat, b.lon)) # type: ignore
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+
+def normalize(text:str) -> str:
+    """Lowercase, strip accents and turn punctuation into spaces, keeping one character per input character
+    so positions still line up with the original text."""
+
+    text = str(text)
+    if text.isascii():
+        return text.lower().translate(_ASCII_PUNCTUATION)
+    chars = []
+    for ch in text:
+        base = unicodedata.normalize("NFKD", ch)[0:1] or " "
+        chars.append(base.lower()[0] if base.isalnum() else " ")
+    return "".join(chars)
+
+
+_ASCII_PUNCTUATION = str.maketrans({chr(i): " " for i in range(128) if not chr(i).isalnum()})
+
+
+def trigrams(text:str) -> list[str]:
+    padded = f"  {text} "
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+def _key(text) -> str:
+    return " ".join(normalize(text).split())
+
+
+def _code(code) -> str:
+    return str(code or "").strip().upper()
+
+
+def _common_prefix(a:str, b:str) -> int:
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    return i
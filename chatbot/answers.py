@@ -0,0 +1,191 @@
+# Semantic cache for LLM answers that only depend on the prompt (the location and general info agents)
+
+import re
+import threading
+import zlib
+from difflib import SequenceMatcher
+import numpy as np
+from airports import normalize
+from cache import TTLCache
+
+# Words that don't change what is being asked. Question words like "how" and "where" are kept, and so are words that
+# can name a place ("us" as in the US), since the answer depends on them.
+STOP_WORDS = frozenset("""
+a an the and or but of in on at to for from with about into by as is are was were be been am it its this that these those
+i me my we our you your please can could would will should may might tell give show know let lets want like need just
+really some any what whats which u ur
+""".split())
+
+# Keys with fewer words than this need a closer near-duplicate, and words of at least TYPO_MIN_CHARS characters
+# this similar count as the same word
+SHORT_KEY_WORDS = 4
+SHORT_KEY_SIMILARITY = 0.95
+TYPO_MIN_CHARS = 5
+TYPO_SIMILARITY = 0.85
+
+# Prompts whose answer changes from day to day are never cached
+VOLATILE = re.compile(r"\b(today|tonight|tomorrow|yesterday|now|right now|current|currently|latest|this (week|weekend|month)|weather|news)\b")
+
+
+class AnswerCache():
+    """Cache of LLM answers keyed on a normalized prompt, with near-duplicate matching.
+
+    The key is the prompt lowercased, without punctuation or stop words, with place names replaced by their
+    IATA city code (so "NYC" and "new york" agree) and the remaining words sorted. A prompt whose key isn't
+    cached can still hit a cached entry whose hashed word and character n-gram vector has a cosine similarity
+    of at least `similarity` (more for short keys, where one word moves it less), that names the same places,
+    and whose words are the prompt's words up to typos: every word of either key has to appear in the other,
+    so "visa japan india" never gets the answer cached for "visa japan us" or for plain "visa japan".
+    Set similarity to 1 to only allow exact keys.
+
+    Answers are stored in a TTLCache, so they expire after ttl seconds, the least recently used are evicted
+    past maxsize, and they can be persisted to SQLite."""
+
+    def __init__(self, ttl:float, maxsize:int = 1024, similarity:float = 0.85, sqlite_path:str | None = None,
+                 namespace:str = "answers", places = None, dim:int = 2 ** 10):
+        self.store = TTLCache(ttl, maxsize=maxsize, sqlite_path=sqlite_path, namespace=namespace)
+        self.similarity = similarity
+        self.places = places
+        self.dim = dim
+        self.lookups = 0
+        self.hits = 0
+        self.near_hits = 0
+
+        # One row per indexed key, reused round-robin once maxsize keys have been indexed
+        self._vectors = np.zeros((maxsize, dim), dtype=np.float32)
+        self._keys = [None] * maxsize
+        self._row_of = {}
+        self._next_row = 0
+        self._lock = threading.Lock()
+
+        self.store.load()
+        for key in self.store.keys():
+            self._index(key)
+
+
+    def key(self, prompt:str) -> str:
+        """Normalized cache key: content words plus "@" city codes, sorted."""
+
+        text = str(prompt)
+        normalized = normalize(text)
+        spans = self.places.spans(text) if self.places is not None else []
+
+        words, entities, last = [], [], 0
+        for start, end, place in spans + [(len(text), len(text), None)]:
+            words += normalized[last:start].split()
+            if place is not None:
+                entities.append("@" + (self.places.city_code(place.code) or place.code).lower()) # type: ignore
+            last = end
+
+        # A prompt made only of stop words ("what can you tell me") keeps all of its words
+        content = [word for word in words if word not in STOP_WORDS] or words
+        # Light stemming, so "restaurants" and "restaurant" share a key
+        content = [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word for word in content]
+        return " ".join(sorted(set(entities + content)))
+
+
+    def get(self, prompt:str) -> str | None:
+        """The cached answer for prompt or a near duplicate of it, or None."""
+
+        if VOLATILE.search(str(prompt).lower()):
+            return None
+        key = self.key(prompt)
+        with self._lock:
+            self.lookups += 1
+
+        answer = self.store.get(key)
+        if answer is None and self.similarity < 1:
+            for match in self._nearest(key):
+                answer = self.store.get(match)
+                if answer is not None:
+                    with self._lock:
+                        self.near_hits += 1
+                    break
+        if answer is not None:
+            with self._lock:
+                self.hits += 1
+        return answer
+
+
+    def set(self, prompt:str, answer:str):
+        if not answer or VOLATILE.search(str(prompt).lower()):
+            return
+        key = self.key(prompt)
+        self.store.set(key, answer)
+        self._index(key)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "near_hits": self.near_hits,
+                "size": len(self.store),
+                "maxsize": self.store.maxsize,
+            }
+
+
+    def vector(self, key:str) -> np.ndarray:
+        """L2-normalized hashed features: each key word, plus the character trigrams of the non-place words."""
+
+        v = np.zeros(self.dim, dtype=np.float32)
+        for word in key.split():
+            v[zlib.crc32(word.encode()) % self.dim] += 1.0
+            if not word.startswith("@"):
+                padded = f" {word} "
+                for i in range(len(padded) - 2):
+                    v[zlib.crc32(("#" + padded[i:i + 3]).encode()) % self.dim] += 0.5
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+
+    def _nearest(self, key:str, candidates:int = 3) -> list[str]:
+        """Indexed keys similar enough to key that mention the same places, most similar first."""
+
+        query = self.vector(key)
+        places = _places(key)
+        threshold = max(self.similarity, SHORT_KEY_SIMILARITY) if len(key.split()) < SHORT_KEY_WORDS else self.similarity
+        with self._lock:
+            if not self._row_of:
+                return []
+            scores = self._vectors @ query
+            count = min(candidates, len(scores))
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best])]
+            matches = [self._keys[row] for row in best
+                       if scores[row] >= threshold and self._keys[row] is not None and _places(self._keys[row]) == places] # type: ignore
+        return [match for match in matches if _covers(key, match) and _covers(match, key)] # type: ignore
+
+
+    def _index(self, key:str):
+        vector = self.vector(key)
+        with self._lock:
+            row = self._row_of.get(key)
+            if row is None:
+                row = self._next_row
+                self._next_row = (row + 1) % len(self._keys)
+                if self._keys[row] is not None:
+                    del self._row_of[self._keys[row]]
+                self._keys[row] = key
+                self._row_of[key] = row
+            self._vectors[row] = vector
+
+
+def _places(key:str) -> set[str]:
+    return {word for word in key.split() if word.startswith("@")}
+
+
+def _covers(key:str, other:str) -> bool:
+    """Whether every word of key is in other, allowing for typos in longer words. Stop words don't count."""
+
+    words = other.split()
+    for word in key.split():
+        if word in STOP_WORDS or word in words:
+            continue
+        if len(word) < TYPO_MIN_CHARS or not any(len(candidate) >= TYPO_MIN_CHARS and
+                                                 SequenceMatcher(None, word, candidate).ratio() >= TYPO_SIMILARITY
+                                                 for candidate in words):
+            return False
+    return True
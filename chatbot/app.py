@@ -1,12 +1,20 @@
 # Hugging Face Space Entry Point for NaviBlu Travel Assistant
 
-import streamlit as st
+import json
 import os
-from core import Chatbot
+import httpx
+import streamlit as st
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# The chatbot runs in the API server (server.py); this script is only its chat UI
+API_URL = os.getenv("NAVIBLU_API_URL", "http://127.0.0.1:8000").rstrip("/")
+API_TIMEOUT = httpx.Timeout(10.0, read=120.0)
+
+# Messages kept on screen per browser session; the conversation itself lives in the API's session store
+UI_HISTORY = int(os.getenv("NAVIBLU_UI_HISTORY", "40"))
+
 # Page config - must be first Streamlit command
 st.set_page_config(
     page_title="NaviBlu Travel Assistant",
@@ -46,9 +54,44 @@ if "messages" not in st.session_state or st.session_state.messages is None:
     st.session_state.messages = []
 
 
-# Initialize chatbot object in streamlit session state
-if "chatbot" not in st.session_state or st.session_state.chatbot is None:
-    st.session_state.chatbot = Chatbot()
+# The API session holding this conversation, started on the first message
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
+
+
+def start_session() -> str:
+    response = httpx.post(f"{API_URL}/api/sessions", timeout=API_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+def stream_reply(prompt:str):
+    """Send prompt to the API and yield its server-sent events as (event, data) pairs.
+    Starts a new session if there is none yet or the API no longer knows this one (e.g. after a restart)."""
+
+    for attempt in range(2):
+        if st.session_state.session_id is None:
+            st.session_state.session_id = start_session()
+        url = f"{API_URL}/api/sessions/{st.session_state.session_id}/messages"
+        with httpx.stream("POST", url, json={"message": prompt}, headers={"Accept": "text/event-stream"}, timeout=API_TIMEOUT) as response:
+            if response.status_code == 404 and attempt == 0:
+                st.session_state.session_id = None
+                continue
+            if response.status_code != 200:
+                response.read()
+                yield "error", response.json()
+                return
+
+            name, data = "message", []
+            for line in response.iter_lines():
+                if line.startswith("event:"):
+                    name = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    yield name, json.loads("\n".join(data))
+                    name, data = "message", []
+        return
 
 
 # Streamlit App ----------------------------------------------------------------------
@@ -72,11 +115,29 @@ if prompt := st.chat_input("Type Here"):
 
     with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
 
-        # Call shared chatbot logic
-        response = st.session_state.chatbot.process_input(prompt) # type: ignore
-
-        # Display response in UI
-        st.markdown(response)
-
-    # Add response to chat history
+        # Ask the chatbot API, rendering each section as it streams in
+        placeholder = st.empty()
+        placeholder.markdown("✈️ *Searching...*")
+        order, sections = [], {}
+        response = ""
+        try:
+            for name, data in stream_reply(prompt):
+                if name == "start":
+                    order = data["order"]
+                elif name == "section":
+                    section = data["section"]
+                    sections[section] = data["text"] if data["final"] else sections.get(section, "") + data["text"]
+                    placeholder.markdown("\n".join(sections[key] for key in order if key in sections) + " ▌")
+                elif name == "done":
+                    response = data["response"]
+                elif name == "error":
+                    response = f"⚠️ **{data.get('error', 'Something went wrong. Please try again.')}**"
+        except httpx.HTTPError:
+            response = "⚠️ **NaviBlu is unavailable right now. Please try again in a moment.**"
+
+        # Display the complete response in UI
+        placeholder.markdown(response)
+
+    # Add response to chat history, keeping only the most recent messages in the Streamlit session
     st.session_state.messages.append({"role": "assistant", "content": response})
+    del st.session_state.messages[:-UI_HISTORY]
@@ -0,0 +1,152 @@
+# Process-wide result caches for upstream API calls
+
+import ast
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache():
+    """Thread-safe cache with a time-to-live and least-recently-used eviction.
+
+    Entries live in memory, bounded by maxsize. If sqlite_path is given, entries are also written
+    through to a SQLite file so they survive a container restart; a memory miss then falls back to disk.
+    Several caches can share one SQLite file as long as they use different namespaces."""
+
+    def __init__(self, ttl:float, maxsize:int = 1024, sqlite_path:str | None = None, namespace:str = "default"):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                    namespace TEXT NOT NULL,
+                                    key TEXT NOT NULL,
+                                    value BLOB NOT NULL,
+                                    expires_at REAL NOT NULL,
+                                    PRIMARY KEY (namespace, key))""")
+            self._db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+
+            entry = self._db_get(key, now)
+            if entry is not None:
+                self._store(key, entry[1], entry[0])
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return default
+
+
+    def set(self, key, value, ttl:float | None = None):
+        """Cache value under key. ttl overrides the cache's default time-to-live for this entry."""
+
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                                 (self.namespace, repr(key), pickle.dumps(value), expires_at))
+                self._db.commit()
+
+
+    def keys(self) -> list:
+        """Keys of the non-expired entries held in memory, least recently used first."""
+
+        now = time.time()
+        with self._lock:
+            return [key for key, (expires_at, _) in self._data.items() if expires_at > now]
+
+
+    def load(self) -> int:
+        """Read this namespace's non-expired entries from SQLite into memory, up to maxsize, and return how many.
+        Only keys whose repr() reads back with ast.literal_eval (strings, numbers and tuples of them) can be loaded."""
+
+        if self._db is None:
+            return 0
+        with self._lock:
+            rows = self._db.execute("SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at > ? "
+                                    "ORDER BY expires_at DESC LIMIT ?", (self.namespace, time.time(), self.maxsize)).fetchall()
+            for key, value, expires_at in reversed(rows):
+                try:
+                    self._store(ast.literal_eval(key), pickle.loads(value), expires_at)
+                except (ValueError, SyntaxError):
+                    continue
+            return len(rows)
+
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return (entry is not None and entry[0] > time.time()) or self._db_get(key, time.time()) is not None
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+                self._db.commit()
+
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+
+    def _store(self, key, value, expires_at:float):
+        """Put an entry in memory and evict the least recently used entries. Caller holds the lock."""
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    def _db_get(self, key, now:float):
+        """Look up a non-expired entry on disk. Caller holds the lock."""
+
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                               (self.namespace, repr(key))).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row[1], pickle.loads(row[0])
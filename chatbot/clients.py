@@ -0,0 +1,147 @@
+# Process-wide registry of the API clients, shared by every chat session
+#
+# The provider SDKs (groq, amadeus) and httpx are imported when their client is first built, not when this module is,
+# so a cold process doesn't pay for them before it needs them. See ClientRegistry.preload() to load them ahead of time.
+
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+from tracing import event
+
+if TYPE_CHECKING:
+    import httpx
+    from amadeus import Client
+    from groq import Groq
+
+SDK_MODULES = ("httpx", "groq", "amadeus")
+
+
+def early_refresh_token(amadeus:"Client"):
+    """Amadeus access token that is renewed 5 minutes before it expires instead of 10 seconds."""
+
+    from amadeus.client.access_token import AccessToken
+
+    class EarlyRefreshAccessToken(AccessToken):
+        TOKEN_BUFFER = 300
+
+    return EarlyRefreshAccessToken(amadeus)
+
+
+class PooledHTTP():
+    """urlopen-compatible callable for the Amadeus SDK that sends requests through a keep-alive httpx connection pool.
+    By default the SDK opens a new TLS connection with urllib for every call."""
+
+    def __init__(self, client:"httpx.Client"):
+        self.client = client
+
+
+    def __call__(self, http_request):
+        response = self.client.request(
+            http_request.get_method(),
+            http_request.full_url,
+            headers = dict(http_request.header_items()),
+            content = http_request.data,
+        )
+        return PooledResponse(response)
+
+
+class PooledResponse():
+    """The parts of urllib's HTTPResponse that the Amadeus SDK reads."""
+
+    def __init__(self, response:"httpx.Response"):
+        self.response = response
+        self.status = response.status_code
+        self.code = response.status_code
+
+
+    def info(self):
+        # httpx headers are case-insensitive, like urllib's
+        return self.response.headers
+
+
+    def read(self):
+        return self.response.content
+
+
+class ClientRegistry():
+    """Lazily builds one Groq client and one Amadeus client per process, importing each SDK on first use.
+
+    Both clients are thread-safe and keep their HTTP connections alive, so every session reuses the same
+    connection pools and the same Amadeus OAuth token. A background thread renews the token before it
+    expires, so no user request has to wait for it."""
+
+    def __init__(self, max_connections:int = 20, token_check_interval:float = 60):
+        self.max_connections = max_connections
+        self.token_check_interval = token_check_interval
+        self._groq = None
+        self._amadeus = None
+        self._lock = threading.Lock()
+
+
+    def preload(self) -> dict:
+        """Import the SDKs without building any client, e.g. while a container starts.
+        Returns the seconds each import took (0 for one that was already loaded)."""
+
+        timings = {}
+        for module in SDK_MODULES:
+            start = time.perf_counter()
+            importlib.import_module(module)
+            timings[module] = time.perf_counter() - start
+        return timings
+
+
+    @property
+    def groq(self) -> "Groq":
+        if self._groq is None:
+            with self._lock:
+                if self._groq is None:
+                    import httpx
+                    from groq import Groq
+                    self._groq = Groq(
+                        api_key = os.getenv("GROQ_API_KEY"),
+                        max_retries = 0, # retries are handled by the scheduler
+                        http_client = httpx.Client(limits=self._limits(), timeout=httpx.Timeout(60.0, connect=10.0)),
+                    )
+        return self._groq
+
+
+    @property
+    def amadeus(self) -> "Client":
+        if self._amadeus is None:
+            with self._lock:
+                if self._amadeus is None:
+                    import httpx
+                    from amadeus import Client # Hotels API
+                    amadeus = Client(
+                        client_id = os.getenv("AMADEUS_API_KEY"),
+                        client_secret = os.getenv("AMADEUS_API_SECRET"),
+                        http = PooledHTTP(httpx.Client(limits=self._limits(), timeout=httpx.Timeout(30.0, connect=10.0))),
+                    )
+                    # The SDK memoizes its token in this attribute, so every request shares this one
+                    amadeus.access_token = early_refresh_token(amadeus)
+                    threading.Thread(target=self._refresh_amadeus_token, args=(amadeus,), daemon=True,
+                                     name="naviblu-amadeus-token").start()
+                    self._amadeus = amadeus
+        return self._amadeus
+
+
+    def _limits(self) -> "httpx.Limits":
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections, keepalive_expiry=120)
+
+
+    def _refresh_amadeus_token(self, amadeus:"Client"):
+        """Fetch the first token right away, then renew it whenever it gets within TOKEN_BUFFER of expiring."""
+
+        while True:
+            try:
+                amadeus.access_token._bearer_token()
+            except Exception as e:
+                event("amadeus token refresh failed", logging.WARNING, error=str(e))
+            time.sleep(self.token_check_interval)
+
+
+CLIENTS = ClientRegistry(max_connections=int(os.getenv("NAVIBLU_MAX_CONNECTIONS", "20")))
@@ -1,54 +1,351 @@
 # Core backend chatbot logic with agent-based architecture
 
-import os
 import json
+import logging
+import os
+import time
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from amadeus import Client, ResponseError # Hotels API
-from fast_flights import FlightData, Passengers, Result, get_flights # Flights API
-from groq import Groq
 from dotenv import load_dotenv
+from airports import AirportIndex
+from answers import AnswerCache
+from cache import TTLCache
+from clients import CLIENTS
+from executor import AgentExecutor
+from flights import FlightGrid, FlightLeg, FlightSearchExecutor, LegSearchError, cheapest_trips, load_fast_flights
+from hotels import POPULAR_CITIES, HotelSearch
+from intent import IntentClassifier
+from memory import ConversationMemory
+from prefetch import Prefetcher, hotel_stays, stay_key
+from scheduler import BACKGROUND, INTERACTIVE, CircuitOpenError, Deadline, DeadlineExceeded, Scheduler
+from singleflight import SingleFlight
+from tracing import METRICS, configure_logging, event, span, start_metrics_server
+from understanding import understand
 load_dotenv()
+configure_logging()
+
+
+# Every upstream call goes through this scheduler: per-provider rate limits as (calls per second, burst),
+# fair turns across sessions, interactive calls before background work, and retries with backoff.
+# A provider that fails NAVIBLU_BREAKER_FAILURES times in a row is not called for NAVIBLU_BREAKER_RESET seconds.
+SCHEDULER = Scheduler({
+    "groq": (float(os.getenv("NAVIBLU_GROQ_RATE", "5")), float(os.getenv("NAVIBLU_GROQ_BURST", "10"))),
+    "amadeus": (float(os.getenv("NAVIBLU_AMADEUS_RATE", "8")), float(os.getenv("NAVIBLU_AMADEUS_BURST", "8"))),
+    "fast_flights": (float(os.getenv("NAVIBLU_FLIGHTS_RATE", "2")), float(os.getenv("NAVIBLU_FLIGHTS_BURST", "4"))),
+},
+    failure_threshold = int(os.getenv("NAVIBLU_BREAKER_FAILURES", "5")),
+    reset_after = float(os.getenv("NAVIBLU_BREAKER_RESET", "30")),
+)
+
+# Time budget for a whole turn, and for each agent within it. Agents that run out of time are shown as still
+# searching, with whatever they had so far, instead of holding up the rest of the answer.
+TURN_BUDGET = float(os.getenv("NAVIBLU_TURN_BUDGET", "25"))
+AGENT_TIMEOUTS = {
+    "flight": float(os.getenv("NAVIBLU_FLIGHT_TIMEOUT", "20")),
+    "hotel": float(os.getenv("NAVIBLU_HOTEL_TIMEOUT", "15")),
+    "location": float(os.getenv("NAVIBLU_LOCATION_TIMEOUT", "12")),
+    "general": float(os.getenv("NAVIBLU_GENERAL_TIMEOUT", "12")),
+}
+# A flight grid stops searching this long before its deadline, to leave time to show what it found
+GRID_RENDER_SECONDS = 1.0
+
+# When sessions make the same upstream call at the same time (a popular route or question going around), only one
+# of them calls upstream and the rest wait for its result. Merged calls are counted in upstream_merged_total.
+IN_FLIGHT = {provider: SingleFlight(provider) for provider in SCHEDULER.queues}
+
+# Shared across every Chatbot so concurrent sessions don't each spin up their own threads
+AGENT_EXECUTOR = AgentExecutor(max_workers=int(os.getenv("NAVIBLU_AGENT_WORKERS", "8")))
+
+# Work no user is waiting on (summarizing older turns, building indexes at startup) gets its own few threads,
+# so it can never hold agent threads while its low-priority calls wait behind interactive ones
+BACKGROUND_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("NAVIBLU_BACKGROUND_WORKERS", "2")), thread_name_prefix="naviblu-background")
+
+# Flight results for popular routes are reused across sessions for a few minutes.
+# Set NAVIBLU_CACHE_DB to a file path to keep cached results across container restarts.
+FLIGHT_CACHE = TTLCache(
+    ttl = float(os.getenv("NAVIBLU_FLIGHT_CACHE_TTL", "900")),
+    maxsize = int(os.getenv("NAVIBLU_FLIGHT_CACHE_SIZE", "1024")),
+    sqlite_path = os.getenv("NAVIBLU_CACHE_DB"),
+    namespace = "flights",
+)
+FLIGHT_SEARCH_EXECUTOR = FlightSearchExecutor(max_workers=int(os.getenv("NAVIBLU_FLIGHT_WORKERS", "8")), cache=FLIGHT_CACHE,
+                                              scheduler=SCHEDULER, grid_workers=int(os.getenv("NAVIBLU_FLIGHT_GRID_WORKERS", "8")),
+                                              in_flight=IN_FLIGHT["fast_flights"])
+
+# Flexible-date and nearby-airport searches: at most FLIGHT_GRID_MAX one-way searches per request, nearest dates and
+# main airports first, and up to NEARBY_AIRPORTS airports within NEARBY_KM of each end of the trip
+FLIGHT_GRID_MAX = int(os.getenv("NAVIBLU_FLIGHT_GRID_MAX", "16"))
+NEARBY_KM = float(os.getenv("NAVIBLU_NEARBY_KM", "250"))
+NEARBY_AIRPORTS = int(os.getenv("NAVIBLU_NEARBY_AIRPORTS", "3"))
+
+# City → hotel-ID reference data is kept for a week and persisted when a SQLite path is configured,
+# while hotel offers are only reused for a few minutes.
+HOTEL_ID_INDEX = TTLCache(
+    ttl = float(os.getenv("NAVIBLU_HOTEL_INDEX_TTL", str(7 * 24 * 60 * 60))),
+    maxsize = 4096,
+    sqlite_path = os.getenv("NAVIBLU_HOTEL_INDEX_DB", os.getenv("NAVIBLU_CACHE_DB")),
+    namespace = "hotel_ids",
+)
+HOTEL_OFFERS_CACHE = TTLCache(
+    ttl = float(os.getenv("NAVIBLU_HOTEL_OFFERS_TTL", "300")),
+    maxsize = int(os.getenv("NAVIBLU_HOTEL_OFFERS_SIZE", "512")),
+    sqlite_path = os.getenv("NAVIBLU_CACHE_DB"),
+    namespace = "hotel_offers",
+)
+
+# Cache hit rates are reported with the other metrics. Set NAVIBLU_METRICS_PORT to serve them at /metrics.
+METRICS.register_cache("flights", FLIGHT_CACHE)
+METRICS.register_cache("hotel_ids", HOTEL_ID_INDEX)
+METRICS.register_cache("hotel_offers", HOTEL_OFFERS_CACHE)
+if os.getenv("NAVIBLU_METRICS_PORT"):
+    start_metrics_server(int(os.getenv("NAVIBLU_METRICS_PORT"))) # type: ignore
+
+# Hotel offer batches run on their own pool, which also caps how many Amadeus calls are in flight at once
+HOTEL_BATCH_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("NAVIBLU_HOTEL_CONCURRENCY", "4")), thread_name_prefix="naviblu-hotels")
+HOTEL_BATCH_SIZE = int(os.getenv("NAVIBLU_HOTEL_BATCH_SIZE", "30"))
+HOTEL_MAX_IDS = int(os.getenv("NAVIBLU_HOTEL_MAX_IDS", "300"))
+
+# Offline airport/city index used to check and resolve the codes the LLM extracts before any search goes out.
+# Its name indexes take a moment to build, so that happens in the background at startup.
+AIRPORT_INDEX = AirportIndex.load()
+BACKGROUND_POOL.submit(AIRPORT_INDEX.warm)
+
+# Location and general answers only depend on the prompt, so repeated and near-duplicate questions are answered
+# from this cache without an LLM call. Set NAVIBLU_ANSWER_SIMILARITY to 1 to only reuse answers for the same normalized prompt.
+ANSWER_CACHES = {
+    agent: AnswerCache(
+        ttl = float(os.getenv("NAVIBLU_ANSWER_CACHE_TTL", str(6 * 60 * 60))),
+        maxsize = int(os.getenv("NAVIBLU_ANSWER_CACHE_SIZE", "1024")),
+        similarity = float(os.getenv("NAVIBLU_ANSWER_SIMILARITY", "0.85")),
+        sqlite_path = os.getenv("NAVIBLU_CACHE_DB"),
+        namespace = f"{agent}_answers",
+        places = AIRPORT_INDEX,
+    )
+    for agent in ("location", "general")
+}
+for agent, answer_cache in ANSWER_CACHES.items():
+    METRICS.register_cache(f"{agent}_answers", answer_cache)
+
+# Local intent classifier; confident location/general predictions skip the LLM understanding call.
+# NAVIBLU_INTENT_LOG collects LLM-classified queries that the classifier is retrained on at startup.
+# Training happens in the background; until it's done every turn goes through the LLM.
+INTENT_CLASSIFIER = IntentClassifier(log_path=os.getenv("NAVIBLU_INTENT_LOG"))
+INTENT_TRAINING = BACKGROUND_POOL.submit(INTENT_CLASSIFIER.train)
+INTENT_THRESHOLD = float(os.getenv("NAVIBLU_INTENT_THRESHOLD", "0.9"))
+# How often the classifier agrees with the LLM, and how many queries each candidate threshold would let skip it
+METRICS.register_gauges("intent", INTENT_CLASSIFIER.gauges)
+
+# Tokens of conversation history (summary + recent turns) sent with each LLM call
+MEMORY_TOKEN_BUDGET = int(os.getenv("NAVIBLU_MEMORY_TOKENS", "1500"))
+# Seconds a summary of older turns may take before the memory falls back to keeping their most recent part
+SUMMARY_TIMEOUT = float(os.getenv("NAVIBLU_SUMMARY_TIMEOUT", "60"))
+
+# Order the agent sections are shown in
+SECTION_ORDER = ["flight", "hotel", "location", "general"]
+
+# Message shown in place of an agent's section when that agent fails
+AGENT_ERROR_MESSAGES = {
+    "flight": "⚠️ **Unable to retrieve flight information at this time.**",
+    "hotel": "⚠️ **Unable to retrieve hotel information at this time.**",
+    "location": "⚠️ **Unable to retrieve location information at this time.**",
+    "general": "⚠️ **Unable to answer that right now. Please try again.**",
+}
+
+# Shown in place of (or after the partial output of) an agent that ran out of time, and of one whose provider is down
+AGENT_PENDING_MESSAGES = {
+    "flight": "⏳ **Still searching for flights.** The flight search is taking longer than usual. Ask again in a moment for the results.",
+    "hotel": "⏳ **Still searching for hotels.** The hotel search is taking longer than usual. Ask again in a moment for the results.",
+    "location": "⏳ **Still working on this.** Ask again in a moment for the full answer.",
+    "general": "⏳ **Still working on this.** Ask again in a moment for the full answer.",
+}
+AGENT_UNAVAILABLE_MESSAGES = {
+    "flight": "🚫 **Flight search is unavailable right now.** It has been failing repeatedly, so it's paused for a little while. Please try again in a few minutes.",
+    "hotel": "🚫 **Hotel search is unavailable right now.** It has been failing repeatedly, so it's paused for a little while. Please try again in a few minutes.",
+    "location": "🚫 **Answers are unavailable right now.** Please try again in a few minutes.",
+    "general": "🚫 **Answers are unavailable right now.** Please try again in a few minutes.",
+}
+
+
+# Hotel lookups hold no per-session state, so every session shares one HotelSearch
+HOTEL_SEARCH = HotelSearch(lambda: CLIENTS.amadeus, HOTEL_ID_INDEX, HOTEL_OFFERS_CACHE, pool=HOTEL_BATCH_POOL,
+                           batch_size=HOTEL_BATCH_SIZE, max_hotels=HOTEL_MAX_IDS, scheduler=SCHEDULER,
+                           in_flight=IN_FLIGHT["amadeus"])
+
+# After a flight search, the hotel search it makes likely (a stay at the destination for the trip's dates, or just
+# the destination's hotel list for a one-way trip) is run in the background at low priority, so asking for hotels
+# next is answered from the caches. Prefetching may use up to NAVIBLU_PREFETCH_BUDGET Amadeus calls an hour; 0 turns it off.
+PREFETCH_BUDGET = float(os.getenv("NAVIBLU_PREFETCH_BUDGET", "300"))
+PREFETCHER = Prefetcher(
+    budget = PREFETCH_BUDGET,
+    ttl = HOTEL_OFFERS_CACHE.ttl,
+    timeout = float(os.getenv("NAVIBLU_PREFETCH_TIMEOUT", "30")),
+)
+METRICS.register_cache("prefetch", PREFETCHER)
+
+
+# Popular cities whose hotel-ID index warm_up() loads at container start (0 leaves it to the first searches)
+WARM_HOTEL_CITIES = int(os.getenv("NAVIBLU_WARM_HOTELS", "0"))
+
+
+def warm_hotel_index(top_n:int = 20) -> dict:
+    """Load the hotel-ID index for the top_n most popular cities ahead of the first user request."""
+    return HOTEL_SEARCH.warm(POPULAR_CITIES[0:top_n])
+
+
+def warm_up(hotel_cities:int = WARM_HOTEL_CITIES) -> dict:
+    """Do the work a cold process would otherwise do during its first turns: import the provider SDKs, build the
+    clients whose API keys are set (which also fetches the Amadeus token), finish training the intent classifier
+    and building the airport name indexes, and load the hotel-ID index for the hotel_cities most popular cities.
+    Meant to run once at container start. Returns the seconds each step took."""
+
+    steps = [
+        ("sdks", CLIENTS.preload),
+        ("fast_flights", load_fast_flights),
+        ("intent", INTENT_TRAINING.result),
+        ("airports", AIRPORT_INDEX.warm),
+    ]
+    if os.getenv("GROQ_API_KEY"):
+        steps.append(("groq_client", lambda: CLIENTS.groq))
+    if os.getenv("AMADEUS_API_KEY"):
+        steps.append(("amadeus_client", lambda: CLIENTS.amadeus))
+        if hotel_cities:
+            steps.append(("hotel_index", lambda: warm_hotel_index(hotel_cities)))
+
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            event("warm-up step failed", logging.WARNING, step=name, error=str(e))
+        timings[name] = round(time.perf_counter() - start, 3)
+    event("warmed up", **timings)
+    return timings
 
 
 class Chatbot():
 
-    def __init__(self):
+    def __init__(self, session_id:str | None = None):
+        # Identifies this conversation to the scheduler, so sessions get fair turns at the APIs
+        self.session_id = session_id or uuid.uuid4().hex
+
         self.input_prompt = ""
         self.todays_date = date.today().isoformat()
 
         self.LLM_model = "llama-3.3-70b-versatile"
 
-        self.amadeus = Client(
-            client_id = os.getenv("AMADEUS_API_KEY"),
-            client_secret = os.getenv("AMADEUS_API_SECRET")
-        )
-
-        # chat_history to store all of the messages in the conversation.
+        # Conversation memory: compact records of each turn, kept within a token budget by summarizing older turns.
         # Set the system prompt to establish the behavior of the chatbot.
-        self.chat_history = [
-                                {"role": "system", 
-                                "content": """You are a travel assistant named NaviBlu who helps provide information to users for planning trips and vacations.
-                                                You can pull realtime flight and hotel information.
-                                                You can also provide information about tourist attractions and activities at a location, as well as answer any general queries the user may have.
-                                                You can also provide general information about travel and destinations."""}
-                            ]
+        self.memory = ConversationMemory(
+            system_prompt = """You are a travel assistant named NaviBlu who helps provide information to users for planning trips and vacations.
+                                You can pull realtime flight and hotel information.
+                                You can also provide information about tourist attractions and activities at a location, as well as answer any general queries the user may have.
+                                You can also provide general information about travel and destinations.""",
+            token_budget = MEMORY_TOKEN_BUDGET,
+            summarizer = lambda prompt: self.call_llm(prompt = prompt, priority = BACKGROUND, deadline = Deadline(SUMMARY_TIMEOUT)),
+        )
 
         self.flight_info = ""
         self.hotel_info = ""
         self.location_info = ""
         self.general_info = ""
 
-        # establish Groq client for API calls
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        # Categories and search slots extracted from the latest user message
+        self.understanding = {}
+
+        # How long each agent took on the last turn, in seconds
+        self.agent_timings = {}
+
+        # Complete response to the last turn
+        self.last_response = ""
+
+
+    @classmethod
+    def from_state(cls, session_id:str, state:dict):
+        """Rebuild a session's Chatbot from the state saved by to_state()."""
+
+        chatbot = cls(session_id)
+        chatbot.memory.load_state(state.get("memory", {}))
+        return chatbot
+
+
+    def to_state(self) -> dict:
+        """What a session needs to continue later: its conversation memory. The rendered sections of the last
+        turn are left out, they are rebuilt on the next turn."""
+        return {"memory": self.memory.to_state()}
+
+
+    @property
+    def client(self):
+        """Groq client for API calls, shared by every session."""
+        return CLIENTS.groq
+
+
+    @property
+    def amadeus(self):
+        """Amadeus client for hotel searches, shared by every session."""
+        return CLIENTS.amadeus
+
+
+    @property
+    def chat_history(self):
+        """Messages to send to the LLM: system prompt, summary of older turns and the recent turns."""
+        return self.memory.messages()
 
 
     def process_input(self, input_prompt:str):
         '''Determine if the user prompt is asking for information on flights, hotels, location, or general info.'''
 
-        print("Running process_input function")
+        with span("turn", session=self.session_id):
+            deadline = Deadline(TURN_BUDGET)
+            categories_list = self._start_turn(input_prompt, deadline)
+
+            # Run the agents concurrently, results come back in the same order
+            agents, deadlines = self._agents(categories_list, deadline)
+            results = AGENT_EXECUTOR.run(agents, deadlines)
+
+            return self._finish_turn(results)
+
+
+    def process_input_stream(self, input_prompt:str):
+        '''Streaming version of process_input.
+        Yields (section, text, final) as the agents make progress, where section is "flight", "hotel", "location" or "general".
+        Partial text (final=False) should be appended to the section; final text replaces the whole section.
+        Sections arrive in whatever order the agents finish, so callers should display them in SECTION_ORDER.
+        The complete response is available in last_response once the generator is exhausted.'''
+
+        with span("turn", session=self.session_id, stream=True):
+            deadline = Deadline(TURN_BUDGET)
+            categories_list = self._start_turn(input_prompt, deadline)
+
+            # Location and general answers stream their LLM tokens and flight grid searches their progress,
+            # hotel sections arrive in one piece
+            agents, deadlines = self._agents(categories_list, deadline)
+            agents = [(name, lambda emit, agent=agent: agent(on_token=emit)) if name in ("flight", "location", "general")
+                      else (name, lambda emit, agent=agent: agent()) for name, agent in agents]
+
+            results, partial_text = {}, {}
+            for name, text, result in AGENT_EXECUTOR.stream(agents, deadlines):
+                if result is None:
+                    partial_text[name] = partial_text.get(name, "") + text
+                    yield name, text, False
+                else:
+                    # An agent that ran out of time keeps what it streamed so far
+                    if not result.ok and not result.output:
+                        result.output = partial_text.get(name, "")
+                    results[name] = result
+                    yield name, self._section(result), True
+
+            self._finish_turn([results[name] for name in SECTION_ORDER if name in results])
+
+
+    def _start_turn(self, input_prompt:str, deadline:Deadline | None = None) -> list[str]:
+        """Record the user's message and work out which categories of information it needs."""
 
         self.input_prompt = input_prompt
-        print(f"Input prompt: {self.input_prompt}")
+        event("user turn", logging.DEBUG, session=self.session_id, prompt=self.input_prompt)
 
         # Reset info
         self.flight_info = ""
@@ -57,243 +354,396 @@ class Chatbot():
         self.general_info = ""
 
         # Add to chat history
-        self.chat_history.append({"role": "user", "content": str(self.input_prompt)})
-        
-        # make seperate chat history just for this process
-        process_input_history = [{
-            "role": "system", 
-            "content": """You are a classifier that determines which category of information the user needs: 'flight', 'hotel', 'location', or 'general'.
-                        
-                        Follow these rules:
-                        - ONLY respond with one or more of these exact words: flight, hotel, location, general
-                        - Separate multiple categories with commas: flight, hotel
-                        - DO NOT include any other text, explanations, or examples
-                        - If the user is asking about what the chatbot can do or asking meta-questions about the chatbot itself, respond ONLY with: general
-                        - Only use 'location' if the user wants information about attractions and activities at a specific place
-                        
-                        Examples:
-                        user: can you find flights to New York?
-                        assistant: flight
-
-                        user: can you find hotels in vancouver this weekend?
-                        assistant: hotel
-
-                        user: what are hotels near popular tourist locations in Orlando?
-                        assistant: hotel, location
-
-                        user: help me plan an entire trip from Charlotte to London this weekend.
-                        assistant: flight, hotel, location
-
-                        user: what are some popular activities to do in Wellington, New Zealand?
-                        assistant: location
-
-                        user: How far is Tokyo from New York?
-                        assistant: general
-                        
-                        user: what questions can I ask?
-                        assistant: general
-                        
-                        user: what can you do?
-                        assistant: general
-                        
-
-                        """
-        }]
-        
-        # Add all of the user's messages to process_input_history
-        for message in self.chat_history:
-            process_input_history.append(message)
-
-        completion = self.client.chat.completions.create(
-            model = self.LLM_model,
-            messages = process_input_history, # type: ignore
-            temperature = 0.0  # Set to 0 for deterministic classification
-        )
-
-        categories = str(completion.choices[0].message.content).strip().lower()
-        print(f"---User Query Categories: {categories}---")
-
-        # Parse categories - only trigger agents if the category word appears as a standalone term
-        categories_list = [cat.strip() for cat in categories.split(',')]
+        self.memory.add_user_turn(str(self.input_prompt))
         
+        # Try the local classifier first. Flight and hotel searches still need the LLM to extract their search slots,
+        # but a confident location/general prediction needs nothing else, so the LLM call can be skipped.
+        with span("intent.local") as trace:
+            prediction = INTENT_CLASSIFIER.predict(self.input_prompt)
+            trace["confidence"] = round(prediction.confidence, 3)
+            trace["skip_llm"] = prediction.confidence >= INTENT_THRESHOLD and set(prediction.categories) <= {"location", "general"}
+        if trace["skip_llm"]:
+            self.understanding = {"categories": prediction.categories, "flight": None, "hotel": None}
+        else:
+            # One LLM call works out which agents are needed and extracts the flight and hotel search slots they use
+            try:
+                with span("understanding"):
+                    self.understanding = understand(partial(self.call_llm, deadline=deadline), self.chat_history, self.todays_date,
+                                                    places=AIRPORT_INDEX)
+                INTENT_CLASSIFIER.record(self.input_prompt, prediction, self.understanding["categories"])
+            except Exception:
+                # Already logged by the span. Unparseable output, the deadline, an open breaker and any Groq error
+                # (a 429 after the retries, a 401) all fall back to the general agent, which shows its own error section
+                self.understanding = {"categories": ["general"], "flight": None, "hotel": None}
+        categories_list = self.understanding["categories"]
+        event("categories", session=self.session_id, categories=categories_list, local=trace["skip_llm"])
+        return categories_list
+
+
+    def _agents(self, categories_list:list[str], deadline:Deadline | None = None) -> tuple[list, dict]:
+        """Pick the agents to run, in the order their sections are shown.
+        Returns the (name, agent) pairs and each agent's deadline: its own timeout, within the turn's deadline."""
+
+        deadline = deadline or Deadline()
+        agents = []
         if "flight" in categories_list:
-            self.flight_info = self.flight_agent()
+            agents.append(("flight", self.flight_agent))
 
         if "hotel" in categories_list:
-            self.hotel_info = self.hotel_agent()
+            agents.append(("hotel", self.hotel_agent))
 
         if "location" in categories_list:
-            self.location_info = self.location_agent()
+            agents.append(("location", self.location_agent))
+
+        if "general" in categories_list:
+            agents.append(("general", self.general_info_agent))
+
+        deadlines = {name: deadline.within(AGENT_TIMEOUTS.get(name)) for name, _ in agents}
+        return [(name, partial(agent, deadline=deadlines[name])) for name, agent in agents], deadlines
+
+
+    def _section(self, result) -> str:
+        """The text shown for an agent's result, or an error message if the agent failed.
+        An agent that ran out of time or whose provider is down keeps any partial output, followed by a notice."""
+
+        if result.ok:
+            return result.output
+        status = _unfinished(result.error)
+        if status is None:
+            return AGENT_ERROR_MESSAGES[result.name] + "  \n"
+        messages = AGENT_PENDING_MESSAGES if status == "pending" else AGENT_UNAVAILABLE_MESSAGES
+        return (result.output + "  \n" if result.output else "") + messages[result.name] + "  \n"
+
+
+    def _finish_turn(self, results:list) -> str:
+        """Combine the agent results into the response and record the turn in memory."""
+
+        self.agent_timings = {}
+        for result in results:
+            self.agent_timings[result.name] = result.duration
+            setattr(self, f"{result.name}_info", self._section(result))
+        event("agent timings", session=self.session_id, **{name: round(seconds, 3) for name, seconds in self.agent_timings.items()})
 
-        if "general" in categories_list or len(categories) == 0:
-            self.general_info = self.general_info_agent()
-        
         # Combine the responses of all the agents
         assistant_response = f"{self.flight_info}\n{self.hotel_info}\n{self.location_info}\n{self.general_info}"
+        self.last_response = assistant_response
 
-        # Add AI response to chat history
-        self.chat_history.append({"role": "assistant", "content": assistant_response})
+        # Add a compact record of the response to the conversation memory, and summarize older turns in the background
+        self.memory.add_assistant_turn(self.understanding, {"location": self.location_info, "general": self.general_info})
+        BACKGROUND_POOL.submit(self.memory.compact)
 
-        print("Outputing Message.\n")
+        self._prefetch()
         return assistant_response
 
 
-    def flight_agent(self):
-        """Uses an LLM to parse flight parameters the user is searching for. 
-        Then uses the fast-flights API to search for available flights."""
-
-        print("Running flight agent.")
-
-        flight_info_prompt = f"""Use this chat history to extract the flight information the user is currently looking for: 
-                chat history: {self.chat_history}
-                format your response as a json exactly structured like below and nothing else. If you can't find information for a section, make an educated guess based on the message history. 
-                If needed, today's date is {self.todays_date}.
-
-                {{
-                "tripType": either "round-trip" or "one-way",
-                "originCity": three letter origin city iataCode,
-                "destinationCity": three letter destination city iataCode,
-                "originAirport": three letter origin airport code based on the city,
-                "destinationAirport": three letter destination airport code based on the city,
-                "departureDate": "YYY-MM-DD",
-                "arrivalDate": "YYY-MM-DD" if tripType is one-way, enter "None" for this field,
-                "numAdults": X If no number is specified, assume 2,
-                "numChildren": X If no number is specified, assume 0,
-                "seat": either "economy", "premium-economy", "business", or "first". If no specification is made, enter "economy"
-                }}
-                """
-        
-        # Use LLM to parse flight search parameters from prompt
-        search_info = self.call_llm(prompt = flight_info_prompt)
-        # convert to JSON
-        search_info_json = json.loads(search_info) # type: ignore
+    def _prefetch(self):
+        """Start the hotel lookups this turn's flight search makes likely for the next turn.
+        Nothing is prefetched when this turn searched hotels already or Amadeus is failing."""
+
+        flight = self.understanding.get("flight")
+        if PREFETCH_BUDGET <= 0 or flight is None or self.understanding.get("hotel") is not None:
+            return
+        if SCHEDULER.breakers["amadeus"].state != "closed":
+            return
+
+        stays = hotel_stays(flight, AIRPORT_INDEX.city_code)
+        for city, check_in, check_out, guests in stays:
+            PREFETCHER.submit(stay_key(city, check_in, check_out, guests), HOTEL_SEARCH.max_calls(city),
+                              partial(HOTEL_SEARCH.search, city, check_in, check_out, guests,
+                                      session = self.session_id, priority = BACKGROUND))
+
+        city = str(flight.get("destinationCity") or "").strip().upper()
+        if not stays and city and city not in HOTEL_ID_INDEX:
+            PREFETCHER.submit(("hotel_ids", city), 1,
+                              lambda deadline, stop: HOTEL_SEARCH.hotel_ids(city, self.session_id, BACKGROUND, deadline, stop))
+
+
+    def flight_agent(self, on_token = None, deadline = None):
+        """Uses the flight parameters the understanding step extracted from the conversation.
+        Then uses the fast-flights API to search for available flights.
+        Flexible dates or nearby airports search a grid of dates and airports instead, calling on_token with a
+        progress line as each search finishes. Searches still running at the deadline are given up on."""
+
+        # Flight search parameters were already extracted and validated by the understanding step
+        search_info_json = self.understanding.get("flight")
+        if search_info_json is None:
+            return self._missing_details_message("flight", "where you're flying from and to, and your travel dates")
+
+        trip_type = search_info_json.get("tripType")
 
         output = ["### Flight Search Parameters"]
-        output.append(f"**Trip Type:** {search_info_json.get("tripType")} | **Seat:** {search_info_json.get("seat")}")
+        output.append(f"**Trip Type:** {trip_type} | **Seat:** {search_info_json.get("seat")}")
         output.append(f"**Origin:** {search_info_json.get("originCity")} ({search_info_json.get("originAirport")}) → **Destination:** {search_info_json.get("destinationCity")} ({search_info_json.get("destinationAirport")})")
-        if search_info_json.get("tripType") == "one-way":
-            output.append(f"**Departure:** {search_info_json.get("departureDate")}")
-        else:
+        if trip_type == "round-trip":
             output.append(f"**Departure:** {search_info_json.get("departureDate")} | **Return:** {search_info_json.get("arrivalDate")}")
+        else:
+            output.append(f"**Departure:** {search_info_json.get("departureDate")}")
         output.append(f"**Passengers:** {search_info_json.get("numAdults")} Adult(s), {search_info_json.get("numChildren")} Children\n")
+
+        grids = self._flight_grids(search_info_json)
+        if grids:
+            return self._flight_grid_search(search_info_json, grids, output, on_token, deadline)
         output.append("---")
 
-        # get info for outbound flight 
+        # Build every one-way leg of the trip (fast-flights API doesn't support normal round-trip)
+        legs, titles = self._flight_legs(search_info_json)
+
+        # Search all of the legs at the same time
+        failure = None
         try:
-            outbound: Result = get_flights(
-                flight_data=[
-                    FlightData(date=search_info_json.get("departureDate"), from_airport=search_info_json.get("originAirport"), to_airport=search_info_json.get("destinationAirport"))
-                ],
-                trip="one-way",
-                seat=search_info_json.get("seat"),
-                passengers=Passengers(adults=search_info_json.get("numAdults"), children=search_info_json.get("numChildren"), infants_in_seat=0, infants_on_lap=0),
-                fetch_mode="fallback",
+            results = FLIGHT_SEARCH_EXECUTOR.search(
+                legs,
+                seat = search_info_json.get("seat"),
+                adults = search_info_json.get("numAdults"),
+                children = search_info_json.get("numChildren"),
+                session = self.session_id,
+                deadline = deadline,
             )
-        except Exception as e:
-            print(f"Flight search error: {e}")
-            output.append("")
-            output.append("⚠️ **Unable to retrieve flight information at this time.**")
-            output.append("")
-            output.append("The flight search service may be temporarily unavailable.")
-            output.append("Please try again later.")
-            
-            output_string = ""                  
-            for line in output:
-                output_string += str(line) + "  \n"
-            
-            return str(output_string)
-
-        output.append("### Outbound Flights")
-        output.append(f"*Price Level: {outbound.current_price}*\n")
-
-        for flight in outbound.flights:
-            if flight.is_best == True:
-                output.append(f"**{flight.name}** - ${flight.price}")
-                output.append(f"🛫 {flight.departure} → 🛬 {flight.arrival}")
-                output.append(f"⏱️ {flight.duration} | 🔄 {flight.stops} stop(s)")
+        except LegSearchError as e:
+            event("flight search failed", logging.WARNING, session=self.session_id, error=str(e))
+            failure = e.error
+            # Without the first leg there's nothing useful to show
+            if e.results[0] is None and _unfinished(e.error) is not None:
+                raise e.error
+            if e.results[0] is None:
                 output.append("")
-
-        # If round-trip, get info for inbound flight as well. (fast-flights API doesn't support normal round-trip)
-        if search_info_json.get("tripType") == "round-trip":
-            try:
-                inbound: Result = get_flights(
-                    flight_data=[
-                        FlightData(date=search_info_json.get("arrivalDate"), from_airport=search_info_json.get("destinationAirport"), to_airport=search_info_json.get("originAirport"))
-                    ],
-                    trip="one-way",
-                    seat=search_info_json.get("seat"),
-                    passengers=Passengers(adults=search_info_json.get("numAdults"), children=search_info_json.get("numChildren"), infants_in_seat=0, infants_on_lap=0),
-                    fetch_mode="fallback",
-                )
-
-                output.append("### Inbound Flights")
-                output.append(f"*Price Level: {inbound.current_price}*\n")
-
-                for flight in inbound.flights:
+                output.append("⚠️ **Unable to retrieve flight information at this time.**")
+                output.append("")
+                output.append("The flight search service may be temporarily unavailable.")
+                output.append("Please try again later.")
+
+                output_string = ""                  
+                for line in output:
+                    output_string += str(line) + "  \n"
+
+                return str(output_string)
+            results = e.results
+
+        with span("format.flight"):
+            for title, result in zip(titles, results):
+                if result is None:
+                    output.append("")
+                    if _unfinished(failure) == "pending":
+                        output.append(f"⏳ *Still searching for the {title.lower()}. Ask again in a moment for it.*")
+                    else:
+                        output.append(f"⚠️ *Unable to retrieve {title.lower()} information.*")
+                    continue
+
+                output.append(f"### {title}")
+                output.append(f"*Price Level: {result.current_price}*\n")
+
+                for flight in result.flights:
                     if flight.is_best == True:
                         output.append(f"**{flight.name}** - ${flight.price}")
                         output.append(f"🛫 {flight.departure} → 🛬 {flight.arrival}")
                         output.append(f"⏱️ {flight.duration} | 🔄 {flight.stops} stop(s)")
                         output.append("")
-            except Exception as e:
-                print(f"Inbound flight search error: {e}")
-                output.append("")
-                output.append("⚠️ *Unable to retrieve inbound flight information.*")
 
-        output_string = ""                  
-        for line in output:
-            output_string += str(line) + "  \n"
+            output_string = ""                  
+            for line in output:
+                output_string += str(line) + "  \n"
 
-        print("\n\nFlight Output String:\n")
-        print(output_string)
+        event("flight section", logging.DEBUG, session=self.session_id, text=output_string)
 
         return str(output_string)
 
 
-    def hotel_agent(self):
-        """Uses an LLM to parse hotel search parameters the user is searching for. 
-        Then uses the Amadeus API to search for available hotels."""
+    def _flight_legs(self, search_info_json:dict):
+        """Turn the extracted flight parameters into a list of one-way legs and a section title for each."""
+
+        trip_type = search_info_json.get("tripType")
+        origin = search_info_json.get("originAirport")
+        destination = search_info_json.get("destinationAirport")
+
+        if trip_type == "multi-city" and search_info_json.get("legs"):
+            legs = [FlightLeg(date=leg.get("date"), from_airport=leg.get("fromAirport"), to_airport=leg.get("toAirport"))
+                    for leg in search_info_json.get("legs")] # type: ignore
+            titles = [f"Flight {i + 1}: {leg.from_airport} → {leg.to_airport}" for i, leg in enumerate(legs)]
+            return legs, titles
+
+        legs = [FlightLeg(date=search_info_json.get("departureDate"), from_airport=origin, to_airport=destination)] # type: ignore
+        titles = ["Outbound Flights"]
+        if trip_type == "round-trip":
+            legs.append(FlightLeg(date=search_info_json.get("arrivalDate"), from_airport=destination, to_airport=origin)) # type: ignore
+            titles.append("Inbound Flights")
+        return legs, titles
+
+
+    def _flight_grids(self, search_info_json:dict) -> list[tuple[str, FlightGrid, str]]:
+        """(title, grid, center date) for each leg of a one-way or round trip with flexible dates or nearby airports,
+        or [] for an exact search."""
+
+        trip_type = search_info_json.get("tripType")
+        days = int(search_info_json.get("flexibleDays") or 0)
+        nearby = bool(search_info_json.get("nearbyAirports"))
+        if trip_type not in ("one-way", "round-trip") or (days <= 0 and not nearby):
+            return []
+
+        def airports(code):
+            if nearby:
+                return [airport.code for airport in AIRPORT_INDEX.nearby(code, NEARBY_KM, NEARBY_AIRPORTS)] or [code]
+            return [code]
+
+        origins = airports(search_info_json.get("originAirport"))
+        destinations = airports(search_info_json.get("destinationAirport"))
+        departure = search_info_json.get("departureDate")
+        grids = [("Outbound Flights", FlightGrid.around(origins, destinations, departure, days, earliest=self.todays_date), departure)] # type: ignore
+        if trip_type == "round-trip":
+            arrival = search_info_json.get("arrivalDate")
+            grids.append(("Inbound Flights", FlightGrid.around(destinations, origins, arrival, days, earliest=self.todays_date), arrival)) # type: ignore
+        return grids
+
+
+    def _flight_grid_search(self, search_info_json:dict, grids:list, output:list[str], on_token = None, deadline = None) -> str:
+        """Search every grid concurrently and show a price matrix per leg plus the cheapest options.
+        Searches that haven't finished shortly before the deadline are left out of the matrices."""
+
+        flexible = []
+        if search_info_json.get("flexibleDays"):
+            flexible.append(f"±{search_info_json.get("flexibleDays")} days")
+        if search_info_json.get("nearbyAirports"):
+            flexible.append("nearby airports")
+        output.insert(len(output) - 1, f"**Flexible:** {' and '.join(flexible)}")
+        output.append("---")
 
-        print("Running hotel agent.\n")
+        # The nearest dates and main airports of each leg first, up to FLIGHT_GRID_MAX searches split between the legs
+        per_grid = max(1, FLIGHT_GRID_MAX // len(grids))
+        grid_of = {}
+        for _, grid, center in grids:
+            for leg in grid.legs(center)[0:per_grid]:
+                grid_of[leg] = grid
+
+        emit = on_token or (lambda text: None)
+        emit(f"🔎 *Searching {len(grid_of)} date and airport combinations...*  \n")
+        with span("flights.grid", searches=len(grid_of)) as trace:
+            found, searched, errors = 0, 0, []
+            for leg, result, error in FLIGHT_SEARCH_EXECUTOR.search_many(
+                list(grid_of),
+                seat = search_info_json.get("seat"), # type: ignore
+                adults = search_info_json.get("numAdults"), # type: ignore
+                children = search_info_json.get("numChildren"), # type: ignore
+                session = self.session_id,
+                deadline = deadline.earlier(GRID_RENDER_SECONDS) if deadline is not None else None,
+            ):
+                cell = grid_of[leg].add(leg, result, error)
+                found += cell.price is not None
+                searched += 1
+                if error is not None:
+                    errors.append(error)
+                price = f"from ${cell.price:,.0f}" if cell.price is not None else "no flights found"
+                emit(f"✓ {leg.from_airport} → {leg.to_airport} {_short_date(leg.date)}: {price}  \n")
+            trace["found"] = found
+            trace["searched"] = searched
+
+        # With nothing to show, say why: out of time, or the flight search is down
+        if not found:
+            if searched < len(grid_of):
+                raise DeadlineExceeded("No time left for the flight grid")
+            for error in errors:
+                if _unfinished(error) == "unavailable":
+                    raise error
+
+        with span("format.flight"):
+            if searched < len(grid_of):
+                output.append(f"⏳ *Showing {searched} of {len(grid_of)} searches, the rest are taking too long. Ask again in a moment to see them all.*")
+                output.append("")
+            if not found:
+                output.append("")
+                output.append("⚠️ **No flights found for these dates and airports.**")
+                output.append("")
+                output.append("The flight search service may be temporarily unavailable.")
+                output.append("Please try again later.")
+            else:
+                for title, grid, _ in grids:
+                    output.append(f"### {title}")
+                    output += self._price_matrix(grid)
+                    output.append("")
+
+                output.append("### Cheapest Options")
+                if len(grids) == 2:
+                    for i, (total, out, back) in enumerate(cheapest_trips(grids[0][1], grids[1][1]), start=1):
+                        output.append(f"**{i}. ${total:,.0f} total**")
+                        output.append(f"Out: {self._grid_flight(out)}")
+                        output.append(f"Back: {self._grid_flight(back)}")
+                        output.append("")
+                else:
+                    for i, cell in enumerate(grids[0][1].cheapest(), start=1):
+                        output.append(f"**{i}. ${cell.price:,.0f}** {self._grid_flight(cell)}")
+                        output.append("")
 
-        prompt = f"""Use this chat history to extract the hotel information the user is currently looking for: 
-                chat history: {self.chat_history}
-                format your response as a json exactly structured like below and nothing else. If you can't find information for a section, make an educated guess based on the message history. 
-                If needed, today's date is {self.todays_date}.
+            output_string = ""
+            for line in output:
+                output_string += str(line) + "  \n"
 
-                {{
-                "city": three letter city iataCode,
-                "checkInDate": "YYY-MM-DD",
-                "checkOutDate": "YYY-MM-DD",
-                "numGuests": X  If no number is specified, assume it is 2
-                }}
-                """
-        
-        search_info = self.call_llm(prompt = prompt)
-        print(search_info)
-        print()
+        event("flight section", logging.DEBUG, session=self.session_id, text=output_string)
+
+        return str(output_string)
+
+
+    def _price_matrix(self, grid:FlightGrid) -> list[str]:
+        """Markdown table of the cheapest price per date (rows) and route (columns), with the cheapest in bold."""
+
+        routes = grid.routes()
+        if not routes:
+            return ["*No flights found.*"]
+        best = grid.cheapest(1)[0].price
+
+        lines = ["| Date | " + " | ".join(f"{origin} → {destination}" for origin, destination in routes) + " |",
+                 "|---" * (len(routes) + 1) + "|"]
+        for day in grid.dates:
+            cells = [grid.cells.get((origin, destination, day)) for origin, destination in routes]
+            if all(cell is None for cell in cells):
+                continue
+            prices = []
+            for cell in cells:
+                if cell is None:
+                    prices.append("·")
+                elif cell.price is None:
+                    prices.append("—")
+                else:
+                    prices.append(f"**${cell.price:,.0f}**" if cell.price == best else f"${cell.price:,.0f}")
+            lines.append(f"| {_short_date(day)} | " + " | ".join(prices) + " |")
+        return lines
+
+
+    def _grid_flight(self, cell) -> str:
+        flight = cell.flight
+        return (f"{_short_date(cell.leg.date)} {cell.leg.from_airport} → {cell.leg.to_airport} · **{flight.name}** ${cell.price:,.0f} · "
+                f"🛫 {flight.departure} → 🛬 {flight.arrival} · ⏱️ {flight.duration} | 🔄 {flight.stops} stop(s)")
+
+
+    def hotel_agent(self, deadline = None):
+        """Uses the hotel search parameters the understanding step extracted from the conversation.
+        Then uses the Amadeus API to search for available hotels, ranking whatever offers arrived by the deadline."""
+
+        # Hotel search parameters were already extracted and validated by the understanding step
+        search_info_json = self.understanding.get("hotel")
+        if search_info_json is None:
+            return self._missing_details_message("hotel", "the city and your check-in and check-out dates")
+
+        # Counts towards the prefetch hit rate, whether or not this search was prefetched after an earlier flight search.
+        # A prefetch of it that is still running is stopped and waited for, and this search carries on from the caches.
+        city = str(search_info_json.get("city")).strip().upper()
+        PREFETCHER.claim(stay_key(city, search_info_json.get("checkInDate"), search_info_json.get("checkOutDate"), # type: ignore
+                                  search_info_json.get("numGuests")), ("hotel_ids", city), deadline = deadline) # type: ignore
 
-        # convert to JSON
-        search_info_json = json.loads(search_info) # type: ignore
-        
         try:
-            # Get list of hotels by city code
-            hotel_response = self.amadeus.reference_data.locations.hotels.by_city.get(cityCode=search_info_json.get("city"))
-
-            # Make list of hotel Ids
-            hotel_ids = []
-            for hotel in hotel_response.data:
-                hotel_ids.append(str(hotel.get("hotelId")))
-
-            hotel_offers = self.amadeus.shopping.hotel_offers_search.get(
-                hotelIds = hotel_ids[0:30], # search through first number of hotel ids
-                checkInDate = search_info_json.get("checkInDate"),
-                checkOutDate = search_info_json.get("checkOutDate"),
-                adults = search_info_json.get("numGuests")
+            # Search offers across the city's hotel list (served from the local index for known cities)
+            # and keep the cheapest available hotels
+            hotels_to_display = HOTEL_SEARCH.search(
+                city = search_info_json.get("city"), # type: ignore
+                check_in = search_info_json.get("checkInDate"), # type: ignore
+                check_out = search_info_json.get("checkOutDate"), # type: ignore
+                adults = search_info_json.get("numGuests"), # type: ignore
+                top_k = 5,
+                session = self.session_id,
+                deadline = deadline,
             )
-            num_hotels = len(hotel_offers.data)
+        except (DeadlineExceeded, CircuitOpenError):
+            # Shown as still searching or unavailable
+            raise
         except Exception as e:
-            print(f"Hotel search error: {e}")
+            event("hotel search failed", logging.WARNING, session=self.session_id, error=str(e))
             output = ["### Hotel Search Parameters"]
             output.append(f"**Check-In:** {search_info_json.get('checkInDate')} | **Check-Out:** {search_info_json.get('checkOutDate')}")
             output.append(f"**City:** {search_info_json.get('city')}")
@@ -312,73 +762,70 @@ class Chatbot():
             
             return str(output_string)
 
-        if num_hotels >= 5:
-            hotels_to_display = hotel_offers.data[0:5]
-        elif num_hotels < 5 and num_hotels > 0:
-            hotels_to_display = hotel_offers.data[0:num_hotels]
-        else:
+        if len(hotels_to_display) == 0:
             return "Unable to find that match the search criteria."
         
-        output = ["### Hotel Search Parameters"]
-        output.append(f"**Check-In:** {hotels_to_display[0].get("offers")[0].get("checkInDate")} | **Check-Out:** {hotels_to_display[0].get("offers")[0].get("checkOutDate")}") # type: ignore
-        output.append(f"**City:** {search_info_json.get("city")}\n")
-        output.append("---")
+        with span("format.hotel", hotels=len(hotels_to_display)):
+            output = ["### Hotel Search Parameters"]
+            output.append(f"**Check-In:** {hotels_to_display[0].get("offers")[0].get("checkInDate")} | **Check-Out:** {hotels_to_display[0].get("offers")[0].get("checkOutDate")}") # type: ignore
+            output.append(f"**City:** {search_info_json.get("city")}\n")
+            output.append("---")
 
-        guests_info = "**Guests:** "
-        guest_details = []
-        for key in hotels_to_display[0].get("offers")[0].get("guests"): # type: ignore
-            guest_details.append(f"{key}: {hotels_to_display[0].get("offers")[0].get("guests").get(key)}") # type: ignore
-        guests_info += ", ".join(guest_details)
-        output.append(guests_info)
-        output.append("")
+            guests_info = "**Guests:** "
+            guest_details = []
+            for key in hotels_to_display[0].get("offers")[0].get("guests"): # type: ignore
+                guest_details.append(f"{key}: {hotels_to_display[0].get("offers")[0].get("guests").get(key)}") # type: ignore
+            guests_info += ", ".join(guest_details)
+            output.append(guests_info)
+            output.append("")
 
-        for hotel in hotels_to_display:
-            try:
-                output.append("---")
-                for key in hotel:
-                    if key == "hotel":
-                        output.append(f"### {hotel.get(key).get("name")}") # type: ignore
-
-                    elif key == "available":
-                        availability = "✅ Available" if hotel.get(key) else "❌ Not Available"
-                        output.append(f"**{availability}**") # type: ignore
-
-                    elif key == "offers":
-                        for offer in hotel.get(key): # type: ignore
-                            output.append(f"**Room:** {offer.get("room").get("typeEstimated").get("category")}")
-                            output.append(f"**Beds:** {offer.get("room").get("typeEstimated").get("beds")} {offer.get("room").get("typeEstimated").get("bedType")}")
-                            output.append(f"**Price:** {offer.get("price").get("currency")} ${offer.get("price").get("total")} total (${offer.get("price").get("variations").get("average").get("base")}/night)")
-                            output.append(f"*{offer.get("room").get("description").get("text")}*")
-                output.append("")
-            except Exception as e:
-                print(f"Error parsing hotel info: {e}")
+            for hotel in hotels_to_display:
+                try:
+                    output.append("---")
+                    for key in hotel:
+                        if key == "hotel":
+                            output.append(f"### {hotel.get(key).get("name")}") # type: ignore
+
+                        elif key == "available":
+                            availability = "✅ Available" if hotel.get(key) else "❌ Not Available"
+                            output.append(f"**{availability}**") # type: ignore
+
+                        elif key == "offers":
+                            for offer in hotel.get(key): # type: ignore
+                                output.append(f"**Room:** {offer.get("room").get("typeEstimated").get("category")}")
+                                output.append(f"**Beds:** {offer.get("room").get("typeEstimated").get("beds")} {offer.get("room").get("typeEstimated").get("bedType")}")
+                                output.append(f"**Price:** {offer.get("price").get("currency")} ${offer.get("price").get("total")} total (${offer.get("price").get("variations").get("average").get("base")}/night)")
+                                output.append(f"*{offer.get("room").get("description").get("text")}*")
+                    output.append("")
+                except Exception as e:
+                    event("hotel offer parse error", logging.WARNING, error=str(e))
 
-        output.append("")
-        output_string = ""                  
-        for line in output:
-            output_string += str(line) + "  \n"
+            output.append("")
+            output_string = ""                  
+            for line in output:
+                output_string += str(line) + "  \n"
 
-        print("\n\nHotel Output String:")
-        print(output_string)
+        event("hotel section", logging.DEBUG, session=self.session_id, text=output_string)
 
         return str(output_string)
 
 
-    def location_agent(self):
+    def location_agent(self, on_token = None, deadline = None):
         """Agent for answering questions about tourist attractions and activities at a location.
-        Doesn't use a special API to retrieve information, just prompts the LLM for what information it has on the location."""
+        Doesn't use a special API to retrieve information, just prompts the LLM for what information it has on the location.
+        If on_token is given, the section is streamed to it as it is generated."""
 
-        print("Running location agent.")
         location_prompt = f"""Provide helpful information about tourist attractions, activities, and things to do based on this request.
         Include specific recommendations, popular landmarks, and local experiences.
         Keep your response informative but concise.
         
         User request: {self.input_prompt}"""
-        response = self.call_llm(prompt = location_prompt)
 
-        print(response)
-        print()
-        
+        # Stream the header before the LLM starts answering
+        if on_token is not None:
+            on_token("### Location Information\n  \n---  \n")
+        response = self._answer("location", location_prompt, on_token, deadline)
+
         # Format response with header
         output = ["### Location Information\n"]
         output.append("---")
@@ -391,10 +838,10 @@ class Chatbot():
         return output_string
 
 
-    def general_info_agent(self):
-        """Agent for answering general questions that the other agents can't answer."""
+    def general_info_agent(self, on_token = None, deadline = None):
+        """Agent for answering general questions that the other agents can't answer.
+        If on_token is given, the answer is streamed to it as it is generated."""
 
-        print("Running general info agent.")
         general_prompt = f"""You are NaviBlu, a helpful travel assistant. Respond to this user query in a friendly and concise way.
         
         If the user is asking what you can do or what questions they can ask, provide a brief overview like:
@@ -410,24 +857,136 @@ class Chatbot():
         Otherwise, if their question is not related to your capabilities, you should provide helpful travel-related information for their question.
         
         User query: {self.input_prompt}"""
-        return self.call_llm(prompt = general_prompt)
+        return self._answer("general", general_prompt, on_token, deadline)
+
+
+    def _answer(self, agent:str, prompt:str, on_token = None, deadline = None) -> str:
+        """LLM answer for the location or general agent, reused from ANSWER_CACHES when the question was asked before."""
+
+        cache = ANSWER_CACHES[agent]
+        with span("answers.lookup", agent=agent) as trace:
+            response = cache.get(self.input_prompt)
+            trace["cache_hit"] = response is not None
+        if response is not None:
+            if on_token is not None:
+                on_token(response)
+            return response
+
+        response = self.call_llm(prompt = prompt, on_token = on_token, deadline = deadline)
+        cache.set(self.input_prompt, response)
+        return response
+
 
+    def _missing_details_message(self, search:str, details:str):
+        """Section shown when the understanding step couldn't extract usable search parameters."""
 
-    def call_llm(self, prompt):
-        """function for LLM calls."""
+        output = [f"### {search.capitalize()} Search"]
+        output.append(f"⚠️ I couldn't work out the details of your {search} search.")
+        output.append(f"Please include {details}.")
+        output.append("")
 
-        print("--Running call_llm.")
+        output_string = ""
+        for line in output:
+            output_string += str(line) + "  \n"
+
+        return output_string
+
+
+    def call_llm(self, prompt = None, messages = None, temperature = None, json_mode = False, on_token = None,
+                 priority = INTERACTIVE, deadline = None):
+        """function for LLM calls.
+        Either pass a single prompt, or a full list of messages. json_mode asks Groq for a JSON object response.
+        If on_token is given, the completion is streamed and on_token is called with each piece of text as it arrives;
+        the full text is still returned at the end.
+        Calls go through the shared scheduler; background work such as summarization should pass priority=BACKGROUND.
+        A call identical to one already in flight from another session waits for and shares that call's response.
+        Pass the turn's deadline to give up (with DeadlineExceeded) once it has passed."""
 
         # make chat history to send to LLM
-        history = [{
+        history = messages if messages is not None else [{
                     "role": "user",
                     "content": prompt,
                     }]
 
-        # Call LLM
-        completion = self.client.chat.completions.create(
-            model = self.LLM_model,
-            messages = history, # type: ignore
-        )
+        options = {}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if json_mode:
+            options["response_format"] = {"type": "json_object"}
+
+        # Identical requests made at the same time get the same response, so they are merged
+        key = (self.LLM_model, json.dumps(history, sort_keys=True, default=str), json.dumps(options, sort_keys=True),
+               on_token is not None, priority)
+
+        with span("llm", model=self.LLM_model, json_mode=json_mode, stream=on_token is not None, priority=priority) as trace:
+            if on_token is not None:
+                started = time.perf_counter()
+
+                def emit(piece):
+                    if "first_token_ms" not in trace:
+                        trace["first_token_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                    on_token(piece)
+
+                def stream_completion(publish):
+                    stream = SCHEDULER.call(
+                        "groq", self.client.chat.completions.create,
+                        session = self.session_id,
+                        priority = priority,
+                        deadline = deadline,
+                        model = self.LLM_model,
+                        messages = history, # type: ignore
+                        stream = True,
+                        **options
+                    )
+                    pieces = []
+                    for chunk in stream:
+                        piece = chunk.choices[0].delta.content if chunk.choices else None
+                        if piece:
+                            pieces.append(piece)
+                            publish(piece)
+                        # Groq reports token usage on the last chunk of a stream
+                        self._record_usage(trace, getattr(getattr(chunk, "x_groq", None), "usage", None))
+                    return "".join(pieces)
+
+                response, trace["merged"] = IN_FLIGHT["groq"].stream(key, stream_completion, emit, deadline)
+                return response
+
+            def complete():
+                # Call LLM
+                completion = SCHEDULER.call(
+                    "groq", self.client.chat.completions.create,
+                    session = self.session_id,
+                    priority = priority,
+                    deadline = deadline,
+                    model = self.LLM_model,
+                    messages = history, # type: ignore
+                    **options
+                )
+                self._record_usage(trace, getattr(completion, "usage", None))
+                return completion.choices[0].message.content
+
+            response, trace["merged"] = IN_FLIGHT["groq"].do(key, complete, deadline)
+            return response
+
+
+    def _record_usage(self, trace:dict, usage):
+        """Copy a Groq usage block's token counts into the current span."""
+        if usage is not None:
+            trace["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            trace["completion_tokens"] = getattr(usage, "completion_tokens", None)
+
+
+def _unfinished(error) -> str | None:
+    """"pending" for an error caused by running out of time, "unavailable" for one caused by an open circuit
+    breaker, None for anything else."""
+
+    if isinstance(error, DeadlineExceeded):
+        return "pending"
+    if isinstance(error, CircuitOpenError):
+        return "unavailable"
+    return None
+
 
-        return completion.choices[0].message.content
+def _short_date(day:str) -> str:
+    """Short date for tables, like Fri Mar 14 for 2025-03-14."""
+    return date.fromisoformat(day).strftime("%a %b %d")
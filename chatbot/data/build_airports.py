@@ -0,0 +1,63 @@
+# Regenerates airports.tsv.gz, the airport dataset bundled with the chatbot.
+#
+# Every airport with an IATA code comes from the airportsdata package (MIT License, (c) Mike Borsetti),
+# grouped into metro city codes with its IATA multi-airport city list. airport_overrides.tsv then sets the
+# city codes, names and aliases for the major airports and marks them as major.
+#
+#   pip install airportsdata
+#   python chatbot/data/build_airports.py
+
+import csv
+import gzip
+import os
+
+import airportsdata
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+OVERRIDES_PATH = os.path.join(DATA_DIR, "airport_overrides.tsv")
+OUTPUT_PATH = os.path.join(DATA_DIR, "airports.tsv.gz")
+
+COLUMNS = ["iata", "city_code", "city", "country", "lat", "lon", "major", "name", "city_aliases", "airport_aliases"]
+
+
+def load_overrides() -> list[list[str]]:
+    with open(OVERRIDES_PATH, encoding="utf-8") as file:
+        return [line.rstrip("\n").split("\t") for line in file if line.strip() and not line.startswith("#")]
+
+
+def load_metro_codes() -> dict:
+    """airport code -> (city code, city name) from airportsdata's IATA multi-airport city list."""
+
+    path = os.path.join(os.path.dirname(airportsdata.__file__), "iata_macs.csv")
+    with open(path, encoding="utf-8") as file:
+        return {row["Airport Code"]: (row["City Code"], row["City Name"]) for row in csv.DictReader(file)}
+
+
+def main():
+    airports = airportsdata.load("IATA")
+    metros = load_metro_codes()
+    rows = {}
+
+    for code, airport in airports.items():
+        city_code, city = metros.get(code, (code, airport["city"] or airport["name"]))
+        rows[code] = [code, city_code, city, airport["country"], f"{airport['lat']:.3f}", f"{airport['lon']:.3f}", "0",
+                      airport["name"], "", ""]
+
+    # Overrides come first in the output, so each city's primary airport is listed before its other airports
+    ordered = []
+    for code, city_code, city, country, name, city_aliases, airport_aliases in load_overrides():
+        row = rows.pop(code, [code, city_code, city, country, "", "", "0", name, "", ""])
+        row[1:4] = [city_code, city, country]
+        row[6:] = ["1", name, city_aliases, airport_aliases]
+        ordered.append(row)
+    ordered += sorted(rows.values())
+
+    with gzip.open(OUTPUT_PATH, "wt", encoding="utf-8", newline="") as file:
+        file.write("\t".join(COLUMNS) + "\n")
+        for row in ordered:
+            file.write("\t".join(value.replace("\t", " ") for value in row) + "\n")
+    print(f"Wrote {len(ordered)} airports to {OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
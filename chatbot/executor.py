@@ -0,0 +1,124 @@
+# Concurrent execution engine for the chatbot agents
+
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+from dataclasses import dataclass
+from scheduler import DeadlineExceeded
+from tracing import span
+
+
+@dataclass
+class AgentResult():
+    """Outcome of a single agent run."""
+    name: str
+    output: str = ""
+    error: Exception | None = None
+    duration: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class AgentExecutor():
+    """Runs agents concurrently on a bounded thread pool.
+
+    The agents spend almost all of their time waiting on Groq, fast_flights and Amadeus,
+    so threads are enough to overlap them. Turn latency becomes roughly the slowest agent
+    instead of the sum of all of them.
+
+    Agents can be given deadlines (a dict of name -> Deadline). An agent that hasn't finished grace seconds
+    after its deadline is given up on: its result is a DeadlineExceeded error and whatever it does later is
+    ignored, so a hung upstream call can't hold up the turn."""
+
+    def __init__(self, max_workers:int = 8, grace:float = 0.5):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="naviblu-agent")
+        self.grace = grace # time an agent gets past its deadline to hand back what it has
+
+
+    def run(self, agents:list, deadlines:dict | None = None) -> list[AgentResult]:
+        """Run a list of (name, callable) pairs concurrently.
+        Results are returned in the same order as the agents were given, and an agent that raises
+        is captured in its AgentResult instead of failing the other agents."""
+
+        deadlines = deadlines or {}
+        start = time.perf_counter()
+        futures = [(name, self.pool.submit(self._timed, name, agent)) for name, agent in agents]
+
+        results = []
+        for name, future in futures:
+            left = self._left(deadlines.get(name))
+            try:
+                results.append(future.result(timeout=None if left is None else max(0.0, left)))
+            except TimeoutError:
+                future.cancel()
+                results.append(self._timed_out(name, start))
+        return results
+
+
+    def stream(self, agents:list, deadlines:dict | None = None):
+        """Run a list of (name, callable) pairs concurrently and yield (name, text, result) events as they happen.
+
+        Each callable is called with an emit(text) function it can use to stream partial output.
+        Partial output is yielded as (name, text, None); when an agent finishes, (name, None, AgentResult) is yielded."""
+
+        deadlines = deadlines or {}
+        start = time.perf_counter()
+        events = queue.Queue()
+        for name, agent in agents:
+            self.pool.submit(self._streamed, name, agent, events)
+
+        pending = {name for name, _ in agents}
+        while pending:
+            lefts = [left for left in (self._left(deadlines.get(name)) for name in pending) if left is not None]
+            try:
+                event = events.get(timeout=max(0.0, min(lefts)) if lefts else None)
+            except queue.Empty:
+                for name in sorted(pending):
+                    left = self._left(deadlines.get(name))
+                    if left is not None and left <= 0:
+                        pending.discard(name)
+                        yield name, None, self._timed_out(name, start)
+                continue
+
+            # Output of an agent that was already given up on
+            if event[0] not in pending:
+                continue
+            if event[2] is not None:
+                pending.discard(event[0])
+            yield event
+
+
+    def _streamed(self, name:str, agent, events:queue.Queue):
+        emit = lambda text: events.put((name, text, None))
+        events.put((name, None, self._timed(name, lambda: agent(emit))))
+
+
+    def _timed(self, name:str, agent) -> AgentResult:
+        start = time.perf_counter()
+        try:
+            with span(f"agent.{name}"):
+                output = agent()
+            return AgentResult(name=name, output=str(output), duration=time.perf_counter() - start)
+        except Exception as e:
+            # Already logged by the span
+            return AgentResult(name=name, error=e, duration=time.perf_counter() - start)
+
+
+    def _left(self, deadline) -> float | None:
+        """Seconds until an agent with this deadline is given up on, or None to wait for it however long it takes."""
+
+        if deadline is None or deadline.expires_at is None:
+            return None
+        return deadline.expires_at + self.grace - time.monotonic()
+
+
+    def _timed_out(self, name:str, start:float) -> AgentResult:
+        return AgentResult(name=name, error=DeadlineExceeded(f"The {name} agent ran out of time"),
+                           duration=time.perf_counter() - start)
+
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,266 @@
+# Flight search helpers built around the fast-flights API
+
+import re
+from concurrent.futures import ALL_COMPLETED, ThreadPoolExecutor, TimeoutError, as_completed, wait
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from scheduler import INTERACTIVE, DeadlineExceeded
+from tracing import span
+
+
+def load_fast_flights():
+    """The fast_flights module (Flights API). It is only imported for the first search, since it pulls in its
+    scraping and protobuf dependencies that would otherwise add to every cold start."""
+
+    import fast_flights
+    return fast_flights
+
+
+def get_flights(**kwargs):
+    """fast_flights.get_flights, importing fast_flights on first use."""
+    return load_fast_flights().get_flights(**kwargs)
+
+
+@dataclass(frozen=True)
+class FlightLeg():
+    """One one-way leg of a trip."""
+    date: str
+    from_airport: str
+    to_airport: str
+
+
+def flight_cache_key(leg:FlightLeg, seat:str, adults:int, children:int) -> tuple:
+    """Normalized (origin airport, destination airport, date, seat, adults, children) tuple,
+    so the same search phrased differently by the LLM maps to the same cache entry."""
+
+    return (
+        str(leg.from_airport).strip().upper(),
+        str(leg.to_airport).strip().upper(),
+        date.fromisoformat(str(leg.date).strip()).isoformat(),
+        str(seat or "economy").strip().lower().replace(" ", "-"),
+        int(adults),
+        int(children or 0),
+    )
+
+
+def parse_price(price) -> float | None:
+    """Numeric value of a fast-flights price such as "$1,289", or None if it has none."""
+
+    digits = re.sub(r"[^\d.]", "", str(price or ""))
+    try:
+        return float(digits) if digits else None
+    except ValueError:
+        return None
+
+
+def cheapest_flight(result):
+    """The lowest priced flight in a fast-flights result, or None."""
+
+    priced = [(parse_price(flight.price), i, flight) for i, flight in enumerate(getattr(result, "flights", None) or [])]
+    priced = [entry for entry in priced if entry[0] is not None]
+    return min(priced)[2] if priced else None
+
+
+@dataclass
+class GridCell():
+    """Outcome of one search in a FlightGrid. flight is None when the search failed or found nothing."""
+    leg: FlightLeg
+    flight: object = None
+    price: float | None = None
+    error: Exception | None = None
+
+
+@dataclass
+class FlightGrid():
+    """Prices for one leg of a trip over a window of dates and a set of origin and destination airports."""
+    origins: list[str]
+    destinations: list[str]
+    dates: list[str]
+    cells: dict = field(default_factory=dict) # (origin, destination, date) -> GridCell
+
+
+    @classmethod
+    def around(cls, origins:list[str], destinations:list[str], center:str, days:int, earliest:str | None = None):
+        """Grid of every origin and destination airport on the dates within days of center, skipping dates before earliest."""
+
+        middle = date.fromisoformat(center)
+        dates = [(middle + timedelta(days=offset)).isoformat() for offset in range(-days, days + 1)]
+        return cls(list(origins), list(destinations), [day for day in dates if earliest is None or day >= earliest])
+
+
+    def legs(self, center:str | None = None) -> list[FlightLeg]:
+        """Every leg in the grid, most likely to be wanted first. Each leg is ranked by its days from center plus
+        the positions of its airports in the lists, so a truncated list still covers both dates and airports."""
+
+        middle = date.fromisoformat(center) if center else None
+        ordered = []
+        for day in self.dates:
+            offset = abs((date.fromisoformat(day) - middle).days) if middle else 0
+            for i, origin in enumerate(self.origins):
+                for j, destination in enumerate(self.destinations):
+                    if origin != destination:
+                        ordered.append((offset + i + j, offset, i + j, day, origin, destination))
+        return [FlightLeg(date=day, from_airport=origin, to_airport=destination) for *_, day, origin, destination in sorted(ordered)]
+
+
+    def add(self, leg:FlightLeg, result = None, error:Exception | None = None) -> GridCell:
+        flight = cheapest_flight(result) if result is not None else None
+        cell = GridCell(leg, flight, parse_price(flight.price) if flight is not None else None, error)
+        self.cells[(leg.from_airport, leg.to_airport, leg.date)] = cell
+        return cell
+
+
+    def cheapest(self, limit:int = 3) -> list[GridCell]:
+        priced = [cell for cell in self.cells.values() if cell.price is not None]
+        return sorted(priced, key=lambda cell: (cell.price, cell.leg.date))[0:limit]
+
+
+    def routes(self, limit:int = 4) -> list[tuple[str, str]]:
+        """The (origin, destination) pairs with results, cheapest first."""
+
+        best = {}
+        for (origin, destination, _), cell in self.cells.items():
+            if cell.price is not None:
+                best[(origin, destination)] = min(cell.price, best.get((origin, destination), cell.price))
+        return sorted(best, key=lambda route: best[route])[0:limit]
+
+
+def cheapest_trips(outbound:FlightGrid, inbound:FlightGrid, limit:int = 3) -> list[tuple[float, GridCell, GridCell]]:
+    """Cheapest (total, outbound cell, inbound cell) round trips that come back on or after the day they leave."""
+
+    outs = [cell for cell in outbound.cells.values() if cell.price is not None]
+    backs = [cell for cell in inbound.cells.values() if cell.price is not None]
+    trips = [(out.price + back.price, out.leg.date, back.leg.date, i, j) for i, out in enumerate(outs)
+             for j, back in enumerate(backs) if back.leg.date >= out.leg.date]
+    return [(total, outs[i], backs[j]) for total, _, _, i, j in sorted(trips)[0:limit]] # type: ignore
+
+
+class LegSearchError(Exception):
+    """Raised when one of the legs in a search fails.
+    results holds the legs that finished (None for the rest)."""
+
+    def __init__(self, leg_index:int, leg:FlightLeg, error:Exception, results:list):
+        super().__init__(f"Search for leg {leg_index} ({leg.from_airport} → {leg.to_airport} on {leg.date}) failed: {error}")
+        self.leg_index = leg_index
+        self.leg = leg
+        self.error = error
+        self.results = results
+
+
+class FlightSearchExecutor():
+    """Searches any number of flight legs concurrently.
+
+    fast-flights only supports one-way searches reliably, so round trips and multi-city trips
+    are searched as separate one-way legs. Each search can take several seconds with
+    fetch_mode="fallback", so the legs are issued at the same time instead of one after another."""
+
+    def __init__(self, max_workers:int = 8, fetch_mode:str = "fallback", cache=None, scheduler=None, grid_workers:int = 8,
+                 in_flight=None):
+        self.fetch_mode = fetch_mode
+        self.cache = cache # optional TTLCache shared by every session
+        self.scheduler = scheduler # optional Scheduler that rate-limits the fast-flights calls
+        self.in_flight = in_flight # optional SingleFlight that merges identical searches running at the same time
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="naviblu-flights")
+        # Grid searches get their own threads, so a large grid doesn't hold up exact searches queued behind it
+        self.grid_pool = ThreadPoolExecutor(max_workers=grid_workers, thread_name_prefix="naviblu-flight-grid")
+
+
+    def search(self, legs:list[FlightLeg], seat:str, adults:int, children:int,
+               session:str = "default", priority:int = INTERACTIVE, deadline=None) -> list:
+        """Search every leg concurrently and return the results in the same order as legs.
+        A failed leg doesn't stop the others: every leg gets until the deadline, then legs that haven't finished are
+        cancelled. If any leg failed or didn't finish, a LegSearchError is raised for the first one that failed
+        (with its own error), or else the first one that ran out of time, carrying the results of the legs that
+        finished. session, priority and deadline are passed on to the scheduler."""
+
+        futures = [self.pool.submit(self.search_leg, leg, seat, adults, children, session, priority, deadline) for leg in legs]
+        done, not_done = wait(futures, timeout=None if deadline is None else deadline.remaining(), return_when=ALL_COMPLETED)
+        for pending in not_done:
+            pending.cancel()
+
+        failed = [index for index, future in enumerate(futures) if future in done and future.exception() is not None]
+        unfinished = [index for index, future in enumerate(futures) if future in not_done]
+        if failed or unfinished:
+            results = [f.result() if f in done and f.exception() is None else None for f in futures]
+            index = (failed or unfinished)[0]
+            error = futures[index].exception() if failed else DeadlineExceeded("No time left for the flight search")
+            raise LegSearchError(index, legs[index], error, results) # type: ignore
+
+        return [future.result() for future in futures]
+
+
+    def search_many(self, legs:list[FlightLeg], seat:str, adults:int, children:int,
+                    session:str = "default", priority:int = INTERACTIVE, deadline=None):
+        """Search independent legs concurrently and yield (leg, result, error) as each one finishes.
+        Legs that normalize to the same search are only searched once, and a failed leg doesn't stop the others.
+        When the deadline passes, the legs still running are dropped and the generator just ends."""
+
+        unique = {}
+        for leg in legs:
+            unique.setdefault(flight_cache_key(leg, seat, adults, children), leg)
+        futures = {self.grid_pool.submit(self.search_leg, leg, seat, adults, children, session, priority, deadline): leg
+                   for leg in unique.values()}
+        try:
+            for future in as_completed(futures, timeout=None if deadline is None else deadline.remaining()):
+                error = future.exception()
+                yield futures[future], None if error else future.result(), error
+        except TimeoutError:
+            return
+        finally:
+            # The caller stopped early, so don't spend the rate limit on the rest
+            for future in futures:
+                future.cancel()
+
+
+    def search_leg(self, leg:FlightLeg, seat:str, adults:int, children:int,
+                   session:str = "default", priority:int = INTERACTIVE, deadline=None):
+        """Run a single one-way fast-flights search, answering from the cache when possible."""
+
+        key = flight_cache_key(leg, seat, adults, children)
+        if self.cache is None:
+            return self._shared(key, leg, seat, adults, children, session, priority, deadline)[0]
+
+        with span("flights.leg", route=f"{key[0]}-{key[1]}", date=key[2]) as trace:
+            result = self.cache.get(key)
+            trace["cache_hit"] = result is not None
+            if result is None:
+                result, trace["merged"] = self._shared(key, leg, seat, adults, children, session, priority, deadline)
+        return result
+
+
+    def _shared(self, key:tuple, leg:FlightLeg, seat:str, adults:int, children:int, session:str, priority:int,
+                deadline=None) -> tuple:
+        """Search and cache a leg, waiting on an identical search if one is already running.
+        Returns (result, merged). Searches are only merged within a priority, so interactive
+        searches never wait on background work that is still queued behind them."""
+
+        def fetch():
+            result = self._get_flights(leg, seat, adults, children, session, priority, deadline)
+            if self.cache is not None:
+                self.cache.set(key, result)
+            return result
+
+        if self.in_flight is None:
+            return fetch(), False
+        return self.in_flight.do((key, priority), fetch, deadline)
+
+
+    def _get_flights(self, leg:FlightLeg, seat:str, adults:int, children:int, session:str, priority:int, deadline=None):
+        if self.scheduler is None:
+            return self._fetch(leg, seat, adults, children)
+        return self.scheduler.call("fast_flights", self._fetch, leg, seat, adults, children,
+                                   session=session, priority=priority, deadline=deadline)
+
+
+    def _fetch(self, leg:FlightLeg, seat:str, adults:int, children:int):
+        fast_flights = load_fast_flights()
+        with span("fast_flights.get_flights", route=f"{leg.from_airport}-{leg.to_airport}"):
+            return get_flights(
+                flight_data=[
+                    fast_flights.FlightData(date=leg.date, from_airport=leg.from_airport, to_airport=leg.to_airport)
+                ],
+                trip="one-way",
+                seat=seat, # type: ignore
+                passengers=fast_flights.Passengers(adults=adults, children=children, infants_in_seat=0, infants_on_lap=0),
+                fetch_mode=self.fetch_mode, # type: ignore
+            )
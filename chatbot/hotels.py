@@ -0,0 +1,234 @@
+# Hotel search helpers built around the Amadeus API
+
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import numpy as np
+from scheduler import BACKGROUND, INTERACTIVE, DeadlineExceeded
+from tracing import event, span
+
+# Cities the hotel-ID index is warmed for ahead of time, roughly in order of how often they're asked about
+POPULAR_CITIES = [
+    "NYC", "LON", "PAR", "TYO", "LAX", "CHI", "ROM", "BCN", "MIA", "LAS",
+    "SFO", "ORL", "WAS", "BOS", "AMS", "BER", "MAD", "DXB", "SIN", "HKG",
+    "BKK", "SYD", "TOR", "YVR", "MEX", "CUN", "LIS", "DUB", "IST", "SEA",
+    "ATL", "DFW", "DEN", "CLT", "SAN", "HNL", "PRG", "VIE", "MIL", "ATH",
+]
+
+
+class OfferTable():
+    """Columnar view of hotel offers so they can be ranked with NumPy instead of Python loops.
+    Each row is one offer; hotel holds the index of the hotel record the offer belongs to."""
+
+    def __init__(self, hotels:list[dict]):
+        hotel_index, price_total, per_night, currency, beds, available = [], [], [], [], [], []
+        for i, hotel in enumerate(hotels):
+            for offer in hotel.get("offers") or []:
+                price = offer.get("price") or {}
+                room = (offer.get("room") or {}).get("typeEstimated") or {}
+                hotel_index.append(i)
+                price_total.append(_to_float(price.get("total")))
+                per_night.append(_to_float(((price.get("variations") or {}).get("average") or {}).get("base")))
+                currency.append(str(price.get("currency", "")))
+                beds.append(_to_int(room.get("beds")))
+                available.append(bool(hotel.get("available", True)))
+
+        self.hotels = hotels
+        self.hotel = np.asarray(hotel_index, dtype=np.int32)
+        self.price_total = np.asarray(price_total, dtype=np.float64)
+        self.per_night = np.asarray(per_night, dtype=np.float64)
+        self.currency = np.asarray(currency, dtype=object)
+        self.beds = np.asarray(beds, dtype=np.int16)
+        self.available = np.asarray(available, dtype=bool)
+
+
+    def __len__(self):
+        return len(self.hotel)
+
+
+    def top_k(self, k:int) -> list[dict]:
+        """The k cheapest available hotels, cheapest first, each with its offers sorted by price.
+        Unavailable or unpriced offers sort after every priced one, and hotels without a priced offer are left out."""
+
+        if len(self) == 0 or k <= 0:
+            return []
+
+        price = np.where(self.available & ~np.isnan(self.price_total), self.price_total, np.inf)
+
+        # Cheapest offer per hotel: sort by (hotel, price) and keep the first row of each hotel
+        order = np.lexsort((price, self.hotel))
+        hotels, first = np.unique(self.hotel[order], return_index=True)
+        best_price = price[order][first]
+        priced = np.isfinite(best_price)
+        hotels, best_price = hotels[priced], best_price[priced]
+        if len(hotels) == 0:
+            return []
+
+        # Partial selection of the k cheapest hotels, then sort just those k
+        k = min(k, len(hotels))
+        chosen = np.argpartition(best_price, k - 1)[:k]
+        chosen = chosen[np.argsort(best_price[chosen], kind="stable")]
+
+        ranked = []
+        for h in hotels[chosen]:
+            # A hotel's offers are stored in consecutive rows, in their original order
+            rows = np.flatnonzero(self.hotel == h)
+            offer_order = np.argsort(price[rows], kind="stable")
+            hotel = dict(self.hotels[h])
+            hotel["offers"] = [hotel["offers"][i] for i in offer_order]
+            ranked.append(hotel)
+        return ranked
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_int(value) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+class HotelSearch():
+    """Amadeus hotel lookups backed by two caches.
+
+    The city → hotel-ID index is reference data that almost never changes, so it is kept for a long time
+    and can be warmed ahead of time. Hotel offers change constantly, so they are only cached briefly.
+    For a city that is already indexed, a hotel search only costs the offers calls upstream."""
+
+    def __init__(self, get_amadeus, id_index, offers_cache, pool:ThreadPoolExecutor | None = None,
+                 batch_size:int = 30, max_hotels:int = 300, scheduler=None, in_flight=None):
+        self.get_amadeus = get_amadeus # returns the Amadeus client, so it's only built when first needed
+        self.id_index = id_index # TTLCache: city code -> list of hotel ids
+        self.offers_cache = offers_cache # TTLCache: (hotel ids, dates, adults) -> list of offers
+        self.pool = pool # bounds how many offer batches run at once across all sessions
+        self.batch_size = batch_size # hotel ids per hotel_offers_search call
+        self.max_hotels = max_hotels # cap on hotel ids searched per request, to protect the API quota
+        self.scheduler = scheduler # optional Scheduler that rate-limits the Amadeus calls
+        self.in_flight = in_flight # optional SingleFlight that merges identical Amadeus calls running at the same time
+
+
+    def search(self, city:str, check_in:str, check_out:str, adults:int, top_k:int = 5,
+               session:str = "default", priority:int = INTERACTIVE, deadline=None, stop=None) -> list[dict]:
+        """Search offers across the city's hotel list in concurrent batches and return the top_k cheapest hotels.
+        A failed batch, or one that isn't done by the deadline, is skipped; the error is only raised if every batch failed.
+
+        Background searches run their batches one at a time on the calling thread instead of on the shared pool,
+        so they never queue ahead of interactive batches there. Setting the stop event ends one before its next
+        Amadeus call, including one still waiting for the rate limit."""
+
+        hotel_ids = self.hotel_ids(city, session, priority, deadline, stop)[0:self.max_hotels]
+        batches = [hotel_ids[i:i + self.batch_size] for i in range(0, len(hotel_ids), self.batch_size)]
+
+        hotels, errors = [], []
+        if self.pool is None or len(batches) <= 1 or priority == BACKGROUND:
+            for batch in batches:
+                if stop is not None and stop.is_set():
+                    break
+                try:
+                    hotels.extend(self.offers(batch, check_in, check_out, adults, session, priority, deadline, stop))
+                except Exception as e:
+                    if stop is not None and stop.is_set():
+                        break
+                    errors.append(e)
+        else:
+            futures = [self.pool.submit(self.offers, batch, check_in, check_out, adults, session, priority, deadline)
+                       for batch in batches]
+            for future in futures:
+                try:
+                    hotels.extend(future.result(timeout=None if deadline is None else deadline.remaining()))
+                except TimeoutError:
+                    future.cancel()
+                    errors.append(DeadlineExceeded("No time left for the hotel search"))
+                except Exception as e:
+                    errors.append(e)
+
+        if errors:
+            event("hotel offer batches failed", logging.WARNING, city=city, failed=len(errors), batches=len(batches), error=str(errors[0]))
+            if len(errors) == len(batches):
+                raise errors[0]
+
+        with span("hotels.rank", offers=len(hotels)):
+            return OfferTable(hotels).top_k(top_k)
+
+
+    def hotel_ids(self, city:str, session:str = "default", priority:int = INTERACTIVE, deadline=None, stop=None) -> list[str]:
+        """All hotel ids Amadeus knows for a city code."""
+
+        city = str(city).strip().upper()
+        with span("amadeus.hotels_by_city", city=city) as trace:
+            hotel_ids = self.id_index.get(city)
+            trace["cache_hit"] = hotel_ids is not None
+            if hotel_ids is None:
+                def fetch():
+                    hotel_response = self._call(self.get_amadeus().reference_data.locations.hotels.by_city.get, session, priority,
+                                                deadline, stop, cityCode=city)
+                    hotel_ids = [str(hotel.get("hotelId")) for hotel in hotel_response.data]
+                    self.id_index.set(city, hotel_ids)
+                    return hotel_ids
+                hotel_ids, trace["merged"] = self._shared(("hotels_by_city", city, priority), fetch, deadline)
+        return hotel_ids
+
+
+    def offers(self, hotel_ids:list[str], check_in:str, check_out:str, adults:int,
+               session:str = "default", priority:int = INTERACTIVE, deadline=None, stop=None) -> list[dict]:
+        """Available offers for the given hotels and stay."""
+
+        key = (tuple(hotel_ids), str(check_in), str(check_out), int(adults))
+        with span("amadeus.hotel_offers", hotels=len(hotel_ids)) as trace:
+            offers = self.offers_cache.get(key)
+            trace["cache_hit"] = offers is not None
+            if offers is None:
+                def fetch():
+                    hotel_offers = self._call(
+                        self.get_amadeus().shopping.hotel_offers_search.get, session, priority, deadline, stop,
+                        hotelIds = hotel_ids,
+                        checkInDate = check_in,
+                        checkOutDate = check_out,
+                        adults = adults
+                    )
+                    offers = list(hotel_offers.data or [])
+                    self.offers_cache.set(key, offers)
+                    return offers
+                offers, trace["merged"] = self._shared(("hotel_offers", key, priority), fetch, deadline)
+        return offers
+
+
+    def max_calls(self, city:str) -> int:
+        """The most Amadeus calls a search for city can make: the hotel list if it isn't indexed yet, then every offer batch."""
+
+        indexed = str(city).strip().upper() in self.id_index
+        return (0 if indexed else 1) + math.ceil(self.max_hotels / self.batch_size)
+
+
+    def warm(self, cities:list[str]) -> dict:
+        """Load the hotel-ID index for each city that isn't already indexed.
+        Returns the number of hotel ids per city, skipping cities that failed."""
+
+        indexed = {}
+        for city in cities:
+            try:
+                indexed[city] = len(self.hotel_ids(city, session="warm-up", priority=BACKGROUND))
+            except Exception as e:
+                event("hotel index warm-up failed", logging.WARNING, city=city, error=str(e))
+        return indexed
+
+
+    def _shared(self, key:tuple, fetch, deadline=None) -> tuple:
+        """Run fetch(), or wait on an identical call that is already running. Returns (result, merged).
+        Keys include the priority, so interactive calls never wait on queued background work."""
+
+        if self.in_flight is None:
+            return fetch(), False
+        return self.in_flight.do(key, fetch, deadline)
+
+
+    def _call(self, fn, session:str, priority:int, deadline=None, stop=None, **kwargs):
+        if self.scheduler is None:
+            return fn(**kwargs)
+        return self.scheduler.call("amadeus", fn, session=session, priority=priority, deadline=deadline, stop=stop, **kwargs)
@@ -0,0 +1,208 @@
+# Local fast-path intent classifier, so obvious queries don't need an LLM round trip to be classified
+
+import json
+import os
+import re
+import threading
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+import numpy as np
+
+CATEGORIES = ["flight", "hotel", "location", "general"]
+
+# Training examples: the examples from the LLM classifier prompt plus a few more of the same kind.
+# Queries classified by the LLM at runtime can be logged and added on top of these.
+SEED_EXAMPLES = [
+    ("can you find flights to New York?", ["flight"]),
+    ("can you find hotels in vancouver this weekend?", ["hotel"]),
+    ("what are hotels near popular tourist locations in Orlando?", ["hotel", "location"]),
+    ("help me plan an entire trip from Charlotte to London this weekend.", ["flight", "hotel", "location"]),
+    ("what are some popular activities to do in Wellington, New Zealand?", ["location"]),
+    ("How far is Tokyo from New York?", ["general"]),
+    ("what questions can I ask?", ["general"]),
+    ("what can you do?", ["general"]),
+    ("find me a flight from Charlotte to Denver next Friday", ["flight"]),
+    ("cheapest flights from NYC to Paris in March", ["flight"]),
+    ("I need a one-way ticket to Chicago tomorrow", ["flight"]),
+    ("are there any direct flights from Atlanta to Seattle?", ["flight"]),
+    ("book a round trip to Miami for 2 adults", ["flight"]),
+    ("fly me to Los Angeles on December 3rd in business class", ["flight"]),
+    ("show me airfare to Rome for next month", ["flight"]),
+    ("where can I stay in Barcelona next week?", ["hotel"]),
+    ("find a hotel in Chicago for 3 nights", ["hotel"]),
+    ("any cheap places to stay in Tokyo from June 1 to June 5?", ["hotel"]),
+    ("I need accommodation in Boston for two guests", ["hotel"]),
+    ("show me hotels in Paris for this weekend", ["hotel"]),
+    ("book a room in Las Vegas for Friday night", ["hotel"]),
+    ("what should I see in Rome?", ["location"]),
+    ("things to do in Chicago", ["location"]),
+    ("what are the best attractions in Paris?", ["location"]),
+    ("top sights to visit in Barcelona", ["location"]),
+    ("recommend some museums and landmarks in London", ["location"]),
+    ("what is there to do in Denver at night?", ["location"]),
+    ("family friendly activities in Orlando", ["location"]),
+    ("best places to explore in Kyoto", ["location"]),
+    ("do I need a visa to travel to Japan?", ["general"]),
+    ("what's the best time of year to visit Iceland?", ["general"]),
+    ("what currency do they use in Thailand?", ["general"]),
+    ("how much should I tip in Italy?", ["general"]),
+    ("what is the time difference between London and New York?", ["general"]),
+    ("hello", ["general"]),
+    ("who are you?", ["general"]),
+    ("thanks for the help!", ["general"]),
+    ("what should I pack for a beach vacation?", ["general"]),
+    ("find flights and hotels for a trip to Seattle next week", ["flight", "hotel"]),
+    ("I want to fly to Denver and need a hotel there", ["flight", "hotel"]),
+    ("plan a weekend in Nashville with flights, hotels and things to do", ["flight", "hotel", "location"]),
+    ("hotels in Rome and what to see while I'm there", ["hotel", "location"]),
+    ("flights to Cancun and fun activities there", ["flight", "location"]),
+]
+
+# Strong keyword signals, added to the model as extra features
+KEYWORD_RULES = {
+    "flight": re.compile(r"\b(flights?|fly|flying|airfares?|airlines?|plane|tickets?|round[- ]trip|one[- ]way|nonstop|direct)\b"),
+    "hotel": re.compile(r"\b(hotels?|motels?|stay|staying|accommodations?|lodging|hostels?|resorts?|rooms?|nights?)\b"),
+    "location": re.compile(r"\b(things to do|attractions?|activities|sights?|sightseeing|landmarks?|museums?|explore|tourist|see|visit)\b"),
+    "general": re.compile(r"\b(what can you do|who are you|questions can i ask|visa|currency|tip|time difference|how far|weather|pack|hello|hi|thanks?)\b"),
+}
+
+
+@dataclass
+class IntentPrediction():
+    categories: list[str]
+    confidence: float
+    probabilities: dict = field(default_factory=dict)
+
+
+class IntentClassifier():
+    """Multi-label linear classifier over hashed word n-grams plus keyword-rule features.
+
+    One logistic regression per category, trained with NumPy on a few dozen examples in milliseconds,
+    and predicting in microseconds. The confidence of a prediction is the least certain of the
+    per-category decisions, so the caller can fall back to the LLM classifier when it is low."""
+
+    def __init__(self, dim:int = 2 ** 12, log_path:str | None = None):
+        self.dim = dim
+        self.log_path = log_path
+        self.weights = np.zeros((dim + len(CATEGORIES), len(CATEGORIES)))
+        self.bias = np.zeros(len(CATEGORIES))
+        # Until it is trained every prediction has confidence 0.5, so nothing skips the LLM
+        self.trained = False
+        # (confidence, local categories == LLM categories) for recent LLM-classified queries
+        self.comparisons = deque(maxlen=10000)
+        self._lock = threading.Lock()
+
+
+    def train(self):
+        """Train on SEED_EXAMPLES plus any logged queries. Takes a few hundred milliseconds, so a server can
+        start with an untrained classifier and run this in the background."""
+        self.fit(SEED_EXAMPLES + self.logged_examples())
+
+
+    def active_features(self, text:str) -> list[int]:
+        """Indices of the non-zero (binary) features: hashed unigrams and bigrams, then one per matching keyword rule."""
+
+        text = text.lower()
+        words = re.findall(r"[a-z0-9']+", text)
+        active = {zlib.crc32(gram.encode()) % self.dim for gram in words + [f"{a} {b}" for a, b in zip(words, words[1:])]}
+        active.update(self.dim + i for i, category in enumerate(CATEGORIES) if KEYWORD_RULES[category].search(text))
+        return sorted(active)
+
+
+    def features(self, text:str) -> np.ndarray:
+        x = np.zeros(self.dim + len(CATEGORIES))
+        x[self.active_features(text)] = 1.0
+        return x
+
+
+    def fit(self, examples:list, epochs:int = 300, learning_rate:float = 0.5, l2:float = 1e-3):
+        """Full-batch gradient descent on the logistic loss, one output per category."""
+
+        X = np.stack([self.features(text) for text, _ in examples])
+        Y = np.array([[category in labels for category in CATEGORIES] for _, labels in examples], dtype=np.float64)
+        weights = np.zeros((X.shape[1], len(CATEGORIES)))
+        bias = np.zeros(len(CATEGORIES))
+        for _ in range(epochs):
+            error = _sigmoid(X @ weights + bias) - Y
+            weights -= learning_rate * (X.T @ error / len(X) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+        self.weights, self.bias = weights, bias
+        self.trained = True
+
+
+    def predict(self, text:str) -> IntentPrediction:
+        # Features are binary, so the dot product is just the sum of the active weight rows
+        probabilities = _sigmoid(self.weights[self.active_features(text)].sum(axis=0) + self.bias)
+        categories = [category for category, p in zip(CATEGORIES, probabilities) if p >= 0.5]
+        if not categories:
+            categories = [CATEGORIES[int(np.argmax(probabilities))]]
+        confidence = float(np.min(np.maximum(probabilities, 1 - probabilities)))
+        return IntentPrediction(categories, confidence, dict(zip(CATEGORIES, probabilities.round(3).tolist())))
+
+
+    def record(self, text:str, prediction:IntentPrediction, llm_categories:list[str]):
+        """Compare a local prediction with the LLM's answer for the same query, and log the query for retraining."""
+
+        agreed = sorted(prediction.categories) == sorted(llm_categories)
+        with self._lock:
+            if self.trained:
+                self.comparisons.append((prediction.confidence, agreed))
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as log_file:
+                    log_file.write(json.dumps({"text": text, "categories": llm_categories}) + "\n")
+
+
+    def logged_examples(self) -> list:
+        if not self.log_path or not os.path.exists(self.log_path):
+            return []
+        examples = []
+        with open(self.log_path, encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    entry = json.loads(line)
+                    examples.append((entry["text"], [c for c in entry["categories"] if c in CATEGORIES]))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+        return examples
+
+
+    def metrics(self, thresholds:tuple = (0.6, 0.7, 0.8, 0.9, 0.95)) -> dict:
+        """Agreement with the LLM overall, and for each candidate threshold how many queries
+        would have skipped the LLM (coverage) and how often those agreed with it (accuracy)."""
+
+        with self._lock:
+            comparisons = list(self.comparisons)
+
+        report = {"compared": len(comparisons), "agreement": None, "thresholds": {}}
+        if not comparisons:
+            return report
+
+        confidence = np.array([c for c, _ in comparisons])
+        agreed = np.array([a for _, a in comparisons])
+        report["agreement"] = float(agreed.mean())
+        for threshold in thresholds:
+            covered = confidence >= threshold
+            report["thresholds"][threshold] = {
+                "coverage": float(covered.mean()),
+                "accuracy": float(agreed[covered].mean()) if covered.any() else None,
+            }
+        return report
+
+
+    def gauges(self) -> list[tuple[str, dict, float]]:
+        """metrics() as (name, labels, value) gauges, for METRICS.register_gauges()."""
+
+        report = self.metrics()
+        gauges = [("intent_compared", {}, report["compared"])]
+        if report["agreement"] is not None:
+            gauges.append(("intent_agreement", {}, report["agreement"]))
+        for threshold, stats in report["thresholds"].items():
+            for key in ("coverage", "accuracy"):
+                if stats[key] is not None:
+                    gauges.append((f"intent_{key}", {"threshold": threshold}, stats[key]))
+        return gauges
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
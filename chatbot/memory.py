@@ -0,0 +1,161 @@
+# Token-budgeted conversation memory with rolling summarization
+
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from tracing import event
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and a travel assistant.
+Keep what matters for later requests: destinations, origins, dates, number of travellers, budget and preferences.
+Respond with the updated summary only, in at most {max_words} words.
+
+Summary so far: {summary}
+
+New turns:
+{turns}"""
+
+
+def estimate_tokens(text:str) -> int:
+    """Rough token count (about 4 characters per token for English), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+@dataclass(slots=True)
+class Turn():
+    """One message in the conversation. Assistant turns hold a compact record of what was shown,
+    not the rendered markdown."""
+    role: str
+    content: str
+    tokens: int
+
+
+class ConversationMemory():
+    """Conversation history that keeps prompt size roughly constant regardless of session length.
+
+    Recent turns are kept verbatim while they fit in token_budget. Older turns are folded into a
+    running summary by compact(), using summarizer(prompt) if given (e.g. Chatbot.call_llm)."""
+
+    def __init__(self, system_prompt:str, token_budget:int = 1500, summary_tokens:int = 250, keep_recent:int = 2,
+                 summarizer = None):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget # tokens for summary + recent turns, not counting the system prompt
+        self.summary_tokens = summary_tokens
+        self.keep_recent = keep_recent # turns always kept verbatim
+        self.summarizer = summarizer
+
+        self.summary = ""
+        self.turns: list[Turn] = []
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+
+
+    def add_user_turn(self, text:str):
+        with self._lock:
+            self.turns.append(Turn("user", text, estimate_tokens(text)))
+
+
+    def add_assistant_turn(self, understanding:dict, answers:dict | None = None, answer_chars:int = 300):
+        """Record an assistant turn as the search parameters that were used, plus the start of any free-text answers."""
+
+        record = {}
+        for search in ("flight", "hotel"):
+            if understanding.get(search):
+                record[f"{search}Search"] = understanding[search]
+        for name, answer in (answers or {}).items():
+            if answer:
+                answer = " ".join(str(answer).split())
+                record[f"{name}Answer"] = answer if len(answer) <= answer_chars else answer[:answer_chars] + "…"
+
+        content = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.turns.append(Turn("assistant", content, estimate_tokens(content)))
+
+
+    def messages(self) -> list[dict]:
+        """The system prompt, the running summary and as many recent turns as fit in the token budget."""
+
+        with self._lock:
+            messages = [{"role": "system", "content": self.system_prompt}]
+            budget = self.token_budget
+            if self.summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+                budget -= estimate_tokens(self.summary)
+
+            recent = []
+            for i, turn in enumerate(reversed(self.turns)):
+                if turn.tokens > budget and i >= self.keep_recent:
+                    break
+                recent.append({"role": turn.role, "content": turn.content})
+                budget -= turn.tokens
+            messages.extend(reversed(recent))
+            return messages
+
+
+    def compact(self):
+        """Fold the oldest turns into the summary until the remaining turns fit the budget.
+        Cheap to call after every turn; it only summarizes when the budget is exceeded."""
+
+        # The summarizer call can be slow, so it runs outside the main lock; new turns can still be added meanwhile
+        with self._compact_lock:
+            with self._lock:
+                budget = self.token_budget - self.summary_tokens
+                used = sum(turn.tokens for turn in self.turns)
+                if used <= budget:
+                    return
+
+                # Fold down to half the budget so the summarizer runs every few turns rather than every turn
+                fold = 0
+                while used > budget // 2 and len(self.turns) - fold > self.keep_recent:
+                    used -= self.turns[fold].tokens
+                    fold += 1
+                if fold == 0:
+                    return
+                summary, old_turns = self.summary, self.turns[:fold]
+
+            new_summary = self._summarize(summary, old_turns)
+
+            with self._lock:
+                self.summary = new_summary
+                del self.turns[:fold]
+
+
+    def to_state(self) -> dict:
+        """The summary and turns as plain JSON-able data, for storing an idle session."""
+
+        with self._lock:
+            return {"summary": self.summary, "turns": [[turn.role, turn.content, turn.tokens] for turn in self.turns]}
+
+
+    def load_state(self, state:dict):
+        """Replace the summary and turns with ones saved by to_state()."""
+
+        with self._lock:
+            self.summary = state.get("summary", "")
+            self.turns = [Turn(role, content, tokens) for role, content, tokens in state.get("turns", [])]
+
+
+    def __len__(self):
+        return len(self.turns)
+
+
+    def _summarize(self, summary:str, turns:list[Turn]) -> str:
+        turns_text = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        if self.summarizer is not None:
+            try:
+                prompt = SUMMARY_PROMPT.format(max_words=int(self.summary_tokens * 0.75), summary=summary or "(none)", turns=turns_text)
+                new_summary = str(self.summarizer(prompt)).strip()
+                if new_summary:
+                    return self._truncate(new_summary)
+            except Exception as e:
+                event("summarization failed", logging.WARNING, error=str(e))
+
+        # Without an LLM, keep the most recent part of the old turns
+        return self._truncate(f"{summary} {turns_text}".strip(), keep_end=True)
+
+
+    def _truncate(self, text:str, keep_end:bool = False) -> str:
+        max_chars = self.summary_tokens * 4
+        if len(text) <= max_chars:
+            return text
+        return "…" + text[-max_chars:] if keep_end else text[:max_chars] + "…"
@@ -0,0 +1,180 @@
+# Speculative prefetching of the lookups a conversation is likely to need next
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import date
+from scheduler import Deadline, TokenBucket
+from tracing import METRICS, span
+
+
+def stay_key(city:str, check_in:str, check_out:str, guests:int) -> tuple:
+    """Key a hotel search is prefetched and claimed under."""
+    return ("hotel", str(city).strip().upper(), str(check_in), str(check_out), int(guests or 1))
+
+
+def hotel_stays(flight:dict, city_code = lambda code: code) -> list[tuple[str, str, str, int]]:
+    """(city, check-in, check-out, guests) for the stays a flight search implies: the destination between the
+    outbound and return flights of a round trip, and each stop between two legs of a multi-city trip.
+    city_code turns an airport code into its city code (AirportIndex.city_code)."""
+
+    guests = int(flight.get("numAdults") or 1)
+    if flight.get("tripType") == "multi-city":
+        legs = flight.get("legs") or []
+        stays = [(city_code(leg.get("toAirport")), leg.get("date"), after.get("date")) for leg, after in zip(legs, legs[1:])]
+        home = city_code(legs[0].get("fromAirport")) if legs else None
+    elif flight.get("tripType") == "round-trip":
+        stays = [(flight.get("destinationCity"), flight.get("departureDate"), flight.get("arrivalDate"))]
+        home = flight.get("originCity")
+    else:
+        return []
+
+    result = []
+    for city, check_in, check_out in stays:
+        try:
+            nights = (date.fromisoformat(check_out) - date.fromisoformat(check_in)).days
+        except (TypeError, ValueError):
+            continue
+        if city and city != home and nights > 0:
+            result.append((city, check_in, check_out, guests))
+    return result
+
+
+class Prefetcher():
+    """Runs lookups the next turn will probably ask for in the background, and counts how often that pays off.
+
+    submit() starts a lookup that fills the caches the real request reads from. Each lookup is charged its worst-case
+    cost in upstream calls against a budget of budget calls per window seconds, and is skipped when that doesn't fit
+    or when the same key was already prefetched. The real request calls claim() with the keys a prefetch of it would
+    have used: a key prefetched in the last ttl seconds is a hit (for every session that asks), one still being
+    prefetched is late. A late claim takes the lookup over: the prefetch is stopped before its next upstream call
+    (including one still queued for the rate limit at background priority) and the claim only waits for a call it
+    already has on the wire. The real request then finds everything fetched so far in the caches and makes the
+    calls that are left itself, at its own priority, instead of repeating the prefetch's calls next to it.
+
+    stats() reports hits and misses like a cache, so it can be registered with METRICS.register_cache()."""
+
+    def __init__(self, budget:float, window:float = 3600, ttl:float = 300, timeout:float = 30, max_workers:int = 2):
+        self.ttl = ttl
+        self.timeout = timeout # seconds each lookup may take once it starts
+
+        self.submitted = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.hits = 0
+        self.late = 0
+        self.misses = 0
+        self.used = 0
+        self.wasted = 0
+
+        self._budget = TokenBucket(budget / window, budget)
+        self._prefetched = OrderedDict() # key -> [expires at, done, claimed, stop event, future]
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="naviblu-prefetch")
+
+
+    def submit(self, key:tuple, cost:float, fn) -> bool:
+        """Call fn(deadline=..., stop=...) in the background, unless key is already prefetched or cost upstream calls
+        don't fit in the budget. fn should return early once the stop event is set. Returns whether the lookup was started."""
+
+        with self._lock:
+            self._expire(time.time())
+            if key in self._prefetched:
+                return False
+            if self._budget.burst < cost or self._budget.take(cost) > 0:
+                self.skipped += 1
+                METRICS.increment("prefetch_total", kind=key[0], outcome="skipped")
+                return False
+            entry = self._prefetched[key] = [time.time() + self.ttl, False, False, threading.Event(), None]
+            self.submitted += 1
+            entry[4] = self._pool.submit(self._run, key, entry[3], fn)
+        return True
+
+
+    def claim(self, *keys, deadline=None) -> bool:
+        """Record a real lookup that a prefetch of any of keys would have served. Returns whether one had finished.
+        A prefetch that is still running is stopped, and waited for until a call it has on the wire returns or the deadline."""
+
+        outcome, running = "miss", None
+        with self._lock:
+            self._expire(time.time())
+            for key in keys:
+                entry = self._prefetched.get(key)
+                if entry is not None:
+                    outcome = "hit" if entry[1] else "late"
+                    if not entry[1]:
+                        entry[3].set()
+                        running = entry[4]
+                    if not entry[2]:
+                        entry[2] = True
+                        self.used += 1
+                    break
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "late":
+                self.late += 1
+            else:
+                self.misses += 1
+        METRICS.increment("prefetch_claims_total", result=outcome)
+
+        if running is not None:
+            try:
+                running.result(timeout=None if deadline is None else deadline.remaining())
+            except TimeoutError:
+                pass
+        return outcome == "hit"
+
+
+    def stats(self) -> dict:
+        """Prefetch outcomes. hit_rate is the share of claimed lookups a finished prefetch had already served,
+        used_rate the share of prefetches that served at least one or were taken over by one."""
+
+        with self._lock:
+            lookups = self.hits + self.late + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.late + self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "late": self.late,
+                "prefetched": self.submitted,
+                "used_rate": min(1.0, self.used / self.done) if self.done else 0.0,
+                "wasted": self.wasted,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "size": len(self._prefetched),
+            }
+
+
+    def _run(self, key:tuple, stop:threading.Event, fn):
+        try:
+            with span("prefetch", kind=key[0]):
+                fn(deadline=Deadline(self.timeout), stop=stop)
+        except Exception:
+            # Already logged by the span. A prefetch stopped by a claim was taken over rather than failed.
+            if not stop.is_set():
+                with self._lock:
+                    self._prefetched.pop(key, None)
+                    self.failed += 1
+                METRICS.increment("prefetch_total", kind=key[0], outcome="failed")
+                return
+
+        with self._lock:
+            self.done += 1
+            entry = self._prefetched.get(key)
+            if entry is not None:
+                entry[1] = True
+        METRICS.increment("prefetch_total", kind=key[0], outcome="stopped" if stop.is_set() else "done")
+
+
+    def _expire(self, now:float):
+        """Forget prefetches older than ttl; their results may have left the caches. Caller holds the lock."""
+
+        while self._prefetched:
+            key, (expires_at, done, claimed, _, _) = next(iter(self._prefetched.items()))
+            if expires_at > now:
+                break
+            del self._prefetched[key]
+            if done and not claimed:
+                self.wasted += 1
@@ -0,0 +1,354 @@
+# Global rate limiting, scheduling, deadlines and circuit breaking for upstream API calls (Groq, Amadeus, fast_flights)
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from tracing import METRICS, event
+
+# Priorities, lower runs first
+INTERACTIVE = 0 # a user is waiting on the answer
+BACKGROUND = 1 # cache warming, summarization, prefetching
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Seconds between checks of the stop event of a call waiting for the rate limit
+STOP_POLL = 0.05
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a turn's time budget ran out before a call could be made or finished."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, provider:str, retry_in:float):
+        super().__init__(f"{provider} is unavailable after repeated errors, retrying in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class Deadline():
+    """A point in time by which a turn (or part of one) has to be answered. Deadline(None) never expires.
+    Deadlines are passed down to every upstream call made for the turn, like the session and priority are."""
+
+    def __init__(self, seconds:float | None = None, expires_at:float | None = None):
+        self.expires_at = expires_at if seconds is None else time.monotonic() + seconds
+
+
+    def remaining(self) -> float | None:
+        """Seconds left, never negative, or None if there is no deadline."""
+
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+
+    def check(self, what:str = "call"):
+        if self.expired:
+            raise DeadlineExceeded(f"No time left for {what}")
+
+
+    def within(self, seconds:float | None) -> "Deadline":
+        """A deadline at most seconds from now that is no later than this one."""
+
+        if seconds is None:
+            return self
+        expires_at = time.monotonic() + seconds
+        return Deadline(expires_at=expires_at if self.expires_at is None else min(expires_at, self.expires_at))
+
+
+    def earlier(self, seconds:float) -> "Deadline":
+        """This deadline moved seconds earlier, to leave time for work after the wait (like formatting)."""
+        return self if self.expires_at is None else Deadline(expires_at=self.expires_at - seconds)
+
+
+class TokenBucket():
+    """Allows rate calls per second on average, with bursts of up to burst calls."""
+
+    def __init__(self, rate:float, burst:float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+
+    def take(self, tokens:float = 1) -> float:
+        """Take tokens if they are available and return 0, otherwise return how many seconds until they will be.
+        Not thread-safe on its own; ProviderQueue calls it under its lock."""
+
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class ProviderQueue():
+    """Hands out a provider's rate-limit tokens in a fair order.
+
+    Waiting calls are grouped by priority and then by session. Interactive calls always go before background calls,
+    and within a priority the sessions take turns, so one busy session can't starve the others."""
+
+    def __init__(self, rate:float, burst:float):
+        self.bucket = TokenBucket(rate, burst)
+        self.waiting = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()} # priority -> session -> deque of tickets
+        self.cond = threading.Condition()
+
+
+    def acquire(self, session:str, priority:int, deadline:Deadline | None = None, stop:threading.Event | None = None):
+        """Block until it's this caller's turn and a token is available.
+        Raises DeadlineExceeded, giving up the caller's place, if the deadline passes or the stop event is set first."""
+
+        ticket = object()
+        with self.cond:
+            self.waiting[priority].setdefault(session, deque()).append(ticket)
+            while True:
+                remaining = None if deadline is None else deadline.remaining()
+                if remaining == 0 or stop is not None and stop.is_set():
+                    self._pop(priority, session, ticket)
+                    self.cond.notify_all()
+                    raise DeadlineExceeded("Stopped waiting for the rate limit" if remaining != 0 else
+                                           "No time left waiting for the rate limit")
+                if stop is not None:
+                    # Nothing notifies the queue when the event is set, so check it now and then
+                    remaining = STOP_POLL if remaining is None else min(remaining, STOP_POLL)
+                if self._head() is ticket:
+                    wait = self.bucket.take()
+                    if wait == 0:
+                        self._pop(priority, session, ticket)
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait(wait if remaining is None else min(wait, remaining))
+                else:
+                    self.cond.wait(remaining)
+
+
+    def queued(self) -> int:
+        with self.cond:
+            return sum(len(tickets) for sessions in self.waiting.values() for tickets in sessions.values())
+
+
+    def _head(self):
+        for priority in sorted(self.waiting):
+            sessions = self.waiting[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+
+    def _pop(self, priority:int, session:str, ticket):
+        """Remove the session's ticket and send the session to the back of the round-robin order."""
+
+        sessions = self.waiting[priority]
+        sessions[session].remove(ticket)
+        if sessions[session]:
+            sessions.move_to_end(session)
+        else:
+            del sessions[session]
+
+
+class CircuitBreaker():
+    """Fails calls to a provider fast while it is down.
+
+    After failure_threshold failures in a row the circuit opens and calls are refused for reset_after seconds.
+    Then a single trial call is let through: if it succeeds the circuit closes again, if it fails it stays open
+    for another reset_after seconds. Any error but a rejected request counts as a failure, and so does a call still
+    running when its deadline passes."""
+
+    def __init__(self, provider:str, failure_threshold:int = 5, reset_after:float = 30):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.trial_at is not None else "open"
+
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. Claims the trial call when the open period is over."""
+
+        now = time.monotonic()
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # A trial that never came back (a hung call) doesn't keep the circuit open forever
+            if now - self.opened_at >= self.reset_after and (self.trial_at is None or now - self.trial_at >= self.reset_after):
+                self.trial_at = now
+                return True
+            return False
+
+
+    def record(self, ok:bool):
+        with self._lock:
+            if ok:
+                if self.opened_at is not None:
+                    event("circuit closed", provider=self.provider)
+                self.failures = 0
+                self.opened_at = None
+                self.trial_at = None
+                return
+            self.failures += 1
+            if self.trial_at is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    METRICS.increment("circuit_opened_total", provider=self.provider)
+                    event("circuit opened", logging.WARNING, provider=self.provider, failures=self.failures)
+                self.opened_at = time.monotonic()
+                self.trial_at = None
+
+
+    def retry_in(self) -> float:
+        """Seconds until the next trial call is allowed."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_after - time.monotonic())
+
+
+class Scheduler():
+    """Every upstream call goes through call(), which waits for the provider's rate limit and retries
+    throttling and transient errors with jittered exponential backoff, honoring Retry-After.
+    Each provider has a circuit breaker, and calls give up once their deadline has passed."""
+
+    def __init__(self, limits:dict, max_retries:int = 3, backoff_base:float = 0.5, backoff_cap:float = 8.0,
+                 failure_threshold:int = 5, reset_after:float = 30):
+        self.queues = {provider: ProviderQueue(rate, burst) for provider, (rate, burst) in limits.items()}
+        self.breakers = {provider: CircuitBreaker(provider, failure_threshold, reset_after) for provider in limits}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retries = {provider: 0 for provider in limits}
+
+
+    def call(self, provider:str, fn, *args, session:str = "default", priority:int = INTERACTIVE,
+             deadline:Deadline | None = None, stop:threading.Event | None = None, **kwargs):
+        """Call fn(*args, **kwargs) once provider's rate limit allows it, retrying retryable errors.
+        Raises CircuitOpenError while the provider's circuit is open, and DeadlineExceeded if the deadline
+        passes while waiting; a retry that can't finish its backoff before the deadline re-raises the error.
+        Setting stop gives up a call that hasn't gone out yet, like a passed deadline."""
+
+        queue = self.queues[provider]
+        breaker = self.breakers[provider]
+        for attempt in range(self.max_retries + 1):
+            if deadline is not None:
+                deadline.check(f"a {provider} call")
+            if not breaker.allow():
+                METRICS.increment("circuit_rejections_total", provider=provider)
+                raise CircuitOpenError(provider, breaker.retry_in())
+            queue.acquire(session, priority, deadline, stop)
+            settle = self._watch(provider, deadline)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                # Everything but a request the provider rejected counts against the circuit
+                if settle():
+                    breaker.record(is_client_error(e))
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                delay = max(delay, retry_after(e) or 0)
+                remaining = None if deadline is None else deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise
+                self.retries[provider] += 1
+                METRICS.increment("upstream_retries_total", provider=provider)
+                event("retrying upstream call", logging.WARNING, provider=provider, error=str(e), delay=round(delay, 2))
+                time.sleep(delay)
+            else:
+                if settle():
+                    breaker.record(True)
+                return result
+
+
+    def _watch(self, provider:str, deadline:Deadline | None):
+        """Count a call that is still running when its deadline passes as a failure of provider, since the caller
+        has given up on it by then; a provider that hangs would otherwise never open its circuit. Returns settle(),
+        to call when the call returns: it ends the watch and says whether the outcome still has to be recorded."""
+
+        remaining = None if deadline is None else deadline.remaining()
+        if remaining is None:
+            return lambda: True
+
+        lock = threading.Lock()
+        running = [True]
+        def abandon():
+            with lock:
+                if not running[0]:
+                    return
+                running[0] = False
+            METRICS.increment("upstream_abandoned_total", provider=provider)
+            self.breakers[provider].record(False)
+
+        timer = threading.Timer(remaining, abandon)
+        timer.daemon = True
+        timer.start()
+        def settle() -> bool:
+            timer.cancel()
+            with lock:
+                pending, running[0] = running[0], False
+            return pending
+        return settle
+
+
+    def stats(self) -> dict:
+        return {provider: {"queued": queue.queued(), "retries": self.retries[provider], "circuit": self.breakers[provider].state}
+                for provider, queue in self.queues.items()}
+
+
+def status_code(error:Exception) -> int | None:
+    """HTTP status of a Groq, httpx or Amadeus error, if it has one."""
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def retry_after(error:Exception) -> float | None:
+    """Seconds the server asked us to wait before retrying, from the Retry-After header."""
+
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_client_error(error:Exception) -> bool:
+    """A request the provider rejected (4xx other than 429), which says nothing about the provider's health."""
+
+    status = status_code(error)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def is_retryable(error:Exception) -> bool:
+    """Throttling, server errors and connection problems are worth retrying; anything else is a real failure."""
+
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Groq/httpx connection and timeout errors don't carry a status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout", "NetworkError")
@@ -0,0 +1,686 @@
+# Headless HTTP API for the chatbot: JSON and server-sent events on asyncio, with no web framework
+#
+#   python server.py                          one worker on NAVIBLU_API_PORT (8000)
+#   NAVIBLU_API_WORKERS=4 python server.py    four worker processes behind the same port
+#   python server.py --warm-up                each worker warms up (SDKs, clients, indexes) as soon as it listens
+#
+#   POST   /api/sessions                  -> 201 {"session_id": ...}
+#   POST   /api/sessions/<id>/messages    {"message": "..."} -> {"session_id", "response", "sections", "timings"}
+#          with Accept: text/event-stream -> "start", then "section" events as the agents make progress, then "done"
+#   DELETE /api/sessions/<id>             -> 204
+#   GET    /healthz                       -> {"status", "worker", "sessions", "active_turns", "queued_turns", "warm_up"}
+#
+# Any other path is proxied to NAVIBLU_UI_UPSTREAM when it is set, so the Streamlit UI can share the API's port.
+
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import parse_qs
+
+HOST = os.getenv("NAVIBLU_API_HOST", "0.0.0.0")
+PORT = int(os.getenv("NAVIBLU_API_PORT", "8000"))
+WORKERS = int(os.getenv("NAVIBLU_API_WORKERS", "1"))
+
+# Turns answered at once by each worker, and turns allowed to wait for a slot before new ones get a 503
+MAX_TURNS = int(os.getenv("NAVIBLU_API_MAX_TURNS", "16"))
+MAX_QUEUED = int(os.getenv("NAVIBLU_API_MAX_QUEUED", "64"))
+
+# Seconds a shutting-down worker waits for the turns it is answering
+DRAIN_SECONDS = float(os.getenv("NAVIBLU_API_DRAIN_SECONDS", "30"))
+
+# Allowed browser origins, comma separated ("*" allows any site to embed the chat)
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("NAVIBLU_API_CORS_ORIGINS", "*").split(",") if origin.strip()]
+
+# Conversation state: a SQLite file for idle sessions (in memory when unset), live Chatbots per worker, idle sessions
+# kept in memory, seconds idle before a session is frozen, and seconds idle before it is forgotten
+SESSION_DB = os.getenv("NAVIBLU_SESSION_DB")
+SESSION_LIVE = int(os.getenv("NAVIBLU_SESSION_LIVE", "256"))
+SESSION_MAX = int(os.getenv("NAVIBLU_SESSION_MAX", "10000"))
+SESSION_FREEZE_AFTER = float(os.getenv("NAVIBLU_SESSION_FREEZE_AFTER", "600"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("NAVIBLU_SESSION_IDLE_TIMEOUT", str(24 * 60 * 60)))
+SESSION_SWEEP_SECONDS = 60
+
+# Run core.warm_up() in each worker at start, so the first sessions don't pay for SDK imports and index builds.
+# Also enabled by passing --warm-up.
+WARM_UP = os.getenv("NAVIBLU_WARM_UP", "0").lower() not in ("", "0", "false")
+
+# host:port of the Streamlit UI, for requests outside /api and /healthz
+UI_UPSTREAM = os.getenv("NAVIBLU_UI_UPSTREAM")
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_MESSAGE_CHARS = 4000
+HEADER_TIMEOUT = 10.0
+KEEP_ALIVE_TIMEOUT = 15.0
+SSE_HEARTBEAT = 15.0
+
+STATUS_TEXT = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    """Ends a request with an error status and a JSON {"error": message} body."""
+
+    def __init__(self, status:int, message:str, retry_after:int | None = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+@dataclass
+class Request():
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body: bytes
+    raw: bytes
+
+    def json(self) -> dict:
+        try:
+            payload = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "the request body must be JSON")
+        if not isinstance(payload, dict):
+            raise HttpError(400, "the request body must be a JSON object")
+        return payload
+
+
+    @property
+    def wants_stream(self) -> bool:
+        return "text/event-stream" in self.headers.get("accept", "") or self.query.get("stream", ["0"])[0] in ("1", "true")
+
+
+def worker_for(session_id:str, workers:int) -> int:
+    """The worker that holds a session. Every request for the session is dispatched to it."""
+    return zlib.crc32(session_id.encode()) % workers
+
+
+def session_route(path:str) -> tuple[str | None, str | None]:
+    """(session id, sub-resource) for /api/sessions/<id>[/<sub-resource>] paths, else (None, None)."""
+
+    parts = path.strip("/").split("/")
+    if len(parts) in (3, 4) and parts[0:2] == ["api", "sessions"] and parts[2]:
+        return parts[2], parts[3] if len(parts) == 4 else ""
+    return None, None
+
+
+async def read_request(reader:asyncio.StreamReader) -> Request:
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HttpError(413, "request headers are too large")
+
+    lines = raw.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name:
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "request body is too large")
+    body = await reader.readexactly(length) if length else b""
+
+    path, _, query = target.partition("?")
+    return Request(method.upper(), path, parse_qs(query), headers, body, raw)
+
+
+def open_session_store(restore):
+    """The session store configured by the NAVIBLU_SESSION_* variables."""
+
+    from sessions import SessionStore, SQLiteSessionStore
+    options = {"max_live": SESSION_LIVE, "freeze_after": SESSION_FREEZE_AFTER, "idle_timeout": SESSION_IDLE_TIMEOUT}
+    if SESSION_DB:
+        return SQLiteSessionStore(restore, SESSION_DB, **options)
+    return SessionStore(restore, max_sessions=SESSION_MAX, **options)
+
+
+def sse(name:str, data:dict) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class ChatService():
+    """One worker: holds its sessions in a session store and answers their HTTP requests on an asyncio loop.
+
+    Chatbot turns are blocking, so they run on a thread pool of max_turns threads; the loop only parses
+    requests and writes responses. At most max_turns turns run at once, up to max_queued more wait for a
+    slot and any beyond that are turned away with a 503, as is a second message for a session that is
+    still answering the first."""
+
+    def __init__(self, index:int = 0, workers:int = 1, max_turns:int = MAX_TURNS, max_queued:int = MAX_QUEUED,
+                 drain_seconds:float = DRAIN_SECONDS, ui_upstream:str | None = UI_UPSTREAM, warm_up:bool = WARM_UP):
+        # Imported here rather than at the top so a multi-worker parent never loads the chatbot itself
+        import core
+        from tracing import METRICS, event
+        self.core = core
+        self.metrics = METRICS
+        self.event = event
+
+        self.index = index
+        self.workers = workers
+        self.max_queued = max_queued
+        self.drain_seconds = drain_seconds
+        self.ui_upstream = ui_upstream
+        self.warm_up = "pending" if warm_up else "off"
+
+        self.sessions = open_session_store(core.Chatbot.from_state)
+        self.metrics.register_cache("sessions", self.sessions)
+        self.busy = set()
+        self.active = 0
+        self.queued = 0
+        self.draining = False
+        self.turns = asyncio.Semaphore(max_turns)
+        self.pool = ThreadPoolExecutor(max_workers=max_turns, thread_name_prefix="naviblu-turn")
+        self.connections = set()
+
+
+    async def serve(self, channel:socket.socket | None = None, host:str = HOST, port:int = PORT):
+        """Serve until SIGTERM or SIGINT, then stop taking requests and let the running turns finish.
+
+        Connections are accepted on host:port, or handed over by the multi-worker parent through channel."""
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = None
+        if channel is not None:
+            channel.setblocking(False)
+            loop.add_reader(channel.fileno(), self._receive, channel, stop)
+        else:
+            server = await asyncio.start_server(self._connection, host, port, limit=MAX_HEADER_BYTES)
+        self.event("api listening", worker=self.index, workers=self.workers, port=port)
+        sweeper = loop.create_task(self._sweep_sessions())
+        if self.warm_up == "pending":
+            # In the background, so the worker answers (and passes health checks) while it warms up
+            self.warm_up = "running"
+            warming = loop.run_in_executor(None, self.core.warm_up)
+            warming.add_done_callback(lambda _: setattr(self, "warm_up", "done"))
+
+        await stop.wait()
+        sweeper.cancel()
+        self.draining = True
+        if server is not None:
+            server.close()
+        if channel is not None:
+            loop.remove_reader(channel.fileno())
+        self.event("api draining", worker=self.index, active_turns=self.active, queued_turns=self.queued)
+
+        deadline = time.monotonic() + self.drain_seconds
+        while (self.active or self.queued) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.sessions.flush()
+        self.event("api stopped", worker=self.index, unfinished_turns=self.active)
+
+
+    async def _sweep_sessions(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_SECONDS)
+            swept = await loop.run_in_executor(None, self.sessions.sweep)
+            if any(swept.values()):
+                self.event("sessions swept", worker=self.index, **swept)
+
+
+    def _receive(self, channel:socket.socket, stop:asyncio.Event):
+        """Take the connections the parent dispatched to this worker."""
+
+        try:
+            message, fds, _, _ = socket.recv_fds(channel, 16, 32)
+        except BlockingIOError:
+            return
+        if not message:
+            # The parent is gone
+            stop.set()
+            return
+        for fd in fds:
+            connection = socket.socket(fileno=fd)
+            connection.setblocking(False)
+            asyncio.get_running_loop().create_task(self._accepted(connection))
+
+
+    async def _accepted(self, connection:socket.socket):
+        reader, writer = await asyncio.open_connection(sock=connection, limit=MAX_HEADER_BYTES)
+        await self._connection(reader, writer)
+
+
+    async def _connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            # Dispatched connections close after one response, since the next request may be for another worker's session
+            keep_alive = self.workers == 1
+            timeout = HEADER_TIMEOUT
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), timeout)
+                except HttpError as e:
+                    await self._send_error(writer, None, e)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                if not request.path.startswith("/api/") and request.path != "/healthz" and self.ui_upstream:
+                    await self._proxy(request, reader, writer)
+                    break
+
+                keep_alive = keep_alive and request.headers.get("connection", "").lower() != "close" and not self.draining
+                if not await self._respond(request, writer, keep_alive):
+                    break
+                timeout = KEEP_ALIVE_TIMEOUT
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+
+    async def _respond(self, request:Request, writer:asyncio.StreamWriter, keep_alive:bool) -> bool:
+        """Answer one request. Returns whether the connection can take another."""
+
+        route = "other"
+        status = 500
+        try:
+            if request.method == "OPTIONS":
+                route, status = "preflight", 204
+                await self._send(writer, request, 204, b"", keep_alive=keep_alive, headers={
+                    "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
+                    "Access-Control-Allow-Headers": "Content-Type, Accept",
+                    "Access-Control-Max-Age": "86400",
+                })
+                return keep_alive
+
+            session_id, resource = session_route(request.path)
+            if request.path == "/healthz" and request.method == "GET":
+                route, status = "health", 503 if self.draining else 200
+                await self._send_json(writer, request, status, {
+                    "status": "draining" if self.draining else "ok",
+                    "worker": self.index,
+                    "sessions": len(self.sessions),
+                    "active_turns": self.active,
+                    "queued_turns": self.queued,
+                    "warm_up": self.warm_up,
+                }, keep_alive)
+                return keep_alive
+
+            if request.path.rstrip("/") == "/api/sessions":
+                route = "sessions"
+                if request.method != "POST":
+                    raise HttpError(405, "use POST to start a session")
+                self._check_draining()
+                session_id = self._new_session_id()
+                self.sessions.add(session_id, self.core.Chatbot(session_id))
+                status = 201
+                await self._send_json(writer, request, 201, {"session_id": session_id}, keep_alive)
+                return keep_alive
+
+            if session_id is not None and resource == "":
+                route = "session"
+                if request.method != "DELETE":
+                    raise HttpError(405, "use DELETE to end a session")
+                if session_id in self.busy:
+                    raise HttpError(409, "this session is still answering its previous message")
+                if not self.sessions.delete(session_id):
+                    raise HttpError(404, "unknown session")
+                status = 204
+                await self._send(writer, request, 204, b"", keep_alive=keep_alive)
+                return keep_alive
+
+            if session_id is not None and resource == "messages":
+                route = "messages"
+                if request.method != "POST":
+                    raise HttpError(405, "use POST to send a message")
+                status = 200
+                return await self._message(request, writer, session_id, keep_alive)
+
+            raise HttpError(404, "not found")
+        except HttpError as e:
+            status = e.status
+            await self._send_error(writer, request, e, keep_alive)
+            return keep_alive
+        except ConnectionError:
+            return False
+        except Exception as e:
+            status = 500
+            self.event("api request failed", logging.ERROR, route=route, error=f"{type(e).__name__}: {e}")
+            await self._send_error(writer, request, HttpError(500, "internal error"), keep_alive=False)
+            return False
+        finally:
+            self.metrics.increment("api_requests_total", route=route, status=status)
+
+
+    async def _message(self, request:Request, writer:asyncio.StreamWriter, session_id:str, keep_alive:bool) -> bool:
+        message = str(request.json().get("message", "")).strip()
+        if not message:
+            raise HttpError(400, "message is required")
+        if len(message) > MAX_MESSAGE_CHARS:
+            raise HttpError(413, f"message is longer than {MAX_MESSAGE_CHARS} characters")
+        if session_id in self.busy:
+            raise HttpError(409, "this session is still answering its previous message")
+        self._check_draining()
+        if self.queued >= self.max_queued:
+            self.metrics.increment("api_rejected_total", reason="queue_full")
+            raise HttpError(503, "too many messages in progress, try again shortly", retry_after=2)
+
+        self.busy.add(session_id)
+        loop = asyncio.get_running_loop()
+        try:
+            # Checks the session out of the store, rehydrating it if it was frozen
+            chatbot = await loop.run_in_executor(None, self.sessions.get, session_id)
+            if chatbot is None:
+                raise HttpError(404, "unknown session")
+            try:
+                self.queued += 1
+                async with self._turn_slot():
+                    if request.wants_stream:
+                        await self._stream_turn(request, writer, chatbot, message)
+                        return False
+                    try:
+                        await loop.run_in_executor(self.pool, chatbot.process_input, message)
+                    except Exception as e:
+                        # Answered with a 500 like any other failed request; the stream sends its "error" event instead
+                        self.event("api turn failed", logging.ERROR, session=chatbot.session_id, error=f"{type(e).__name__}: {e}")
+                        raise HttpError(500, "the assistant failed to answer, please try again")
+                    await self._send_json(writer, request, 200, self._result(chatbot), keep_alive)
+                    return keep_alive
+            finally:
+                await loop.run_in_executor(None, self.sessions.release, session_id)
+        finally:
+            self.busy.discard(session_id)
+
+
+    @contextlib.asynccontextmanager
+    async def _turn_slot(self):
+        """Wait for one of the max_turns slots, counting the turn as queued until it gets one."""
+
+        try:
+            await self.turns.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.turns.release()
+
+
+    async def _stream_turn(self, request:Request, writer:asyncio.StreamWriter, chatbot, message:str):
+        """Answer a message as server-sent events while the turn runs on the thread pool.
+
+        If the client disconnects, the turn still runs to the end so the session's memory stays consistent."""
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        put = lambda name, data: loop.call_soon_threadsafe(events.put_nowait, (name, data))
+
+        def produce():
+            try:
+                for section, text, final in chatbot.process_input_stream(message):
+                    put("section", {"section": section, "text": text, "final": final})
+                put("done", self._result(chatbot))
+            except Exception as e:
+                self.event("api turn failed", logging.ERROR, session=chatbot.session_id, error=f"{type(e).__name__}: {e}")
+                put("error", {"error": "the assistant failed to answer, please try again"})
+
+        turn = loop.run_in_executor(self.pool, produce)
+        connected = True
+        try:
+            writer.write(self._head(request, 200, {
+                "Content-Type": "text/event-stream; charset=utf-8",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            }, keep_alive=False))
+            writer.write(sse("start", {"session_id": chatbot.session_id, "order": self.core.SECTION_ORDER}))
+            await writer.drain()
+
+            while True:
+                try:
+                    name, data = await asyncio.wait_for(events.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Comment line that keeps proxies from closing an idle stream
+                    writer.write(b": waiting\n\n")
+                    await writer.drain()
+                    continue
+                writer.write(sse(name, data))
+                await writer.drain()
+                if name in ("done", "error"):
+                    break
+        except ConnectionError:
+            connected = False
+            self.metrics.increment("api_disconnects_total")
+        finally:
+            await turn
+        if not connected:
+            raise ConnectionError("client disconnected during the stream")
+
+
+    def _result(self, chatbot) -> dict:
+        categories = chatbot.understanding.get("categories", [])
+        return {
+            "session_id": chatbot.session_id,
+            "response": chatbot.last_response,
+            "sections": {name: getattr(chatbot, f"{name}_info") for name in self.core.SECTION_ORDER if name in categories},
+            "timings": {name: round(seconds, 3) for name, seconds in chatbot.agent_timings.items()},
+        }
+
+
+    async def _proxy(self, request:Request, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """Pipe the connection to the UI upstream, including WebSocket upgrades, until either side closes."""
+
+        host, _, port = self.ui_upstream.rpartition(":") # type: ignore
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host or "127.0.0.1", int(port))
+        except OSError:
+            await self._send_error(writer, request, HttpError(502, "the UI is not available"))
+            return
+        upstream_writer.write(request.raw + request.body)
+        await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+
+
+    def _new_session_id(self) -> str:
+        # With several workers, draw ids until one maps back to this worker, so its later requests are dispatched here
+        while True:
+            session_id = uuid.uuid4().hex
+            if worker_for(session_id, self.workers) == self.index:
+                return session_id
+
+
+    def _check_draining(self):
+        if self.draining:
+            raise HttpError(503, "the server is restarting, try again shortly", retry_after=5)
+
+
+    def _head(self, request:Request | None, status:int, headers:dict, keep_alive:bool) -> bytes:
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+        origin = request.headers.get("origin") if request is not None else None
+        if "*" in CORS_ORIGINS:
+            lines.append("Access-Control-Allow-Origin: *")
+        elif origin in CORS_ORIGINS:
+            lines += [f"Access-Control-Allow-Origin: {origin}", "Vary: Origin"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+    async def _send(self, writer:asyncio.StreamWriter, request:Request | None, status:int, body:bytes,
+                    content_type:str | None = None, keep_alive:bool = False, headers:dict | None = None):
+        headers = dict(headers or {})
+        if content_type:
+            headers["Content-Type"] = content_type
+        headers["Content-Length"] = str(len(body))
+        writer.write(self._head(request, status, headers, keep_alive) + body)
+        await writer.drain()
+
+
+    async def _send_json(self, writer:asyncio.StreamWriter, request:Request | None, status:int, payload:dict, keep_alive:bool = False):
+        await self._send(writer, request, status, json.dumps(payload).encode(), "application/json", keep_alive)
+
+
+    async def _send_error(self, writer:asyncio.StreamWriter, request:Request | None, error:HttpError, keep_alive:bool = False):
+        headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+        body = json.dumps({"error": error.message}).encode()
+        try:
+            await self._send(writer, request, error.status, body, "application/json", keep_alive, headers)
+        except ConnectionError:
+            pass
+
+
+async def _pipe(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    try:
+        while data := await reader.read(64 * 1024):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+class Dispatcher():
+    """Accepts connections on the shared port for several worker processes.
+
+    Each connection's request line is peeked at without consuming it, and the socket is handed to the worker
+    that holds the session in its path (any worker for requests without one), so a session's turns always
+    reach the process with its Chatbot in memory. With NAVIBLU_SESSION_DB, a session whose worker changes
+    (e.g. after a restart with a different worker count) is rehydrated from the shared SQLite file."""
+
+    def __init__(self, listener:socket.socket, channels:list[socket.socket]):
+        self.listener = listener
+        self.channels = channels
+        self.locks = [threading.Lock() for _ in channels]
+        self.pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="naviblu-dispatch")
+        self.next_worker = 0
+        self.stopped = threading.Event()
+
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                break
+            self.pool.submit(self._dispatch, connection)
+
+
+    def stop(self):
+        self.stopped.set()
+        self.listener.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+    def _dispatch(self, connection:socket.socket):
+        try:
+            worker = self._worker(self._request_line(connection))
+            with self.locks[worker]:
+                socket.send_fds(self.channels[worker], [b"c"], [connection.fileno()])
+        except OSError:
+            pass
+        finally:
+            # The worker has its own copy of the socket now
+            connection.close()
+
+
+    def _request_line(self, connection:socket.socket) -> str:
+        connection.settimeout(HEADER_TIMEOUT)
+        deadline = time.monotonic() + HEADER_TIMEOUT
+        data = b""
+        while b"\r\n" not in data and len(data) < MAX_HEADER_BYTES and time.monotonic() < deadline:
+            data = connection.recv(MAX_HEADER_BYTES, socket.MSG_PEEK)
+            if not data:
+                break
+            if b"\r\n" not in data:
+                time.sleep(0.005)
+        return data.split(b"\r\n", 1)[0].decode("latin-1")
+
+
+    def _worker(self, request_line:str) -> int:
+        parts = request_line.split(" ")
+        session_id, _ = session_route(parts[1].partition("?")[0]) if len(parts) > 1 else (None, None)
+        if session_id is not None:
+            return worker_for(session_id, len(self.channels))
+        self.next_worker = (self.next_worker + 1) % len(self.channels)
+        return self.next_worker
+
+
+def run_worker(index:int = 0, workers:int = 1, channel:socket.socket | None = None, warm_up:bool = WARM_UP):
+    """Entry point of a worker process."""
+
+    # Each worker has its own metrics registry, so each serves it on its own port
+    if workers > 1 and os.getenv("NAVIBLU_METRICS_PORT"):
+        os.environ["NAVIBLU_METRICS_PORT"] = str(int(os.environ["NAVIBLU_METRICS_PORT"]) + index)
+    service = ChatService(index, workers, warm_up=warm_up)
+    asyncio.run(service.serve(channel=channel))
+
+
+def main(workers:int = WORKERS, host:str = HOST, port:int = PORT, warm_up:bool = WARM_UP):
+    if workers <= 1:
+        run_worker(warm_up=warm_up)
+        return
+
+    listener = socket.create_server((host, port), backlog=1024)
+    # Workers start fresh interpreters, so none inherits the dispatcher's threads
+    context = multiprocessing.get_context("spawn")
+    channels, processes = [], []
+    for index in range(workers):
+        parent_end, worker_end = socket.socketpair()
+        process = context.Process(target=run_worker, args=(index, workers, worker_end, warm_up), name=f"naviblu-api-{index}")
+        process.start()
+        worker_end.close()
+        channels.append(parent_end)
+        processes.append(process)
+
+    dispatcher = Dispatcher(listener, channels)
+    stopping = threading.Event()
+
+    def shutdown(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        dispatcher.stop()
+        for process in processes:
+            if process.pid is not None:
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    print(f"NaviBlu API: {workers} workers on http://{host}:{port}", flush=True)
+
+    threading.Thread(target=dispatcher.serve, daemon=True, name="naviblu-dispatch").start()
+    while not stopping.is_set() and all(process.is_alive() for process in processes):
+        stopping.wait(1)
+    shutdown(signal.SIGTERM, None)
+    for process in processes:
+        process.join(DRAIN_SECONDS + 5)
+        if process.is_alive():
+            process.kill()
+
+
+if __name__ == "__main__":
+    main(warm_up=WARM_UP or "--warm-up" in sys.argv[1:])
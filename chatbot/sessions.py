@@ -0,0 +1,261 @@
+# Session stores: conversation state for every session, with memory bounded by the active ones
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def encode_state(state:dict) -> bytes:
+    """Compact serialized form of a session: compressed JSON of its summary and turn records."""
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode(), 6)
+
+
+def decode_state(data:bytes) -> dict:
+    return json.loads(zlib.decompress(data))
+
+
+class SessionStore():
+    """Keeps each session's Chatbot live while it is in use and frozen while it is idle.
+
+    Live Chatbots are kept in least-recently-used order, at most max_live of them. A live session that
+    has been idle for freeze_after seconds, or that falls off the end of the LRU, is frozen: its state is
+    serialized with encode_state() and the Chatbot is dropped. The next message for it rehydrates a new
+    Chatbot from that state with restore(session_id, state). Sessions idle for idle_timeout seconds are
+    forgotten.
+
+    This store keeps frozen sessions in memory, at most max_sessions of them, so they are lost on restart.
+    SQLiteSessionStore keeps them in a SQLite file instead.
+
+    Sessions are checked out with get() and handed back with release() when the turn is done; a checked
+    out session is never frozen, so a turn's result can't be lost."""
+
+    def __init__(self, restore, snapshot = lambda chatbot: chatbot.to_state(), max_live:int = 256,
+                 max_sessions:int = 10000, freeze_after:float = 600, idle_timeout:float = 24 * 60 * 60):
+        self.restore = restore
+        self.snapshot = snapshot
+        self.max_live = max_live
+        self.max_sessions = max_sessions
+        self.freeze_after = freeze_after
+        self.idle_timeout = idle_timeout
+
+        self.hits = 0
+        self.rehydrated = 0
+        self.misses = 0
+        self.frozen = 0
+        self.expired = 0
+
+        self._live = OrderedDict() # session id -> [chatbot, last used]
+        self._in_use = {}          # session id -> checkouts
+        self._cold = OrderedDict() # session id -> (state, last used)
+        self._lock = threading.RLock()
+
+
+    def add(self, session_id:str, chatbot):
+        """Store a new session. It starts out live."""
+
+        with self._lock:
+            self._live[session_id] = [chatbot, time.time()]
+            self._save(session_id, chatbot)
+            self._evict()
+
+
+    def get(self, session_id:str):
+        """Check out a session's Chatbot, rehydrating it if it was frozen. Returns None for an unknown session.
+        Every successful get() must be followed by a release()."""
+
+        now = time.time()
+        with self._lock:
+            entry = self._live.get(session_id)
+            if entry is not None:
+                self._live.move_to_end(session_id)
+                entry[1] = now
+                self.hits += 1
+            else:
+                frozen = self._load(session_id, now)
+                if frozen is None:
+                    self.misses += 1
+                    return None
+                entry = [self.restore(session_id, decode_state(frozen)), now]
+                self._live[session_id] = entry
+                self.rehydrated += 1
+            self._in_use[session_id] = self._in_use.get(session_id, 0) + 1
+            self._evict()
+            return entry[0]
+
+
+    def release(self, session_id:str):
+        """Hand a session back after a turn, saving its state."""
+
+        with self._lock:
+            count = self._in_use.pop(session_id, 0) - 1
+            if count > 0:
+                self._in_use[session_id] = count
+            entry = self._live.get(session_id)
+            if entry is not None:
+                entry[1] = time.time()
+                self._save(session_id, entry[0])
+            self._evict()
+
+
+    def delete(self, session_id:str) -> bool:
+        with self._lock:
+            live = self._live.pop(session_id, None) is not None
+            self._in_use.pop(session_id, None)
+            return self._forget(session_id) or live
+
+
+    def sweep(self) -> dict:
+        """Freeze live sessions idle for freeze_after seconds and forget those idle for idle_timeout.
+        Meant to be called periodically."""
+
+        now = time.time()
+        with self._lock:
+            idle = [session_id for session_id, (_, last_used) in self._live.items()
+                    if now - last_used >= self.freeze_after and session_id not in self._in_use]
+            for session_id in idle:
+                self._freeze(session_id)
+            expired = self._expire(now - self.idle_timeout)
+            self.expired += expired
+            return {"frozen": len(idle), "expired": expired}
+
+
+    def flush(self):
+        """Freeze every live session that isn't in use, e.g. before shutting down."""
+
+        with self._lock:
+            for session_id in [session_id for session_id in self._live if session_id not in self._in_use]:
+                self._freeze(session_id)
+
+
+    def __contains__(self, session_id:str) -> bool:
+        with self._lock:
+            return session_id in self._live or self._load(session_id, time.time(), peek=True) is not None
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._live) + self._frozen_count()
+
+
+    def stats(self) -> dict:
+        """Live hits, rehydrations and live/frozen counts for monitoring."""
+
+        with self._lock:
+            lookups = self.hits + self.rehydrated
+            return {
+                "hits": self.hits,
+                "misses": self.rehydrated,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "unknown": self.misses,
+                "size": len(self._live),
+                "maxsize": self.max_live,
+                "frozen": self._frozen_count(),
+                "freezes": self.frozen,
+                "expired": self.expired,
+            }
+
+
+    def _evict(self):
+        """Freeze the least recently used live sessions past max_live, skipping ones in use. Caller holds the lock."""
+
+        if len(self._live) <= self.max_live:
+            return
+        for session_id in list(self._live):
+            if len(self._live) <= self.max_live:
+                break
+            if session_id not in self._in_use:
+                self._freeze(session_id)
+
+
+    def _freeze(self, session_id:str):
+        chatbot, last_used = self._live.pop(session_id)
+        self._store(session_id, encode_state(self.snapshot(chatbot)), last_used)
+        self.frozen += 1
+
+
+    # Frozen tier, overridden by SQLiteSessionStore. The caller holds the lock.
+
+    def _save(self, session_id:str, chatbot):
+        """Persist a live session after a change. Frozen sessions only exist in memory here, so there's nothing to do."""
+
+
+    def _store(self, session_id:str, data:bytes, last_used:float):
+        self._cold[session_id] = (data, last_used)
+        self._cold.move_to_end(session_id)
+        while len(self._cold) > self.max_sessions:
+            self._cold.popitem(last=False)
+
+
+    def _load(self, session_id:str, now:float, peek:bool = False) -> bytes | None:
+        entry = self._cold.get(session_id) if peek else self._cold.pop(session_id, None)
+        if entry is None or now - entry[1] >= self.idle_timeout:
+            return None
+        return entry[0]
+
+
+    def _forget(self, session_id:str) -> bool:
+        return self._cold.pop(session_id, None) is not None
+
+
+    def _expire(self, before:float) -> int:
+        expired = [session_id for session_id, (_, last_used) in self._cold.items() if last_used < before]
+        for session_id in expired:
+            del self._cold[session_id]
+        return len(expired)
+
+
+    def _frozen_count(self) -> int:
+        return len(self._cold)
+
+
+class SQLiteSessionStore(SessionStore):
+    """SessionStore that keeps frozen sessions in a SQLite file, so they survive restarts and can be
+    picked up by any worker process sharing the file. Live sessions are written through after every turn."""
+
+    def __init__(self, restore, sqlite_path:str, **options):
+        super().__init__(restore, **options)
+        self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                id TEXT PRIMARY KEY,
+                                state BLOB NOT NULL,
+                                last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+        self._db.commit()
+
+
+    def _save(self, session_id:str, chatbot):
+        self._store(session_id, encode_state(self.snapshot(chatbot)), time.time())
+
+
+    def _store(self, session_id:str, data:bytes, last_used:float):
+        self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, data, last_used))
+        self._db.commit()
+
+
+    def _load(self, session_id:str, now:float, peek:bool = False) -> bytes | None:
+        row = self._db.execute("SELECT state, last_used FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or now - row[1] >= self.idle_timeout:
+            return None
+        return row[0]
+
+
+    def _forget(self, session_id:str) -> bool:
+        deleted = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+        self._db.commit()
+        return deleted > 0
+
+
+    def _expire(self, before:float) -> int:
+        expired = self._db.execute("DELETE FROM sessions WHERE last_used < ?", (before,)).rowcount
+        self._db.commit()
+        return expired
+
+
+    def _frozen_count(self) -> int:
+        # Rows of live sessions are write-through copies, not frozen sessions
+        count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return max(0, count - len(self._live))
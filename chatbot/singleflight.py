@@ -0,0 +1,153 @@
+# Merging of identical in-flight upstream calls across sessions ("single-flight")
+
+import threading
+from scheduler import DeadlineExceeded
+from tracing import METRICS
+
+
+class Flight():
+    """One in-flight call: its result or error once finished, and the pieces streamed so far."""
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.pieces = []
+        self.cond = threading.Condition()
+
+
+    def publish(self, piece):
+        with self.cond:
+            self.pieces.append(piece)
+            self.cond.notify_all()
+
+
+    def finish(self, result = None, error:BaseException | None = None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+
+class SingleFlight():
+    """Runs at most one call per key at a time. The first caller for a key runs it and any caller that
+    asks for the same key while it is running waits for that call's result (or error) instead of making
+    its own upstream request. Nothing is kept once the call finishes; caching is the caller's job.
+
+    Merged callers are counted in the upstream_merged_total metric, labeled with this instance's provider."""
+
+    def __init__(self, provider:str):
+        self.provider = provider
+        self.calls = 0
+        self.merged = 0
+
+        self._flights = {} # key -> Flight
+        self._lock = threading.Lock()
+
+
+    def do(self, key, fn, deadline = None) -> tuple:
+        """Return (fn(), merged), sharing the call with any identical call already in flight.
+        merged is True when this caller waited on another caller's call. A waiting caller gives up with
+        DeadlineExceeded when its own deadline passes; the call itself carries on for the others."""
+
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                return self._run(key, flight, fn), False
+
+            with flight.cond:
+                while not flight.done:
+                    self._wait(flight, deadline)
+            # The caller that ran it ran out of its own time, this one may still have some
+            if isinstance(flight.error, DeadlineExceeded):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+
+    def stream(self, key, fn, on_piece, deadline = None) -> tuple:
+        """Like do() for a streamed call. fn is called with a callback to publish each piece as it arrives;
+        every caller sharing the call has on_piece called with every piece, in order, including the ones
+        published before it joined. Returns (fn's result, merged)."""
+
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                def publish(piece, flight=flight):
+                    flight.publish(piece)
+                    on_piece(piece)
+                return self._run(key, flight, fn, publish), False
+
+            seen = 0
+            while True:
+                with flight.cond:
+                    while len(flight.pieces) == seen and not flight.done:
+                        self._wait(flight, deadline)
+                    pieces = flight.pieces[seen:]
+                    done = flight.done
+                for piece in pieces:
+                    on_piece(piece)
+                seen += len(pieces)
+                if done and seen == len(flight.pieces):
+                    break
+            # Start over if the caller that ran it ran out of its own time before anything was streamed
+            if isinstance(flight.error, DeadlineExceeded) and seen == 0:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "merged": self.merged,
+                "merge_rate": self.merged / self.calls if self.calls else 0.0,
+                "in_flight": len(self._flights),
+            }
+
+
+    def _join(self, key) -> tuple[Flight, bool]:
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                return flight, True
+            self.merged += 1
+        METRICS.increment("upstream_merged_total", provider=self.provider)
+        return flight, False
+
+
+    def _wait(self, flight:Flight, deadline):
+        """Wait for news on flight. Caller holds flight.cond."""
+
+        remaining = None if deadline is None else deadline.remaining()
+        if remaining == 0:
+            raise DeadlineExceeded("No time left waiting for an identical call in flight")
+        flight.cond.wait(remaining)
+
+
+    def _run(self, key, flight:Flight, fn, *args):
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result=result)
+        return result
+
+
+    def _land(self, key, flight:Flight, result = None, error:BaseException | None = None):
+        # Callers arriving from now on start a new call; the ones already waiting get this result
+        with self._lock:
+            del self._flights[key]
+        flight.finish(result, error)
@@ -0,0 +1,233 @@
+# Lightweight tracing: timed spans per pipeline stage, structured logs and Prometheus-style metrics
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("naviblu")
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageStats():
+    """Latency histogram for one stage, plus a window of recent durations for percentiles."""
+
+    def __init__(self, window:int = 2048):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=window)
+
+
+    def observe(self, seconds:float, error:bool):
+        self.count += 1
+        self.errors += int(error)
+        self.total += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+    def quantiles(self) -> dict:
+        values = sorted(self.recent)
+        if not values:
+            return {q: None for q in QUANTILES}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+
+class Metrics():
+    """Thread-safe store for stage latencies, counters, registered caches and registered gauges."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {} # (name, sorted label items) -> value
+        self.caches = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, stage:str, seconds:float, error:bool = False):
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).observe(seconds, error)
+
+
+    def increment(self, name:str, value:float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def register_cache(self, name:str, cache):
+        """Report a cache's hit/miss counters (anything with a stats() method) alongside the other metrics."""
+        self.caches[name] = cache
+
+
+    def register_gauges(self, name:str, collect):
+        """Report the (metric name, labels, value) tuples collect() returns as gauges, read each time metrics are."""
+        self.gauges[name] = collect
+
+
+    def snapshot(self) -> dict:
+        """Per-stage count, error count, mean and p50/p95/p99 latency in seconds, plus counters, cache stats and gauges."""
+
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "mean": stats.total / stats.count if stats.count else None,
+                    **{f"p{int(q * 100)}": value for q, value in stats.quantiles().items()},
+                }
+                for stage, stats in self.stages.items()
+            }
+            counters = {f"{name}{_labels(dict(labels))}": value for (name, labels), value in self.counters.items()}
+        caches = {name: cache.stats() for name, cache in self.caches.items()}
+        gauges = {f"{name}{_labels(labels)}": value for collect in self.gauges.values() for name, labels, value in collect()}
+        return {"stages": stages, "counters": counters, "caches": caches, "gauges": gauges}
+
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+
+        lines = []
+        with self._lock:
+            lines.append("# TYPE naviblu_stage_duration_seconds histogram")
+            for stage, stats in self.stages.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'naviblu_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'naviblu_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'naviblu_stage_duration_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'naviblu_stage_duration_seconds_count{{stage="{stage}"}} {stats.count}')
+
+            lines.append("# TYPE naviblu_stage_latency_seconds summary")
+            for stage, stats in self.stages.items():
+                for q, value in stats.quantiles().items():
+                    if value is not None:
+                        lines.append(f'naviblu_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+
+            lines.append("# TYPE naviblu_stage_errors_total counter")
+            for stage, stats in self.stages.items():
+                lines.append(f'naviblu_stage_errors_total{{stage="{stage}"}} {stats.errors}')
+
+            family = None
+            for (name, labels), value in sorted(self.counters.items()):
+                if name != family:
+                    family = name
+                    lines.append(f"# TYPE naviblu_{name} counter")
+                lines.append(f"naviblu_{name}{_labels(dict(labels))} {value}")
+
+        caches = {name: cache.stats() for name, cache in self.caches.items()}
+        for key, kind in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+            samples = [f'naviblu_cache_{key}{{cache="{name}"}} {stats[key]}' for name, stats in caches.items() if key in stats]
+            if samples:
+                lines.append(f"# TYPE naviblu_cache_{key} {kind}")
+                lines.extend(samples)
+
+        families = {}
+        for collect in self.gauges.values():
+            for name, labels, value in collect():
+                families.setdefault(name, []).append(f"naviblu_{name}{_labels(labels)} {value}")
+        for name, samples in families.items():
+            lines.append(f"# TYPE naviblu_{name} gauge")
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def span(stage:str, **fields):
+    """Time a stage of the pipeline. Yields a dict the caller can add fields to (token usage, cache hits, ...).
+    On exit the duration is recorded in METRICS and the span is logged as one structured log line."""
+
+    start = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        METRICS.observe(stage, duration, error is not None)
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if fields.get(kind):
+                METRICS.increment("llm_tokens_total", fields[kind], kind=kind.split("_")[0])
+        if "cache_hit" in fields:
+            METRICS.increment("cache_lookups_total", stage=stage, result="hit" if fields["cache_hit"] else "miss")
+
+        record = {"span": stage, "duration_ms": round(duration * 1000, 2), **fields}
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+            log.warning(json.dumps(record, default=str))
+        else:
+            log.info(json.dumps(record, default=str))
+
+
+def configure_logging(level:str | None = None):
+    """Send the naviblu logger's structured lines to stderr, unless the app configured logging already."""
+
+    if log.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('{"time": "%(asctime)s", "level": "%(levelname)s", "event": %(message)s}'))
+    log.addHandler(handler)
+    log.setLevel(level or os.getenv("NAVIBLU_LOG_LEVEL", "INFO"))
+    log.propagate = False
+
+
+def event(message:str, level:int = logging.INFO, **fields):
+    """Log a one-off structured event that isn't a timed span."""
+    log.log(level, json.dumps({"msg": message, **fields}, default=str))
+
+
+def start_metrics_server(port:int, host:str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = METRICS.render_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(METRICS.snapshot(), default=str).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="naviblu-metrics").start()
+    return server
+
+
+def _labels(labels:dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
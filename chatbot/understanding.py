@@ -0,0 +1,400 @@
+# Single-pass understanding of a user turn: intent categories plus flight and hotel search slots
+
+import json
+import re
+from datetime import date
+from tracing import event
+
+CATEGORIES = ["flight", "hotel", "location", "general"]
+
+IATA_CODE = {"type": "string", "pattern": "^[A-Z]{3}$"}
+ISO_DATE = {"type": "string", "format": "date"}
+
+FLIGHT_SCHEMA = {
+    "type": ["object", "null"],
+    "required": ["tripType", "originAirport", "destinationAirport", "departureDate", "numAdults", "numChildren", "seat"],
+    "properties": {
+        "tripType": {"enum": ["round-trip", "one-way", "multi-city"]},
+        "originCity": IATA_CODE,
+        "destinationCity": IATA_CODE,
+        "originAirport": IATA_CODE,
+        "destinationAirport": IATA_CODE,
+        "departureDate": ISO_DATE,
+        "arrivalDate": {"type": ["string", "null"], "format": "date"},
+        "legs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["fromAirport", "toAirport", "date"],
+                "properties": {"fromAirport": IATA_CODE, "toAirport": IATA_CODE, "date": ISO_DATE},
+            },
+        },
+        "numAdults": {"type": "integer", "minimum": 1, "maximum": 9},
+        "numChildren": {"type": "integer", "minimum": 0, "maximum": 8},
+        "seat": {"enum": ["economy", "premium-economy", "business", "first"]},
+        "flexibleDays": {"type": "integer", "minimum": 0, "maximum": 7},
+        "nearbyAirports": {"type": "boolean"},
+    },
+}
+
+HOTEL_SCHEMA = {
+    "type": ["object", "null"],
+    "required": ["city", "checkInDate", "checkOutDate", "numGuests"],
+    "properties": {
+        "city": IATA_CODE,
+        "checkInDate": ISO_DATE,
+        "checkOutDate": ISO_DATE,
+        "numGuests": {"type": "integer", "minimum": 1, "maximum": 9},
+    },
+}
+
+UNDERSTANDING_SCHEMA = {
+    "type": "object",
+    "required": ["categories"],
+    "properties": {
+        "categories": {"type": "array", "items": {"enum": CATEGORIES}},
+        "flight": FLIGHT_SCHEMA,
+        "hotel": HOTEL_SCHEMA,
+    },
+}
+
+# How closely a place named in a "from X to Y" phrase must match the index to override the LLM's code,
+# and to count as one of the places the phrase could name
+LOCAL_MATCH_SCORE = 0.8
+
+# Values filled in when a field is still invalid after the repair attempts
+DEFAULTS = {
+    "flight.numAdults": 2,
+    "flight.numChildren": 0,
+    "flight.seat": "economy",
+    "flight.legs": [],
+    "flight.flexibleDays": 0,
+    "flight.nearbyAirports": False,
+    "hotel.numGuests": 2,
+}
+
+UNDERSTAND_PROMPT = """You read a conversation with a travel assistant and work out what the user currently needs.
+Respond with a single JSON object and nothing else, structured exactly like this:
+
+{{
+"categories": list of one or more of "flight", "hotel", "location", "general",
+"flight": null unless categories contains "flight", otherwise {{
+    "tripType": either "round-trip", "one-way", or "multi-city",
+    "originCity": three letter origin city iataCode,
+    "destinationCity": three letter destination city iataCode,
+    "originAirport": three letter origin airport code based on the city,
+    "destinationAirport": three letter destination airport code based on the city,
+    "departureDate": "YYYY-MM-DD",
+    "arrivalDate": "YYYY-MM-DD" for round-trip, otherwise null,
+    "legs": only if tripType is multi-city, a list of every leg in order like [{{"fromAirport": "XXX", "toAirport": "XXX", "date": "YYYY-MM-DD"}}], otherwise [],
+    "numAdults": number, if no number is specified assume 2,
+    "numChildren": number, if no number is specified assume 0,
+    "seat": either "economy", "premium-economy", "business", or "first". If no specification is made, use "economy",
+    "flexibleDays": how many days either side of the dates the user is flexible, from 0 to 7. Use 3 for "around" or "give or take a few days", 7 for a whole month or "cheapest in March" (with the dates in the middle of that range), otherwise 0,
+    "nearbyAirports": true if the user is happy to use other airports near the origin or destination ("anywhere near Charlotte", "any London airport"), otherwise false
+    }},
+"hotel": null unless categories contains "hotel", otherwise {{
+    "city": three letter city iataCode,
+    "checkInDate": "YYYY-MM-DD",
+    "checkOutDate": "YYYY-MM-DD",
+    "numGuests": number, if no number is specified assume 2
+    }}
+}}
+
+Rules for categories:
+- 'flight' for flight searches, 'hotel' for hotel searches
+- 'location' only if the user wants information about attractions and activities at a specific place
+- 'general' for anything else, including questions about what the chatbot can do
+- Only classify what the latest user message asks for; use earlier messages just to fill in missing details
+
+Examples of categories:
+user: can you find flights to New York? -> ["flight"]
+user: can you find hotels in vancouver this weekend? -> ["hotel"]
+user: what are hotels near popular tourist locations in Orlando? -> ["hotel", "location"]
+user: help me plan an entire trip from Charlotte to London this weekend. -> ["flight", "hotel", "location"]
+user: what are some popular activities to do in Wellington, New Zealand? -> ["location"]
+user: How far is Tokyo from New York? -> ["general"]
+user: what can you do? -> ["general"]
+
+If you can't find information for a field, make an educated guess based on the conversation.
+Today's date is {todays_date}."""
+
+REPAIR_PROMPT = """Your previous answer had invalid or missing fields:
+{errors}
+
+Respond with a single JSON object containing ONLY corrected values for those fields, keyed by the field path shown above,
+for example {{"flight.departureDate": "2025-07-04"}}. Use null for a whole section only if the user did not ask for it.
+Today's date is {todays_date}."""
+
+
+class UnderstandingError(Exception):
+    """Raised when the LLM output couldn't be parsed as JSON even after retrying."""
+
+
+def understand(call_llm, chat_history:list[dict], todays_date:str, max_repairs:int = 1, places = None) -> dict:
+    """Classify the latest user message and extract flight and hotel search slots in one LLM call.
+
+    call_llm is Chatbot.call_llm. The result is validated against UNDERSTANDING_SCHEMA; only the invalid fields
+    are sent back to the LLM for repair. A flight or hotel slot that still can't be validated is set to None.
+    If places (an AirportIndex) is given, airport and city codes are checked against it and unknown codes are
+    first resolved locally from the user's message, so only codes that can't be fixed cost a repair call."""
+
+    messages = [{"role": "system", "content": UNDERSTAND_PROMPT.format(todays_date=todays_date)}]
+    # The assistant's own system prompt doesn't help with classification, so skip it (but keep any conversation summary)
+    messages += [message for i, message in enumerate(chat_history) if not (i == 0 and message.get("role") == "system")]
+    user_text = next((str(message.get("content", "")) for message in reversed(chat_history) if message.get("role") == "user"), "")
+
+    response = call_llm(messages=messages, temperature=0.0, json_mode=True)
+    try:
+        result = json.loads(response)
+    except (TypeError, json.JSONDecodeError):
+        # Malformed output, ask once more for the whole object
+        response = call_llm(messages=messages, temperature=0.0, json_mode=True)
+        try:
+            result = json.loads(response)
+        except (TypeError, json.JSONDecodeError) as e:
+            raise UnderstandingError(f"Could not parse understanding output: {response!r}") from e
+    if not isinstance(result, dict):
+        result = {}
+
+    result = normalize(result)
+    if places is not None:
+        resolve_places(result, places, user_text)
+    errors = check(result, places)
+
+    for attempt in range(max_repairs):
+        if not errors:
+            break
+        event("repairing understanding fields", fields=[path for path, _ in errors])
+        repair_messages = messages + [
+            {"role": "assistant", "content": json.dumps(result)},
+            {"role": "user", "content": REPAIR_PROMPT.format(errors="\n".join(f"- {path}: {message}" for path, message in errors),
+                                                             todays_date=todays_date)},
+        ]
+        try:
+            fixes = json.loads(call_llm(messages=repair_messages, temperature=0.0, json_mode=True)) # type: ignore
+        except (TypeError, json.JSONDecodeError):
+            continue
+        if isinstance(fixes, dict):
+            for path, value in fixes.items():
+                _set_path(result, path, value)
+        result = normalize(result)
+        if places is not None:
+            resolve_places(result, places, user_text)
+        errors = check(result, places)
+
+    # Fall back to defaults, and give up on any slot that still isn't usable
+    for path, _ in errors:
+        if path in DEFAULTS:
+            _set_path(result, path, DEFAULTS[path])
+    for path, _ in check(result, places):
+        section = path.split(".")[0]
+        if section in ("flight", "hotel"):
+            result[section] = None
+        elif section == "categories":
+            result["categories"] = [cat for cat in result.get("categories") or [] if cat in CATEGORIES]
+
+    if not result.get("categories"):
+        result["categories"] = ["general"]
+    return result
+
+
+def normalize(result:dict) -> dict:
+    """Fix cosmetic differences (case, "None" strings, numbers as strings) without spending an LLM call."""
+
+    categories = result.get("categories")
+    if isinstance(categories, str):
+        categories = categories.split(",")
+    if isinstance(categories, list):
+        result["categories"] = [str(cat).strip().lower() for cat in categories if str(cat).strip()]
+
+    for section in ("flight", "hotel"):
+        slots = result.get(section)
+        if not isinstance(slots, dict):
+            continue
+        for key, value in list(slots.items()):
+            if isinstance(value, str) and value.strip().lower() in ("none", "null", ""):
+                slots[key] = None
+            elif key in ("originCity", "destinationCity", "originAirport", "destinationAirport", "city") and isinstance(value, str):
+                slots[key] = value.strip().upper()
+            elif key in ("numAdults", "numChildren", "numGuests", "flexibleDays") and isinstance(value, str) and value.strip().isdigit():
+                slots[key] = int(value)
+            elif key in ("seat", "tripType") and isinstance(value, str):
+                slots[key] = value.strip().lower().replace(" ", "-")
+            elif key == "nearbyAirports" and isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                slots[key] = value.strip().lower() == "true"
+        for leg in slots.get("legs") or []:
+            if isinstance(leg, dict):
+                for key in ("fromAirport", "toAirport"):
+                    if isinstance(leg.get(key), str):
+                        leg[key] = leg[key].strip().upper()
+    return result
+
+
+def check(result:dict, places = None) -> list[tuple[str, str]]:
+    """Schema errors plus the rules a JSON schema can't express, as (field path, message) pairs.
+    With places, airport and city codes must also be known to the airport index."""
+
+    errors = validate(result, UNDERSTANDING_SCHEMA)
+    categories = result.get("categories") or []
+
+    for section in ("flight", "hotel"):
+        if section in categories and result.get(section) is None:
+            errors.append((section, f"missing, but categories contains '{section}'"))
+
+    flight = result.get("flight")
+    if isinstance(flight, dict):
+        if flight.get("tripType") == "round-trip" and flight.get("arrivalDate") is None:
+            errors.append(("flight.arrivalDate", "required for a round-trip"))
+        if flight.get("tripType") == "multi-city" and not flight.get("legs"):
+            errors.append(("flight.legs", "required for a multi-city trip"))
+
+    hotel = result.get("hotel")
+    if isinstance(hotel, dict) and _is_date(hotel.get("checkInDate")) and _is_date(hotel.get("checkOutDate")):
+        if hotel["checkOutDate"] <= hotel["checkInDate"]:
+            errors.append(("hotel.checkOutDate", "must be after checkInDate"))
+
+    if places is not None:
+        failed = {path for path, _ in errors}
+        for path, code, kind in _place_codes(result):
+            if path in failed or not isinstance(code, str):
+                continue
+            if kind == "airport" and not places.is_airport(code):
+                errors.append((path, f"'{code}' is not a known IATA airport code"))
+            elif kind == "city" and places.city_code(code) is None:
+                errors.append((path, f"'{code}' is not a known IATA city code"))
+
+    return errors
+
+
+def resolve_places(result:dict, places, text:str) -> dict:
+    """Fix flight and hotel codes with the local airport index before anything is validated or searched.
+
+    City codes in airport slots become the city's main airport (NYC → JFK) and airport codes in city slots
+    become their city (JFK → NYC). A flight code the LLM left out or made up is filled in from the user's
+    "from X to Y" phrase, and a known one is only replaced when that phrase names exactly one city and it's
+    a different one ("San Jose" could be SJC or SJO, so the LLM's pick stands). An unknown hotel city is
+    replaced by the one city the message mentions."""
+
+    flight = result.get("flight")
+    if isinstance(flight, dict):
+        route = places.route_candidates(text)
+        for index, (airport_key, city_key) in enumerate((("originAirport", "originCity"), ("destinationAirport", "destinationCity"))):
+            code = places.airport_code(flight.get(airport_key)) or places.airport_code(flight.get(city_key))
+            candidates = [place for place in route[index] if place.score >= LOCAL_MATCH_SCORE]
+            cities = set(places.city_code(place.code) for place in candidates)
+            if candidates and (code is None or len(cities) == 1 and places.city_code(code) not in cities):
+                code = places.airport_code(candidates[0].code)
+            if code is not None:
+                flight[airport_key] = code
+                flight[city_key] = places.city_code(code)
+        for leg in flight.get("legs") or []:
+            if isinstance(leg, dict):
+                for key in ("fromAirport", "toAirport"):
+                    leg[key] = places.airport_code(leg.get(key)) or leg.get(key)
+
+    hotel = result.get("hotel")
+    if isinstance(hotel, dict):
+        city = places.city_code(hotel.get("city"))
+        if city is None:
+            mentioned = list(dict.fromkeys(places.city_code(place.code) for place in places.mentions(text)))
+            city = mentioned[0] if len(mentioned) == 1 else None
+        if city is not None:
+            hotel["city"] = city
+    return result
+
+
+def validate(instance, schema:dict, path:str = "") -> list[tuple[str, str]]:
+    """Validate instance against the subset of JSON Schema used in this module
+    (type, enum, pattern, format: date, minimum, maximum, required, properties, items)."""
+
+    errors = []
+    types = schema.get("type")
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if instance is None:
+            return [] if "null" in types else [(path, "is required")]
+        if not any(_is_type(instance, t) for t in types):
+            return [(path, f"must be of type {' or '.join(types)}")]
+
+    if "enum" in schema and instance not in schema["enum"]:
+        return [(path, f"must be one of {schema['enum']}")]
+    if "pattern" in schema and isinstance(instance, str) and not re.match(schema["pattern"], instance):
+        return [(path, f"must match {schema['pattern']}")]
+    if schema.get("format") == "date" and isinstance(instance, str) and not _is_date(instance):
+        return [(path, "must be a date formatted YYYY-MM-DD")]
+    if "minimum" in schema and isinstance(instance, (int, float)) and instance < schema["minimum"]:
+        return [(path, f"must be at least {schema['minimum']}")]
+    if "maximum" in schema and isinstance(instance, (int, float)) and instance > schema["maximum"]:
+        return [(path, f"must be at most {schema['maximum']}")]
+
+    if isinstance(instance, dict):
+        for key in schema.get("required", []):
+            if instance.get(key) is None and "null" not in str(schema.get("properties", {}).get(key, {}).get("type")):
+                errors.append((_join(path, key), "is required"))
+        for key, subschema in schema.get("properties", {}).items():
+            if instance.get(key) is not None:
+                errors += validate(instance[key], subschema, _join(path, key))
+
+    if isinstance(instance, list) and "items" in schema:
+        for i, item in enumerate(instance):
+            errors += validate(item, schema["items"], f"{path}[{i}]")
+
+    return errors
+
+
+def _is_type(value, json_type:str) -> bool:
+    if json_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, {"object": dict, "array": list, "string": str, "boolean": bool, "null": type(None)}[json_type])
+
+
+def _is_date(value) -> bool:
+    try:
+        date.fromisoformat(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _place_codes(result:dict):
+    """(field path, code, "airport" or "city") for every location code in the flight and hotel slots."""
+
+    flight = result.get("flight")
+    if isinstance(flight, dict):
+        yield "flight.originAirport", flight.get("originAirport"), "airport"
+        yield "flight.destinationAirport", flight.get("destinationAirport"), "airport"
+        for i, leg in enumerate(flight.get("legs") or []):
+            if isinstance(leg, dict):
+                yield f"flight.legs[{i}].fromAirport", leg.get("fromAirport"), "airport"
+                yield f"flight.legs[{i}].toAirport", leg.get("toAirport"), "airport"
+    hotel = result.get("hotel")
+    if isinstance(hotel, dict):
+        yield "hotel.city", hotel.get("city"), "city"
+
+
+def _join(path:str, key:str) -> str:
+    return f"{path}.{key}" if path else key
+
+
+def _set_path(result:dict, path:str, value):
+    """Set a dotted field path such as "flight.departureDate" or "flight.legs[1].date"."""
+
+    parts = re.findall(r"[^.\[\]]+", path)
+    target = result
+    for part in parts[:-1]:
+        key = int(part) if part.isdigit() else part
+        if isinstance(target, list):
+            if not isinstance(key, int) or key >= len(target):
+                return
+            target = target[key]
+        else:
+            if not isinstance(target.get(key), (dict, list)):
+                target[key] = {}
+            target = target[key]
+    last = int(parts[-1]) if parts[-1].isdigit() else parts[-1]
+    if isinstance(target, list):
+        if isinstance(last, int) and last < len(target):
+            target[last] = value
+    elif isinstance(target, dict):
+        target[last] = value
@@ -1,8 +1,7 @@
 import os
 import sys
 import subprocess
-import http.server
-import socketserver
+import static_server
 
 def check_streamlit_installed():
     """Check if streamlit is installed."""
@@ -17,10 +16,12 @@ def main():
     print("\nNaviBlu Travel Assistant - Local Testing")
     print("=" * 50)
     print("1. Run Streamlit App (for testing chatbot)")
-    print("2. Serve Static Website (with embedded HF Space)")
+    print("2. Serve Static Website (chatting with the HF Space API)")
+    print("3. Run Chatbot API only")
+    print("4. Serve Static Website in production mode (long-lived caching, precompressed, responsive images)")
     print()
     
-    choice = input("Which option? (1 or 2): ").strip()
+    choice = input("Which option? (1, 2, 3 or 4): ").strip()
     
     if choice == "1":
         # Check if dependencies are installed
@@ -31,28 +32,53 @@ def main():
             print("\nThen run this script again.")
             return
         
-        print("\nStarting Streamlit App...")
+        print("\nStarting Chatbot API and Streamlit App...")
+        print("API: http://localhost:8000")
         print("URL: http://localhost:8501")
         print("Press Ctrl+C to stop\n")
         
-        # Use python -m streamlit for better compatibility
-        os.system(f'{sys.executable} -m streamlit run chatbot/app.py')
+        # The Streamlit app is a client of the API server, so run both
+        api = subprocess.Popen([sys.executable, "chatbot/server.py"])
+        try:
+            # Use python -m streamlit for better compatibility
+            os.system(f'{sys.executable} -m streamlit run chatbot/app.py')
+        finally:
+            api.terminate()
+            api.wait()
         
     elif choice == "2":
         print("\nStarting Static Website Server...")
-        print("URL: http://localhost:8000")
-        print("The embedded Streamlit app will load from Hugging Face Space")
+        print("URL: http://localhost:8080")
+        print("The chat talks to the Hugging Face Space API")
+        print("Open http://localhost:8080/?api=http://localhost:8000 to use a local API instead (option 3, in another terminal)")
         print("Press Ctrl+C to stop\n")
         
-        PORT = 8000
-        
-        Handler = http.server.SimpleHTTPRequestHandler
-        with socketserver.TCPServer(("", PORT), Handler) as httpd:
-            print(f"✅ Server running at http://localhost:{PORT}\n")
-            httpd.serve_forever()
+        # Threaded, so one slow client doesn't block the rest; every load revalidates, so edits show up right away
+        # On 8080, so the API (option 3) can run on 8000 at the same time
+        static_server.serve(port=8080, max_age=0, log_requests=True)
             
+    elif choice == "3":
+        print("\nStarting Chatbot API...")
+        print("URL: http://localhost:8000 (set NAVIBLU_API_WORKERS for more worker processes)")
+        print("Press Ctrl+C to stop\n")
+
+        os.system(f'{sys.executable} chatbot/server.py')
+
+    elif choice == "4":
+        if input("Build downscaled images for responsive srcsets first? Needs Pillow (y/N): ").strip().lower() == "y":
+            manifest = static_server.build_images()
+            print(f"Wrote {sum(len(variants) for variants in manifest.values())} image copies to {static_server.RESPONSIVE_DIR}/")
+
+        print("\nStarting Static Website Server (production mode)...")
+        print("URL: http://localhost:8080")
+        print("Assets are versioned and cached by the browser, text is served gzip/brotli compressed")
+        print("Load test it with: python benchmarks/static_load.py --url http://localhost:8080")
+        print("Press Ctrl+C to stop\n")
+
+        static_server.serve(port=8080)
+
     else:
-        print("Invalid choice. Please enter 1 or 2.")
+        print("Invalid choice. Please enter 1, 2, 3 or 4.")
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,9 @@ const SLIDE_INTERVAL = 6000;
 let slideIndex = 0;
 let slideInterval;
 
+// srcsets of the images that have downscaled copies, added to the page by static_server.py when they're built
+const RESPONSIVE_IMAGES = JSON.parse(document.getElementById('responsive-images')?.textContent || '{}');
+
 // Generate slideshow
 function initializeSlideshow() {
     const wrapper = document.querySelector('.slideshow-wrapper');
@@ -13,7 +16,9 @@ function initializeSlideshow() {
     for (let i = 1; i <= SLIDE_COUNT; i++) {
         const slide = document.createElement('div');
         slide.className = `slide ${i === 1 ? 'active' : ''}`;
-        slide.innerHTML = `<img src="images/travel-${i}.jpg" alt="Beautiful destination ${i}">`;
+        const src = `images/travel-${i}.jpg`;
+        const srcset = RESPONSIVE_IMAGES[src] ? ` srcset="${RESPONSIVE_IMAGES[src]}" sizes="(max-width: 1200px) 50vw, 600px"` : '';
+        slide.innerHTML = `<img src="${src}"${srcset} alt="Beautiful destination ${i}">`;
         wrapper.appendChild(slide);
     }
     
@@ -68,10 +73,179 @@ function resetTimer() {
     startSlideshow();
 }
 
+// Chat client for the NaviBlu API
+let chatApiUrl = '';
+let chatSessionId = null;
+
+function initializeChat() {
+    const content = document.querySelector('.chat-window-content');
+    if (!content) return;
+
+    chatApiUrl = (new URLSearchParams(location.search).get('api') || content.dataset.apiUrl).replace(/\/$/, '');
+    chatSessionId = sessionStorage.getItem('naviblu-session');
+
+    const form = content.querySelector('.chat-form');
+    const input = content.querySelector('.chat-input');
+    const button = content.querySelector('.chat-send');
+
+    form.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        const message = input.value.trim();
+        if (!message) return;
+
+        input.value = '';
+        button.disabled = true;
+        addChatMessage('user').textContent = message;
+        const reply = addChatMessage('assistant pending');
+        reply.textContent = 'Searching...';
+
+        try {
+            await streamReply(message, reply);
+        } catch (err) {
+            reply.innerHTML = renderMarkdown('⚠️ **NaviBlu is unavailable right now. Please try again in a moment.**');
+        }
+        reply.classList.remove('pending');
+        button.disabled = false;
+        input.focus();
+    });
+}
+
+function addChatMessage(kind) {
+    const messages = document.querySelector('.chat-messages');
+    const element = document.createElement('div');
+    element.className = `chat-message ${kind}`;
+    messages.appendChild(element);
+    messages.scrollTop = messages.scrollHeight;
+    return element;
+}
+
+async function startSession() {
+    const response = await fetch(`${chatApiUrl}/api/sessions`, { method: 'POST' });
+    if (!response.ok) throw new Error(`session: ${response.status}`);
+    chatSessionId = (await response.json()).session_id;
+    sessionStorage.setItem('naviblu-session', chatSessionId);
+}
+
+// Send a message and render the server-sent events into element as they arrive.
+// A session the API no longer knows (e.g. after a restart) is replaced once.
+async function streamReply(message, element) {
+    let response;
+    for (let attempt = 0; attempt < 2; attempt++) {
+        if (!chatSessionId) await startSession();
+        response = await fetch(`${chatApiUrl}/api/sessions/${chatSessionId}/messages`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify({ message })
+        });
+        if (response.status !== 404) break;
+        chatSessionId = null;
+    }
+    if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        element.innerHTML = renderMarkdown(`⚠️ **${error.error || 'Something went wrong. Please try again.'}**`);
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const sections = {};
+    let order = [];
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+
+            let name = 'message';
+            const data = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) name = line.slice(6).trim();
+                else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+            });
+            if (!data.length) continue;
+            const payload = JSON.parse(data.join('\n'));
+
+            if (name === 'start') {
+                order = payload.order;
+            } else if (name === 'section') {
+                sections[payload.section] = payload.final ? payload.text : (sections[payload.section] || '') + payload.text;
+                element.innerHTML = renderMarkdown(order.filter(key => key in sections).map(key => sections[key]).join('\n'));
+            } else if (name === 'done') {
+                element.innerHTML = renderMarkdown(payload.response);
+            } else if (name === 'error') {
+                element.innerHTML = renderMarkdown(`⚠️ **${payload.error}**`);
+            }
+            element.parentElement.scrollTop = element.parentElement.scrollHeight;
+        }
+    }
+}
+
+// Just enough Markdown for the chatbot's replies: headings, rules, lists, tables, bold, italics and links
+// Replies can come from the answer cache shared by every session, so nothing in them may reach the page as markup.
+function renderMarkdown(text) {
+    const escaped = escapeHtml(text);
+    const inline = line => line
+        .replace(/\*\*(.+?)\*\*/g, '<strong>$1</strong>')
+        .replace(/\*(.+?)\*/g, '<em>$1</em>')
+        .replace(/\[([^\]]+)\]\((https?:\/\/[^\s)]+)\)/g, (match, label, href) => renderLink(label, href));
+    const cells = (line, tag) => line.replace(/^\||\|$/g, '').split('|').map(cell => `<${tag}>${inline(cell.trim())}</${tag}>`).join('');
+
+    const html = [];
+    let table = null;
+    escaped.split('\n').forEach(line => {
+        const trimmed = line.trim();
+        if (trimmed.startsWith('|')) {
+            // The first row of a table is its header and the second the |---| separator
+            if (table === null) table = [`<tr>${cells(trimmed, 'th')}</tr>`];
+            else if (!/^[|\s:-]+$/.test(trimmed)) table.push(`<tr>${cells(trimmed, 'td')}</tr>`);
+            return;
+        }
+        if (table !== null) {
+            html.push(`<table>${table.join('')}</table>`);
+            table = null;
+        }
+        if (/^-{3,}$/.test(trimmed)) html.push('<hr>');
+        else if (trimmed.startsWith('#')) html.push(`<h3>${inline(trimmed.replace(/^#+\s*/, ''))}</h3>`);
+        else if (/^[-*] /.test(trimmed)) html.push(`• ${inline(trimmed.slice(2))}<br>`);
+        else if (trimmed) html.push(`${inline(trimmed)}<br>`);
+    });
+    if (table !== null) html.push(`<table>${table.join('')}</table>`);
+    return html.join('');
+}
+
+function escapeHtml(text) {
+    return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+// An http(s) link built through the DOM, so the URL can only ever end up in the href attribute.
+// label is already escaped; href is too, and is unescaped before it is parsed.
+function renderLink(label, href) {
+    let url;
+    try {
+        url = new URL(href.replace(/&quot;/g, '"').replace(/&#39;/g, "'").replace(/&lt;/g, '<').replace(/&gt;/g, '>').replace(/&amp;/g, '&'));
+    } catch {
+        return label;
+    }
+    if (url.protocol !== 'http:' && url.protocol !== 'https:') return label;
+    const anchor = document.createElement('a');
+    anchor.href = url.href;
+    anchor.target = '_blank';
+    anchor.rel = 'noopener';
+    anchor.innerHTML = label;
+    return anchor.outerHTML;
+}
+
 // Initialize all page functionality on load
 document.addEventListener('DOMContentLoaded', () => {
     initializeSlideshow();
     startSlideshow();
+    initializeChat();
     
     const container = document.querySelector('.slideshow-container');
     container.addEventListener('mouseenter', () => clearInterval(slideInterval));
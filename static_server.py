@@ -0,0 +1,420 @@
+# Production server for the static website: threaded, with sendfile, conditional requests, long-lived caching,
+# precompressed text assets and responsive images
+#
+#   python static_server.py                       serve the site on NAVIBLU_STATIC_PORT (8000)
+#   python static_server.py --port 8080 --dev     revalidate everything on every load, and log requests
+#   python static_server.py --build-images        write downscaled copies of images/ for srcsets (needs Pillow), then exit
+#
+# HTML is always revalidated. The CSS, JS and images it references get a ?v=<version> query, and versioned URLs
+# are cached for a year; anything else is cached for NAVIBLU_STATIC_MAX_AGE seconds. Text assets are compressed
+# once with gzip and, when the brotli package is installed, brotli. Everything else is sent from disk with sendfile.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import threading
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HOST = os.getenv("NAVIBLU_STATIC_HOST", "0.0.0.0")
+PORT = int(os.getenv("NAVIBLU_STATIC_PORT", "8000"))
+
+# Seconds browsers may reuse an unversioned asset before revalidating it, and versioned ones
+MAX_AGE = int(os.getenv("NAVIBLU_STATIC_MAX_AGE", str(24 * 60 * 60)))
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Only these file types are served, so the Python sources and data files next to the site stay private
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon",
+}
+COMPRESSIBLE = {".html", ".css", ".js", ".svg"}
+
+# Downscaled copies of images/ written by --build-images, and the widths made (never wider than the original)
+RESPONSIVE_DIR = "images/responsive"
+RESPONSIVE_WIDTHS = (360, 720, 1280)
+RESPONSIVE_MANIFEST = f"{RESPONSIVE_DIR}/manifest.json"
+
+# Local CSS/JS/image references in HTML, which get a version query
+ASSET_REFERENCE = re.compile(r'\b(src|href)="([^":?#]+\.(?:css|js|png|jpe?g|webp|gif|svg|ico))"')
+# <img> tags that declare their rendered size, which get a srcset when downscaled copies exist
+SIZED_IMAGE = re.compile(r'<img\b[^>]*\bsizes="[^"]*"[^>]*>')
+
+
+@dataclass
+class Asset():
+    """A servable file. Text assets are held in memory with their compressed variants; other files are sent from disk."""
+    path: str
+    content_type: str
+    size: int
+    mtime: float
+    version: str # short hash of the content (in memory) or of the file's size and mtime (on disk)
+    body: bytes | None = None
+    encoded: dict = field(default_factory=dict) # content coding -> compressed body, only when smaller
+    depends: dict = field(default_factory=dict) # file -> stamp, for HTML whose rewritten references must stay current
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+def _stamp(path:str) -> tuple | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _digest(data:bytes) -> str:
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+class AssetTable():
+    """Files under root by URL path, loaded on first request and reloaded when they change on disk."""
+
+    def __init__(self, root:str):
+        self.root = os.path.realpath(root)
+        self._assets = {} # file path -> (stamp, Asset)
+        self._lock = threading.Lock()
+
+
+    def resolve(self, url_path:str) -> str | None:
+        """File a URL path refers to, or None for paths outside root, hidden files and types that aren't served."""
+
+        url_path = posixpath.normpath(unquote(url_path))
+        if url_path in ("/", "."):
+            url_path = "/index.html"
+        parts = [part for part in url_path.split("/") if part]
+        if any(part.startswith(".") for part in parts):
+            return None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if not path.startswith(self.root + os.sep):
+            return None
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        if os.path.splitext(path)[1].lower() not in CONTENT_TYPES:
+            return None
+        return path
+
+
+    def get(self, path:str) -> Asset | None:
+        """The current Asset for a file resolved by resolve(), or None if it doesn't exist."""
+
+        stamp = _stamp(path)
+        if stamp is None:
+            return None
+        with self._lock:
+            cached = self._assets.get(path)
+        if cached is not None and cached[0] == stamp and all(_stamp(dep) == dep_stamp for dep, dep_stamp in cached[1].depends.items()):
+            return cached[1]
+
+        asset = self._load(path, stamp)
+        with self._lock:
+            self._assets[path] = (stamp, asset)
+        return asset
+
+
+    def preload(self) -> int:
+        """Load and compress every servable text asset ahead of the first requests. Returns how many were loaded."""
+
+        loaded = 0
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in files:
+                path = os.path.join(directory, name)
+                if os.path.splitext(name)[1].lower() in COMPRESSIBLE and self.resolve("/" + os.path.relpath(path, self.root)):
+                    loaded += self.get(path) is not None
+        return loaded
+
+
+    def _load(self, path:str, stamp:tuple) -> Asset:
+        extension = os.path.splitext(path)[1].lower()
+        asset = Asset(path, CONTENT_TYPES[extension], stamp[1], stamp[0] / 1e9, _digest(repr(stamp).encode()))
+        if extension not in COMPRESSIBLE:
+            return asset
+
+        with open(path, "rb") as file:
+            body = file.read()
+        if extension == ".html":
+            body = self._rewrite_html(path, body.decode("utf-8"), asset.depends).encode("utf-8")
+            # The page changes when what it references does
+            asset.mtime = max([asset.mtime] + [stamp[0] / 1e9 for stamp in asset.depends.values() if stamp])
+        asset.body, asset.size, asset.version = body, len(body), _digest(body)
+
+        # Compressed once here, so requests only pick a variant
+        variants = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=11)
+        asset.encoded = {coding: data for coding, data in variants.items() if len(data) < len(body)}
+        return asset
+
+
+    def _rewrite_html(self, path:str, html:str, depends:dict) -> str:
+        """Add the version of each local asset to its URL, and srcsets from the responsive image manifest."""
+
+        base = os.path.dirname(path)
+        manifest_path = os.path.join(self.root, *RESPONSIVE_MANIFEST.split("/"))
+        depends[manifest_path] = _stamp(manifest_path)
+        srcsets = self._srcsets(manifest_path, base, depends)
+
+        def versioned(reference:str) -> str:
+            target = os.path.realpath(os.path.join(base, reference))
+            asset = self.get(target) if target.startswith(self.root + os.sep) else None
+            if asset is None:
+                return reference
+            depends[target] = _stamp(target)
+            return f"{reference}?v={asset.version}"
+
+        def add_srcset(match) -> str:
+            tag = match.group(0)
+            src = re.search(r'\bsrc="([^"?]+)', tag)
+            if src is None or src.group(1) not in srcsets or "srcset=" in tag:
+                return tag
+            return tag.replace("<img", f'<img srcset="{srcsets[src.group(1)]}"', 1)
+
+        html = SIZED_IMAGE.sub(add_srcset, html)
+        html = ASSET_REFERENCE.sub(lambda match: f'{match.group(1)}="{versioned(match.group(2))}"', html)
+        if srcsets:
+            # Images added by scripts.js (the slideshow) look their srcset up here
+            html = html.replace("</head>", f'    <script id="responsive-images" type="application/json">{json.dumps(srcsets)}</script>\n</head>', 1)
+        return html
+
+
+    def _srcsets(self, manifest_path:str, base:str, depends:dict) -> dict:
+        """srcset attribute for each image with downscaled copies, keyed by its URL relative to the page."""
+
+        try:
+            with open(manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        srcsets = {}
+        for image, variants in manifest.items():
+            candidates = []
+            for width, variant in variants:
+                target = os.path.join(self.root, *variant.split("/"))
+                asset = self.get(target)
+                if asset is None:
+                    break
+                depends[target] = _stamp(target)
+                candidates.append(f"{posixpath.relpath(variant, os.path.relpath(base, self.root))}?v={asset.version} {width}w")
+            else:
+                srcsets[posixpath.relpath(image, os.path.relpath(base, self.root))] = ", ".join(candidates)
+        return srcsets
+
+
+def accepted_codings(header:str) -> set[str]:
+    """Content codings an Accept-Encoding header allows (q > 0)."""
+
+    codings = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        try:
+            weight = float(q[2:]) if q.startswith("q=") else 1.0
+        except ValueError:
+            weight = 1.0
+        if coding and weight > 0:
+            codings.add(coding.strip().lower())
+    return codings
+
+
+class StaticHandler(BaseHTTPRequestHandler):
+    """GET and HEAD for the files in the server's AssetTable, with keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "NaviBlu"
+    timeout = 30 # seconds a connection may sit idle, so slow or idle clients don't hold threads forever
+
+
+    def do_GET(self):
+        self._serve(body=True)
+
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+
+    def _serve(self, body:bool):
+        url = urlsplit(self.path)
+        path = self.server.assets.resolve(url.path)
+        asset = None if path is None else self.server.assets.get(path)
+        if asset is None:
+            self.send_error(404)
+            return
+
+        # Pick the smallest variant the client accepts: brotli, then gzip, then the file itself
+        accepted = accepted_codings(self.headers.get("Accept-Encoding", ""))
+        coding = next((coding for coding in ("br", "gzip") if coding in accepted and coding in asset.encoded), None)
+        etag = asset.etag if coding is None else f'"{asset.version}-{coding}"'
+
+        versioned = parse_qs(url.query).get("v", [None])[0] == asset.version
+        if asset.content_type.startswith("text/html") or self.server.max_age <= 0:
+            cache_control = "no-cache"
+        elif versioned:
+            cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            cache_control = f"public, max-age={self.server.max_age}"
+
+        if self._not_modified(asset, etag):
+            self.send_response(304)
+            self._send_validators(asset, etag, cache_control)
+            self.end_headers()
+            return
+
+        data = asset.body if coding is None else asset.encoded[coding]
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(asset.size if data is None else len(data)))
+        if coding is not None:
+            self.send_header("Content-Encoding", coding)
+        self._send_validators(asset, etag, cache_control)
+        self.end_headers()
+        if not body:
+            return
+
+        if data is not None:
+            self.wfile.write(data)
+            return
+        # Large files go from the page cache to the socket without passing through Python
+        with open(asset.path, "rb") as file:
+            sent = self.connection.sendfile(file, 0, asset.size)
+        if sent != asset.size:
+            # The file changed while it was being sent, so the response is short
+            self.close_connection = True
+
+
+    def _not_modified(self, asset:Asset, etag:str) -> bool:
+        """Whether the client's copy is current. If-None-Match wins over If-Modified-Since when both are sent."""
+
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            return int(asset.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+
+    def _send_validators(self, asset:Asset, etag:str, cache_control:str):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(asset.mtime, usegmt=True))
+        self.send_header("Cache-Control", cache_control)
+        if asset.encoded:
+            self.send_header("Vary", "Accept-Encoding")
+
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+
+class StaticServer(ThreadingHTTPServer):
+    """Serves each connection on its own thread, so a slow client only holds up itself."""
+
+    request_queue_size = 128
+
+    def __init__(self, address:tuple, root:str = ROOT, max_age:int = MAX_AGE, log_requests:bool = False):
+        self.assets = AssetTable(root)
+        self.max_age = max_age
+        self.log_requests = log_requests
+        super().__init__(address, StaticHandler)
+
+
+def serve(host:str = HOST, port:int = PORT, root:str = ROOT, max_age:int = MAX_AGE, log_requests:bool = False):
+    """Serve the site until interrupted, with the text assets compressed before the first request."""
+
+    with StaticServer((host, port), root, max_age, log_requests) as httpd:
+        httpd.assets.preload()
+        print(f"✅ Server running at http://localhost:{port} (compression: {'br, gzip' if brotli else 'gzip'})\n")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def build_images(root:str = ROOT, widths:tuple = RESPONSIVE_WIDTHS, quality:int = 82) -> dict:
+    """Write downscaled copies of each JPEG and PNG in images/ at the given widths (only those narrower than the
+    original) to images/responsive/, and a manifest of them the server builds srcsets from. Copies newer than
+    their original are kept. Returns the manifest: image -> [[width, copy], ...]."""
+
+    try:
+        from PIL import Image
+    except ImportError:
+        raise SystemExit("Building responsive images needs Pillow: pip install Pillow")
+
+    output = os.path.join(root, *RESPONSIVE_DIR.split("/"))
+    os.makedirs(output, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(os.path.join(root, "images"))):
+        stem, extension = os.path.splitext(name)
+        source = os.path.join(root, "images", name)
+        if extension.lower() not in (".jpg", ".jpeg", ".png") or not os.path.isfile(source):
+            continue
+
+        with Image.open(source) as image:
+            variants = []
+            for width in sorted(widths):
+                if width >= image.width:
+                    break
+                variant = f"{RESPONSIVE_DIR}/{stem}-{width}w{extension}"
+                target = os.path.join(root, *variant.split("/"))
+                if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                    resized = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+                    if extension.lower() == ".png":
+                        resized.save(target, optimize=True)
+                    else:
+                        resized.convert("RGB").save(target, quality=quality, progressive=True, optimize=True)
+                variants.append([width, variant])
+        if variants:
+            manifest[f"images/{name}"] = variants
+
+    with open(os.path.join(root, *RESPONSIVE_MANIFEST.split("/")), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the NaviBlu website with caching, compression and sendfile.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--root", default=ROOT, help="directory to serve")
+    parser.add_argument("--dev", action="store_true", help="revalidate every asset on every load and log requests")
+    parser.add_argument("--build-images", action="store_true", help="write responsive image copies to images/responsive and exit")
+    args = parser.parse_args()
+
+    if args.build_images:
+        manifest = build_images(args.root)
+        print(f"Wrote {sum(len(variants) for variants in manifest.values())} copies of {len(manifest)} images to {RESPONSIVE_DIR}/")
+        return
+    serve(args.host, args.port, args.root, max_age=0 if args.dev else MAX_AGE, log_requests=args.dev)
+
+
+if __name__ == "__main__":
+    main()